@@ -1,4 +1,4 @@
-import { useState } from 'react';
+import { useRef, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { Layout } from '../../components/layout/Layout';
 import { queriesApi } from '../../services/api';
@@ -9,6 +9,8 @@ export function CreateQueryPage() {
   const [queryText, setQueryText] = useState('');
   const [error, setError] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  // Повторная отправка того же текста (например, после таймаута) не создаст второй запрос
+  const idempotencyKey = useRef(crypto.randomUUID());
 
   const { user } = useAuth();
   const navigate = useNavigate();
@@ -30,7 +32,7 @@ export function CreateQueryPage() {
     setIsLoading(true);
 
     try {
-      const query = await queriesApi.create(user.project, queryText);
+      const query = await queriesApi.create(user.project, queryText, idempotencyKey.current);
       navigate(`/queries/${query.id}`);
     } catch (err: any) {
       setError(err.response?.data?.detail || 'Ошибка при создании запроса');
@@ -56,7 +58,10 @@ export function CreateQueryPage() {
                 id="query-text"
                 className="input"
                 value={queryText}
-                onChange={(e) => setQueryText(e.target.value)}
+                onChange={(e) => {
+                  setQueryText(e.target.value);
+                  idempotencyKey.current = crypto.randomUUID();
+                }}
                 rows={10}
                 placeholder="Опишите задачу для тестирования..."
                 required
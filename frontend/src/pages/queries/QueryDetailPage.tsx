@@ -12,6 +12,7 @@ export function QueryDetailPage() {
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState('');
   const [isDeleting, setIsDeleting] = useState(false);
+  const [isCancelling, setIsCancelling] = useState(false);
 
   const navigate = useNavigate();
 
@@ -23,7 +24,7 @@ export function QueryDetailPage() {
 
     // Set up polling for updates
     const interval = setInterval(() => {
-      if (query?.status !== 'done' && query?.status !== 'failed') {
+      if (query && canCancel(query.status)) {
         loadQuery();
         loadLogs();
       }
@@ -72,6 +73,7 @@ export function QueryDetailPage() {
       in_progress: 'В работе',
       done: 'Завершено',
       failed: 'Ошибка',
+      cancelled: 'Отменено',
     };
     return statusMap[status] || status;
   };
@@ -100,8 +102,31 @@ export function QueryDetailPage() {
     }
   };
 
+  const handleCancel = async () => {
+    if (!query || !id) return;
+
+    if (!confirm('Отменить выполнение запроса?')) {
+      return;
+    }
+
+    setIsCancelling(true);
+    try {
+      const data = await queriesApi.cancel(parseInt(id, 10));
+      setQuery(data);
+    } catch (err: any) {
+      const errorMsg = err.response?.data?.detail || 'Ошибка при отмене запроса';
+      alert(errorMsg);
+    } finally {
+      setIsCancelling(false);
+    }
+  };
+
+  const canCancel = (status: string) => {
+    return status === 'queued' || status === 'in_progress';
+  };
+
   const canDelete = (status: string) => {
-    return status === 'done' || status === 'failed';
+    return status === 'done' || status === 'failed' || status === 'cancelled';
   };
 
   if (isLoading) {
@@ -135,6 +160,15 @@ export function QueryDetailPage() {
           <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: '20px' }}>
             <h1>Запрос #{query.id}</h1>
             <div style={{ display: 'flex', gap: '10px' }}>
+              {canCancel(query.status) && (
+                <button
+                  className="btn btn-secondary"
+                  onClick={handleCancel}
+                  disabled={isCancelling}
+                >
+                  {isCancelling ? 'Отмена...' : 'Отменить'}
+                </button>
+              )}
               {canDelete(query.status) && (
                 <button
                   className="btn btn-danger"
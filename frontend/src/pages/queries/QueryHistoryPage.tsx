@@ -49,7 +49,7 @@ export function QueryHistoryPage() {
   };
 
   const canDelete = (status: string) => {
-    return status === 'done' || status === 'failed';
+    return status === 'done' || status === 'failed' || status === 'cancelled';
   };
 
   const getStatusBadgeClass = (status: string) => {
@@ -62,6 +62,7 @@ export function QueryHistoryPage() {
       in_progress: 'В работе',
       done: 'Завершено',
       failed: 'Ошибка',
+      cancelled: 'Отменено',
     };
     return statusMap[status] || status;
   };
@@ -95,11 +95,15 @@ export const queriesApi = {
     return response.data;
   },
 
-  create: async (projectId: number, queryText: string) => {
-    const response = await api.post('/queries/', {
-      project: projectId,
-      query_text: queryText,
-    });
+  create: async (projectId: number, queryText: string, idempotencyKey?: string) => {
+    const response = await api.post(
+      '/queries/',
+      {
+        project: projectId,
+        query_text: queryText,
+      },
+      idempotencyKey ? { headers: { 'Idempotency-Key': idempotencyKey } } : undefined
+    );
     return response.data;
   },
 
@@ -113,6 +117,11 @@ export const queriesApi = {
     return response.data;
   },
 
+  cancel: async (id: number) => {
+    const response = await api.post(`/queries/${id}/cancel/`);
+    return response.data;
+  },
+
   getLogs: async (id: number) => {
     const response = await api.get(`/queries/${id}/logs/`);
     return response.data.results || response.data; // Support paginated response
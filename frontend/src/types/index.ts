@@ -26,7 +26,7 @@ export interface Query {
   user_name?: string;
   query_text: string;
   answer_text: string;
-  status: 'queued' | 'in_progress' | 'done' | 'failed';
+  status: 'queued' | 'in_progress' | 'done' | 'failed' | 'cancelled';
   query_created: string;
   query_started: string | null;
   query_finished: string | null;
@@ -37,6 +37,10 @@ export interface QueryLog {
   project: number;
   query: number;
   log_data: string;
+  level: 'debug' | 'info' | 'warning' | 'error';
+  agent: string;
+  step: string;
+  payload: unknown | null;
   created: string;
 }
 
@@ -47,6 +51,10 @@ export interface TokenUsage {
   prompt_tokens: number;
   completion_tokens: number;
   total_tokens: number;
+  started_at?: string | null;
+  finished_at?: string | null;
+  duration_ms?: number | null;
+  time_to_first_token_ms?: number | null;
   created: string;
 }
 
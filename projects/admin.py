@@ -1,11 +1,14 @@
 from django.contrib import admin
+from queries.admin_utils import BulkDeleteAdminMixin
+from queries.deletion import delete_project
 from .models import Project
 
 
 @admin.register(Project)
-class ProjectAdmin(admin.ModelAdmin):
+class ProjectAdmin(BulkDeleteAdminMixin, admin.ModelAdmin):
     """
-    Admin interface for Project model
+    Admin interface for Project model.
+    Deletion removes the project's queries and logs in batches (queries.deletion)
     """
     list_display = ('project_name', 'test_it_project_id', 'jira_project_id', 'created_at', 'updated_at')
     list_filter = ('created_at', 'updated_at')
@@ -14,6 +17,12 @@ class ProjectAdmin(admin.ModelAdmin):
         ('Basic Information', {
             'fields': ('project_name', 'project_context')
         }),
+        ('Answer Cache', {
+            'fields': ('answer_cache_enabled', 'context_version')
+        }),
+        ('Token Budget', {
+            'fields': ('daily_token_budget', 'monthly_token_budget')
+        }),
         ('TestIt Integration', {
             'fields': ('test_it_token', 'test_it_project_id'),
             'classes': ('collapse',)
@@ -23,4 +32,8 @@ class ProjectAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
-    readonly_fields = ('created_at', 'updated_at')
\ No newline at end of file
+    readonly_fields = ('context_version', 'created_at', 'updated_at')
+
+    def bulk_delete(self, queryset):
+        for project in queryset:
+            delete_project(project)
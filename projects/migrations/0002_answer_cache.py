@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='answer_cache_enabled',
+            field=models.BooleanField(default=False, verbose_name='Answer Cache Enabled'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='context_version',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='Context Version'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0002_answer_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='daily_token_budget',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Daily Token Budget'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='monthly_token_budget',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Monthly Token Budget'),
+        ),
+    ]
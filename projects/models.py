@@ -11,6 +11,12 @@ class Project(models.Model):
     jira_token = models.CharField(max_length=128, blank=True, verbose_name='Jira Token')
     jira_project_id = models.CharField(max_length=128, blank=True, verbose_name='Jira Project ID')
     project_context = models.TextField(blank=True, verbose_name='Project Context')
+    answer_cache_enabled = models.BooleanField(default=False, verbose_name='Answer Cache Enabled')
+    # Увеличивается при каждом изменении проекта; входит в ключ кэша ответов
+    context_version = models.PositiveIntegerField(default=1, editable=False, verbose_name='Context Version')
+    # Лимиты расхода токенов (пусто - без лимита); расход считается в queries.ProjectTokenCounter
+    daily_token_budget = models.PositiveBigIntegerField(null=True, blank=True, verbose_name='Daily Token Budget')
+    monthly_token_budget = models.PositiveBigIntegerField(null=True, blank=True, verbose_name='Monthly Token Budget')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Updated At')
 
@@ -20,4 +26,16 @@ class Project(models.Model):
         verbose_name_plural = 'Projects'
 
     def __str__(self):
-        return self.project_name
\ No newline at end of file
+        return self.project_name
+
+    def has_token_budget(self):
+        return self.daily_token_budget is not None or self.monthly_token_budget is not None
+
+    def save(self, *args, **kwargs):
+        # Любое изменение проекта (контекст, интеграции) делает закешированные ответы неактуальными
+        if not self._state.adding:
+            self.context_version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'context_version'}
+        super().save(*args, **kwargs)
\ No newline at end of file
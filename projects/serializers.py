@@ -15,9 +15,13 @@ class ProjectSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'project_name', 'test_it_token', 'test_it_project_id',
             'jira_token', 'jira_project_id', 'project_context',
+            'answer_cache_enabled', 'context_version', 'daily_token_budget', 'monthly_token_budget',
+            'created_at', 'updated_at', 'test_it_token_masked', 'jira_token_masked'
+        ]
+        read_only_fields = [
+            'id', 'context_version', 'daily_token_budget', 'monthly_token_budget',
             'created_at', 'updated_at', 'test_it_token_masked', 'jira_token_masked'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'test_it_token_masked', 'jira_token_masked']
         extra_kwargs = {
             'test_it_token': {'write_only': True, 'required': False, 'allow_blank': True},
             'jira_token': {'write_only': True, 'required': False, 'allow_blank': True},
@@ -1,3 +1,66 @@
-from django.test import TestCase
+from webbuddy.testing import ApiTestCase
+from .models import Project
 
-# Create your tests here.
+
+class ProjectApiQueryBudgetTests(ApiTestCase):
+    """
+    Бюджеты SQL-запросов для эндпоинтов projects
+    """
+
+    project_fields = {'test_it_token': 'secret-token-1234'}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Project.objects.bulk_create([Project(project_name=f'Project {i}') for i in range(10)])
+
+    def test_list(self):
+        with self.assertQueryBudget(3, 'GET /api/projects/'):
+            response = self.service_client.get('/api/projects/')
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryCountIndependentOf(
+            lambda: self.service_client.get('/api/projects/'),
+            lambda: Project.objects.bulk_create([Project(project_name=f'Extra {i}') for i in range(20)]),
+            'GET /api/projects/'
+        )
+
+    def test_retrieve(self):
+        with self.assertQueryBudget(2, 'GET /api/projects/{id}/'):
+            response = self.client.get(f'/api/projects/{self.project.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['test_it_token_masked'], '*' * 13 + '1234')
+
+    def test_my_project(self):
+        with self.assertQueryBudget(2, 'GET /api/projects/my_project/'):
+            response = self.client.get('/api/projects/my_project/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_my_project_tokens(self):
+        with self.assertQueryBudget(2, 'GET /api/projects/my_project_tokens/'):
+            response = self.client.get('/api/projects/my_project_tokens/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_project_tokens(self):
+        with self.assertQueryBudget(2, 'GET /api/projects/{id}/tokens/'):
+            response = self.service_client.get(f'/api/projects/{self.project.id}/tokens/')
+        self.assertEqual(response.data['test_it_token'], 'secret-token-1234')
+
+    def test_partial_update(self):
+        with self.assertQueryBudget(3, 'PATCH /api/projects/{id}/'):
+            response = self.client.patch(
+                f'/api/projects/{self.project.id}/', {'project_context': 'New context'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_create(self):
+        with self.assertQueryBudget(2, 'POST /api/projects/'):
+            response = self.service_client.post('/api/projects/', {'project_name': 'Gamma'}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_destroy(self):
+        project = Project.objects.create(project_name='Disposable')
+        # Выборка id запросов, затем каскад по небольшим таблицам
+        # (пользователи, кэш ответов, счетчики бюджета токенов) в транзакции
+        with self.assertQueryBudget(14, 'DELETE /api/projects/{id}/'):
+            response = self.service_client.delete(f'/api/projects/{project.id}/')
+        self.assertEqual(response.status_code, 204)
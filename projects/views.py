@@ -1,6 +1,8 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
+from queries.deletion import delete_project
 from .models import Project
 from .serializers import ProjectSerializer
 
@@ -101,26 +103,19 @@ class ProjectViewSet(viewsets.ModelViewSet):
             "updated_at": project.updated_at,
         })
 
-    def update(self, request, *args, **kwargs):
+    def perform_update(self, serializer):
         """
-        Обновление проекта (только если это проект пользователя или есть cross-project доступ)
+        Обновление проекта (только если это проект пользователя или есть cross-project доступ).
+        Проверка выполняется на уже загруженном объекте, без повторного get_object()
         """
-        instance = self.get_object()
-        if not request.user.has_cross_project_access() and instance.id != request.user.project_id:
-            return Response(
-                {"detail": "You don't have permission to edit this project"},
-                status=status.HTTP_403_FORBIDDEN
-            )
-        return super().update(request, *args, **kwargs)
+        user = self.request.user
+        if not user.has_cross_project_access() and serializer.instance.id != user.project_id:
+            raise PermissionDenied("You don't have permission to edit this project")
+        serializer.save()
 
-    def partial_update(self, request, *args, **kwargs):
+    def perform_destroy(self, instance):
         """
-        Частичное обновление проекта (только если это проект пользователя или есть cross-project доступ)
+        Удаление проекта: запросы и логи удаляются пачками (queries.deletion),
+        без загрузки всех запросов проекта в память сборщиком каскада
         """
-        instance = self.get_object()
-        if not request.user.has_cross_project_access() and instance.id != request.user.project_id:
-            return Response(
-                {"detail": "You don't have permission to edit this project"},
-                status=status.HTTP_403_FORBIDDEN
-            )
-        return super().partial_update(request, *args, **kwargs)
\ No newline at end of file
+        delete_project(instance)
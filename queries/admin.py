@@ -1,66 +1,163 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Query, QueryLog, TokenUsageLog
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
+from .admin_utils import BulkDeleteAdminMixin, IdInputFilter, LargeTableAdmin, input_filter
+from .deletion import delete_queries
+from .models import (
+    AnswerCacheEntry, IdempotencyKey, ProjectTokenCounter, Query, QueryLog, TokenLatencyBucket, TokenUsageLog
+)
+from .search import get_backend
 
+# Maximum number of full-text matches shown in admin change lists
+ADMIN_SEARCH_LIMIT = 1000
 
-class QueryLogInline(admin.TabularInline):
-    """
-    Inline admin for QueryLog
-    """
-    model = QueryLog
-    extra = 0
-    readonly_fields = ('create_dtime',)
-    can_delete = False
+ProjectFilter = input_filter('project_id', 'project', IdInputFilter)
+UserFilter = input_filter('user_id', 'user', IdInputFilter)
+QueryFilter = input_filter('query_id', 'query', IdInputFilter)
+
+
+def _query_link(obj):
+    url = reverse('admin:queries_query_change', args=[obj.query_id])
+    return format_html('<a href="{}">#{}</a>', url, obj.query_id)
 
 
 @admin.register(Query)
-class QueryAdmin(admin.ModelAdmin):
+class QueryAdmin(BulkDeleteAdminMixin, LargeTableAdmin):
     """
-    Admin interface for Query model
+    Admin interface for Query model.
+    Logs are shown as a bounded read-only preview with a link to the paginated log list;
+    deletion removes logs in batches (queries.deletion)
     """
     list_display = ('id', 'project', 'user', 'status', 'query_created', 'query_finished')
-    list_filter = ('status', 'project', 'query_created')
+    list_filter = ('status', ProjectFilter, UserFilter, 'query_created')
+    list_select_related = ('project', 'user')
     search_fields = ('query_text', 'answer_text', 'user__username')
-    readonly_fields = ('query_created', 'query_finished')
-    inlines = [QueryLogInline]
+    autocomplete_fields = ('project', 'user')
+    raw_id_fields = ('cached_from',)
+    readonly_fields = ('query_created', 'query_started', 'query_finished', 'logs_preview')
+    changelist_defer_fields = ('query_text', 'answer_text')
+
+    def bulk_delete(self, queryset):
+        delete_queries(queryset)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search through the full-text index instead of icontains table scans.
+        A numeric term matches the query id, any term matches an exact username
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(id=int(search_term)), False
+        ids = [pk for pk, _ in get_backend().search_queries(search_term, limit=ADMIN_SEARCH_LIMIT)]
+        return queryset.filter(Q(id__in=ids) | Q(user__username=search_term)), False
+
+    def logs_preview(self, obj):
+        """Latest ADMIN_QUERY_LOGS_PREVIEW logs and a link to all of them"""
+        if obj.pk is None:
+            return '-'
+        limit = settings.ADMIN_QUERY_LOGS_PREVIEW
+        logs = list(obj.logs.order_by('-id').values_list('create_dtime', 'log_data')[:limit])
+        url = reverse('admin:queries_querylog_changelist') + f'?query_id={obj.pk}'
+        rows = format_html_join(
+            '', '<tr><td style="white-space: nowrap">{}</td><td>{}</td></tr>',
+            ((created.strftime('%Y-%m-%d %H:%M:%S'), text[:500]) for created, text in reversed(logs))
+        )
+        caption = f'Latest {limit} logs' if len(logs) == limit else 'Logs'
+        return format_html('<p>{} (<a href="{}">all logs</a>)</p><table>{}</table>', caption, url, rows)
+
+    logs_preview.short_description = 'Logs'
 
     fieldsets = (
         ('Query Information', {
             'fields': ('project', 'user', 'query_text', 'status')
         }),
         ('Response', {
-            'fields': ('answer_text',)
+            'fields': ('answer_text', 'cached_from')
         }),
         ('Timestamps', {
-            'fields': ('query_created', 'query_finished')
+            'fields': ('query_created', 'query_started', 'query_finished')
+        }),
+        ('Logs', {
+            'fields': ('logs_preview',)
         }),
     )
 
 
 @admin.register(QueryLog)
-class QueryLogAdmin(admin.ModelAdmin):
+class QueryLogAdmin(LargeTableAdmin):
     """
     Admin interface for QueryLog model
     """
-    list_display = ('query', 'project', 'create_dtime', 'log_data_preview')
-    list_filter = ('project', 'create_dtime')
+    list_display = ('id', 'query_link', 'project', 'level', 'agent', 'step', 'create_dtime', 'log_data_preview')
+    list_filter = (QueryFilter, ProjectFilter, 'level', 'create_dtime')
+    list_select_related = ('project',)
     search_fields = ('log_data', 'query__id')
+    autocomplete_fields = ('project',)
+    raw_id_fields = ('query',)
     readonly_fields = ('create_dtime',)
 
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search through the full-text index; a numeric term matches the query id
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(query_id=int(search_term)), False
+        ids = [pk for pk, _ in get_backend().search_log_ids(search_term, limit=ADMIN_SEARCH_LIMIT)]
+        return queryset.filter(id__in=ids), False
+
     def log_data_preview(self, obj):
         return obj.log_data[:100] + '...' if len(obj.log_data) > 100 else obj.log_data
 
     log_data_preview.short_description = 'Log Preview'
 
+    def query_link(self, obj):
+        return _query_link(obj)
+
+    query_link.short_description = 'Query'
+
 
 @admin.register(TokenUsageLog)
-class TokenUsageLogAdmin(admin.ModelAdmin):
+class TokenUsageLogAdmin(LargeTableAdmin):
     """
-    Admin interface for TokenUsageLog model
+    Admin interface for TokenUsageLog model.
+    Prompts and agent answers are not loaded on the change list
     """
-    list_display = ('ai_agent_name', 'project', 'query', 'model_name', 'total_tokens', 'datetime')
-    list_filter = ('ai_agent_name', 'model_name', 'project', 'datetime')
+    list_display = ('ai_agent_name', 'project', 'query_link', 'model_name', 'total_tokens', 'duration_ms', 'datetime')
+    list_filter = (
+        input_filter('ai_agent_name', 'agent'), input_filter('model_name', 'model'),
+        ProjectFilter, QueryFilter, 'datetime'
+    )
+    list_select_related = ('project',)
     search_fields = ('ai_agent_name', 'model_name', 'query__id')
+    autocomplete_fields = ('project',)
+    raw_id_fields = ('query',)
     readonly_fields = ('datetime',)
+    changelist_defer_fields = (
+        'request_to_ai_agent', 'ai_agent_answer', 'system_prompt', 'user_prompt', 'agent_prompt'
+    )
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Exact agent or model name, or a numeric query id (no icontains scans)
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(query_id=int(search_term)), False
+        return queryset.filter(Q(ai_agent_name=search_term) | Q(model_name=search_term)), False
+
+    def query_link(self, obj):
+        return _query_link(obj)
+
+    query_link.short_description = 'Query'
 
     fieldsets = (
         ('Agent Information', {
@@ -73,6 +170,9 @@ class TokenUsageLogAdmin(admin.ModelAdmin):
             'fields': ('prompt_tokens', 'completion_tokens', 'total_tokens',
                       'precached_prompt_tokens', 'input_tokens', 'output_tokens')
         }),
+        ('Latency', {
+            'fields': ('started_at', 'finished_at', 'duration_ms', 'time_to_first_token_ms')
+        }),
         ('Prompts', {
             'fields': ('system_prompt', 'user_prompt', 'agent_prompt'),
             'classes': ('collapse',)
@@ -80,4 +180,77 @@ class TokenUsageLogAdmin(admin.ModelAdmin):
         ('Timestamp', {
             'fields': ('datetime',)
         }),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(AnswerCacheEntry)
+class AnswerCacheEntryAdmin(LargeTableAdmin):
+    """
+    Admin interface for AnswerCacheEntry model (read-only; entries are written by the answer cache)
+    """
+    list_display = ('project', 'normalized_text_preview', 'context_version', 'hits', 'created_at', 'last_used_at')
+    list_filter = (ProjectFilter,)
+    list_select_related = ('project',)
+    search_fields = ('normalized_text',)
+    raw_id_fields = ('query',)
+    changelist_defer_fields = ('answer_text',)
+    readonly_fields = (
+        'project', 'context_version', 'text_hash', 'normalized_text', 'answer_text',
+        'query', 'hits', 'created_at', 'last_used_at'
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def normalized_text_preview(self, obj):
+        return obj.normalized_text[:100] + '...' if len(obj.normalized_text) > 100 else obj.normalized_text
+
+    normalized_text_preview.short_description = 'Query Text'
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(LargeTableAdmin):
+    """
+    Admin interface for IdempotencyKey model (read-only; keys are written by idempotent endpoints)
+    """
+    list_display = ('key', 'endpoint', 'user', 'status_code', 'created_at')
+    list_filter = ('endpoint', UserFilter)
+    list_select_related = ('user',)
+    search_fields = ('key',)
+    changelist_defer_fields = ('response',)
+    readonly_fields = ('user', 'endpoint', 'key', 'request_hash', 'status_code', 'response', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ProjectTokenCounter)
+class ProjectTokenCounterAdmin(LargeTableAdmin):
+    """
+    Admin interface for ProjectTokenCounter model (read-only; counters are written with token usage
+    and recomputed by reconcile_token_counters)
+    """
+    list_display = ('project', 'period', 'period_start', 'tokens')
+    list_filter = ('period', ProjectFilter)
+    list_select_related = ('project',)
+    readonly_fields = ('project', 'period', 'period_start', 'tokens')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(TokenLatencyBucket)
+class TokenLatencyBucketAdmin(LargeTableAdmin):
+    """
+    Admin interface for TokenLatencyBucket model (read-only; histograms are written with token usage
+    and recomputed by rebuild_token_latency)
+    """
+    list_display = ('hour', 'project', 'model_name', 'ai_agent_name', 'metric', 'bucket', 'calls', 'total_ms')
+    list_filter = ('metric', input_filter('model_name', 'model'), input_filter('ai_agent_name', 'agent'), ProjectFilter)
+    list_select_related = ('project',)
+    readonly_fields = (
+        'project', 'hour', 'model_name', 'ai_agent_name', 'metric', 'bucket', 'calls', 'total_ms', 'output_tokens'
+    )
+
+    def has_add_permission(self, request):
+        return False
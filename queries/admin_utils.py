@@ -0,0 +1,151 @@
+"""
+Admin helpers for tables that grow to millions of rows
+"""
+from django.conf import settings
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from webbuddy.db_router import replica_reads
+
+
+def estimate_row_count(model, using='default'):
+    """
+    Cheap row count estimate for a whole table, or None if the backend has none.
+    PostgreSQL: planner statistics (pg_class.reltuples); SQLite: MAX(rowid)
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    # reltuples is -1 for a table that has never been analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs an unbounded COUNT(*).
+    Unfiltered lists of tables above ADMIN_EXACT_COUNT_LIMIT rows use the estimate
+    from estimate_row_count(); other lists count at most ADMIN_EXACT_COUNT_LIMIT + 1 rows
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit + 1].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Base ModelAdmin for large tables: estimated counts, no second full COUNT(*)
+    for filtered lists, heavy text columns deferred on the change list
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    # Columns not shown on the change list and too large to load for every row
+    changelist_defer_fields = ()
+
+    def changelist_view(self, request, extra_context=None):
+        # Change list (GET) reads from a replica if one is configured; the template is rendered
+        # inside the block so that lazily evaluated querysets also go to the replica
+        with replica_reads(request):
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        match = request.resolver_match
+        if self.changelist_defer_fields and match is not None and match.url_name.endswith('_changelist'):
+            queryset = queryset.defer(*self.changelist_defer_fields)
+        return queryset
+
+
+class BulkDeleteAdminMixin:
+    """
+    Deletion through queries.deletion instead of Django's cascade collector.
+    The confirmation page lists only the selected objects: collecting every related
+    log just to render it would load the rows the bulk path avoids loading
+    """
+
+    def bulk_delete(self, queryset):
+        raise NotImplementedError
+
+    def get_deleted_objects(self, objs, request):
+        objs = list(objs)
+        perms_needed = set() if self.has_delete_permission(request) else {self.opts.verbose_name}
+        return [str(obj) for obj in objs], {self.opts.verbose_name_plural: len(objs)}, perms_needed, []
+
+    def delete_model(self, request, obj):
+        self.bulk_delete(type(obj).objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        self.bulk_delete(queryset)
+
+
+class InputFilter(admin.SimpleListFilter):
+    """
+    Exact-match list filter rendered as a text input, instead of a choice list
+    built from the whole related table (or from SELECT DISTINCT over this one)
+    """
+    template = 'admin/input_filter.html'
+    placeholder = ''
+
+    def lookups(self, request, model_admin):
+        # Non-empty so that the filter is displayed
+        return (('', ''),)
+
+    def clean_value(self, value):
+        return value.strip() or None
+
+    def queryset(self, request, queryset):
+        value = self.clean_value(self.value() or '')
+        if value is None:
+            return queryset
+        return queryset.filter(**{self.parameter_name: value})
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'hidden_params': [
+                (name, value) for name, value in changelist.params.items()
+                if name not in (self.parameter_name, 'p')
+            ],
+        }
+
+
+class IdInputFilter(InputFilter):
+    """InputFilter for a foreign key id"""
+    placeholder = 'ID'
+
+    def clean_value(self, value):
+        value = value.strip()
+        return int(value) if value.isdigit() else None
+
+
+def input_filter(field_name, title, base=InputFilter):
+    """
+    Build an input filter class, e.g. input_filter('model_name', 'model')
+    or input_filter('project_id', 'project', IdInputFilter)
+    """
+    return type(f'{field_name.title().replace("_", "")}InputFilter', (base,), {
+        'parameter_name': field_name,
+        'title': title,
+    })
@@ -0,0 +1,170 @@
+"""
+Admission control для создания запросов.
+
+Когда воркеры не успевают, очередь растет без ограничений, а пользователи
+повторно отправляют запросы. Здесь ограничивается число активных запросов
+(queued + in_progress) глобально и на проект. Выше лимита создание
+возвращает 429 с оценкой Retry-After.
+
+Глубина очереди не считается через COUNT(*) на каждый create: снимок
+берется одним сгруппированным запросом не чаще раза в
+QUERY_ADMISSION_REFRESH_SECONDS секунд и между обновлениями
+поддерживается локальными инкрементами. Снимок обновляет один поток:
+остальные в это время пользуются предыдущим снимком.
+"""
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+
+from .models import Query
+
+ACTIVE_STATUSES = ('queued', 'in_progress')
+
+# Защищает счетчики снимков: note_admitted меняет их из потоков обработки запросов
+_lock = threading.Lock()
+# Не дает нескольким потокам одновременно обновлять снимок
+_refresh_lock = threading.Lock()
+_snapshot = None
+
+
+class QueueSnapshot:
+    """
+    Снимок глубины очереди: число активных запросов по (project_id, status)
+    и скорость завершения запросов (в секунду) за последнее окно.
+    Счетчики читаются и меняются только под _lock
+    """
+    def __init__(self, counts, finish_rate, taken_at):
+        self._counts = dict(counts)
+        self._project_totals = {}
+        for (project_id, _), n in self._counts.items():
+            self._project_totals[project_id] = self._project_totals.get(project_id, 0) + n
+        self._total = sum(self._counts.values())
+        self.finish_rate = finish_rate
+        self.taken_at = taken_at
+
+    def items(self):
+        """Копия счетчиков: [((project_id, status), число), ...]"""
+        with _lock:
+            return list(self._counts.items())
+
+    def total(self):
+        with _lock:
+            return self._total
+
+    def for_project(self, project_id):
+        with _lock:
+            return self._project_totals.get(project_id, 0)
+
+    def _add(self, project_id, status, count):
+        # Вызывается под _lock
+        key = (project_id, status)
+        self._counts[key] = self._counts.get(key, 0) + count
+        self._project_totals[project_id] = self._project_totals.get(project_id, 0) + count
+        self._total += count
+
+
+def _take_snapshot():
+    rows = Query.objects.filter(status__in=ACTIVE_STATUSES).values(
+        'project_id', 'status'
+    ).annotate(n=Count('id')).order_by()
+    counts = {(row['project_id'], row['status']): row['n'] for row in rows}
+
+    window = settings.QUERY_ADMISSION_RATE_WINDOW_SECONDS
+    finished = Query.objects.filter(
+        query_finished__gte=timezone.now() - timedelta(seconds=window)
+    ).count()
+    return QueueSnapshot(counts, finished / window, time.monotonic())
+
+
+def _is_stale(snapshot):
+    return time.monotonic() - snapshot.taken_at >= settings.QUERY_ADMISSION_REFRESH_SECONDS
+
+
+def get_queue_snapshot():
+    """
+    Вернуть текущий снимок очереди, обновив его при устаревании
+    """
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is not None and not _is_stale(snapshot):
+        return snapshot
+    # Без снимка ждем обновления другим потоком; с устаревшим снимком - не ждем
+    if not _refresh_lock.acquire(blocking=snapshot is None):
+        return snapshot
+    try:
+        snapshot = _snapshot
+        if snapshot is None or _is_stale(snapshot):
+            snapshot = _take_snapshot()
+            with _lock:
+                _snapshot = snapshot
+        return snapshot
+    finally:
+        _refresh_lock.release()
+
+
+def invalidate_queue_snapshot():
+    global _snapshot
+    with _lock:
+        _snapshot = None
+
+
+def note_admitted(project_id, count=1):
+    """
+    Учесть только что созданные запросы в снимке до его следующего обновления
+    """
+    with _lock:
+        if _snapshot is not None:
+            _snapshot._add(project_id, 'queued', count)
+
+
+def _retry_after(excess, finish_rate):
+    if finish_rate > 0:
+        wait = math.ceil(excess / finish_rate)
+    else:
+        wait = settings.QUERY_ADMISSION_DEFAULT_RETRY_AFTER
+    return max(1, min(wait, settings.QUERY_ADMISSION_MAX_RETRY_AFTER))
+
+
+def check_admission(project_id, count=1):
+    """
+    Проверить, можно ли поставить в очередь count новых запросов проекта.
+    Выбрасывает Throttled (429 + Retry-After), если лимит превышен
+    """
+    check_admission_many({project_id: count})
+
+
+def check_admission_many(counts):
+    """
+    Проверить пакет новых запросов: counts - {project_id: число запросов}.
+    Лимит проекта проверяется для каждого проекта, глобальный - для всего пакета
+    """
+    global_limit = settings.QUERY_ADMISSION_GLOBAL_LIMIT
+    project_limit = settings.QUERY_ADMISSION_PROJECT_LIMIT
+    if not global_limit and not project_limit:
+        return
+
+    snapshot = get_queue_snapshot()
+
+    if project_limit:
+        for project_id, count in counts.items():
+            depth = snapshot.for_project(project_id)
+            if depth + count > project_limit:
+                raise Throttled(
+                    wait=_retry_after(depth + count - project_limit, snapshot.finish_rate),
+                    detail=f"Очередь проекта переполнена ({depth} активных запросов, лимит {project_limit}). Повторите позже."
+                )
+
+    if global_limit:
+        depth = snapshot.total()
+        count = sum(counts.values())
+        if depth + count > global_limit:
+            raise Throttled(
+                wait=_retry_after(depth + count - global_limit, snapshot.finish_rate),
+                detail=f"Очередь переполнена ({depth} активных запросов, лимит {global_limit}). Повторите позже."
+            )
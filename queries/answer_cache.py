@@ -0,0 +1,141 @@
+"""
+Кэш ответов по проекту.
+
+Повторный запрос с тем же нормализованным текстом в том же проекте получает
+готовый ответ сразу при создании, без постановки в очередь и запуска агентов.
+Ключ кэша - (проект, версия контекста проекта, хэш нормализованного текста).
+Версия контекста увеличивается при любом изменении Project, поэтому ответы,
+полученные со старым контекстом или старыми интеграциями, перестают находиться
+без отдельного сброса. Устаревшие записи и записи сверх
+ANSWER_CACHE_MAX_ENTRIES удаляются при записи в кэш и командой prune_answer_cache.
+
+Кэш включается для проекта флагом Project.answer_cache_enabled.
+"""
+import hashlib
+import re
+import unicodedata
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metrics
+from .models import AnswerCacheEntry, AnswerCacheStats, Query
+
+_WHITESPACE = re.compile(r'\s+')
+_EDGE_PUNCTUATION = ' \t\n.,;:!?…"\'«»'
+
+
+def normalize_text(text):
+    """
+    Нормализация текста запроса: регистр, пробелы, кавычки и знаки препинания по краям.
+    "Протестировать  авторизацию!" и "протестировать авторизацию" дают один ключ
+    """
+    text = unicodedata.normalize('NFKC', text).casefold().replace('ё', 'е')
+    return _WHITESPACE.sub(' ', text).strip(_EDGE_PUNCTUATION)
+
+
+def text_hash(normalized_text):
+    return hashlib.sha256(normalized_text.encode('utf-8')).hexdigest()
+
+
+def _expiry_threshold():
+    return timezone.now() - timedelta(seconds=settings.ANSWER_CACHE_TTL_SECONDS)
+
+
+def _count(project_id, hit):
+    field = 'hits' if hit else 'misses'
+    metrics.answer_cache_lookups.inc(result='hit' if hit else 'miss')
+    updated = AnswerCacheStats.objects.filter(project_id=project_id).update(**{field: F(field) + 1})
+    if not updated:
+        try:
+            with transaction.atomic():
+                AnswerCacheStats.objects.create(project_id=project_id, **{field: 1})
+        except IntegrityError:
+            AnswerCacheStats.objects.filter(project_id=project_id).update(**{field: F(field) + 1})
+
+
+def lookup(project, query_text):
+    """Свежая запись кэша для текста запроса или None (учитывается как промах)"""
+    if not project.answer_cache_enabled:
+        return None
+    entry = AnswerCacheEntry.objects.filter(
+        project=project,
+        context_version=project.context_version,
+        text_hash=text_hash(normalize_text(query_text)),
+        created_at__gte=_expiry_threshold(),
+    ).first()
+    _count(project.id, entry is not None)
+    return entry
+
+
+def create_from_cache(entry, project, user, query_text):
+    """Создать сразу завершенный запрос с ответом из кэша"""
+    now = timezone.now()
+    AnswerCacheEntry.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used_at=now)
+    query = Query.objects.create(
+        project=project,
+        user=user,
+        query_text=query_text,
+        answer_text=entry.answer_text,
+        status='done',
+        query_started=now,
+        query_finished=now,
+        cached_from_id=entry.query_id,
+    )
+    # У нового запроса логов нет - сериализатору не нужен COUNT
+    query.annotated_logs_count = 0
+    return query
+
+
+def store(query):
+    """
+    Сохранить ответ завершенного запроса в кэш проекта.
+    Ответ не кэшируется, если проект изменился после создания запроса:
+    он мог быть получен со старым контекстом
+    """
+    project = query.project
+    if not project.answer_cache_enabled or not query.answer_text or query.cached_from_id:
+        return None
+    if project.updated_at > query.query_created:
+        return None
+
+    normalized = normalize_text(query.query_text)
+    now = timezone.now()
+    entry, _ = AnswerCacheEntry.objects.update_or_create(
+        project=project,
+        context_version=project.context_version,
+        text_hash=text_hash(normalized),
+        defaults={
+            'normalized_text': normalized,
+            'answer_text': query.answer_text,
+            'query': query,
+            'created_at': now,
+            'last_used_at': now,
+        },
+    )
+    evict(project)
+    return entry
+
+
+def evict(project):
+    """Удалить записи проекта со старой версией контекста, истекшие и сверх лимита (давно не использованные)"""
+    entries = AnswerCacheEntry.objects.filter(project=project)
+    entries.filter(
+        Q(context_version__lt=project.context_version) | Q(created_at__lt=_expiry_threshold())
+    ).delete()
+    overflow = entries.order_by('-last_used_at').values_list('id', flat=True)[settings.ANSWER_CACHE_MAX_ENTRIES:]
+    overflow_ids = list(overflow)
+    if overflow_ids:
+        AnswerCacheEntry.objects.filter(id__in=overflow_ids).delete()
+
+
+def prune():
+    """Удалить все устаревшие записи (для периодического запуска); возвращает число удаленных"""
+    stale = AnswerCacheEntry.objects.filter(
+        Q(context_version__lt=F('project__context_version')) | Q(created_at__lt=_expiry_threshold())
+    )
+    deleted, _ = stale.delete()
+    return deleted
@@ -0,0 +1,51 @@
+"""
+Потоковая публикация ответа частями.
+
+Агент дописывает ответ по мере генерации (POST /api/queries/{id}/answer/):
+каждая часть - отдельная строка AnswerChunk, строка Query не перезаписывается,
+поэтому стоимость записи не растет с длиной ответа. Наблюдатели забирают только
+новые части по курсору ?after=<id последней полученной части>.
+
+- Пока запрос выполняется (или после отмены), answer_text при чтении собирается из частей.
+- При завершении запроса без явного answer_text ответ собирается из частей; части
+  сохраняются в answer_text одной транзакцией с завершением и удаляются.
+"""
+from django.conf import settings
+
+from .models import AnswerChunk
+
+
+def append(query, text):
+    """Дописать часть ответа запроса; возвращает созданную часть"""
+    return AnswerChunk.objects.create(query_id=query.pk, text=text)
+
+
+def read(query_id, after=0, limit=None):
+    """Части ответа после части с id after (не больше limit, по умолчанию ANSWER_CHUNKS_PAGE_SIZE)"""
+    limit = limit or settings.ANSWER_CHUNKS_PAGE_SIZE
+    return list(
+        AnswerChunk.objects.filter(query_id=query_id, id__gt=after).order_by('id').values('id', 'text')[:limit]
+    )
+
+
+def assemble(query_id):
+    """Ответ, собранный из частей ('' - частей нет)"""
+    return ''.join(AnswerChunk.objects.filter(query_id=query_id).order_by('id').values_list('text', flat=True))
+
+
+def collapse(query_id):
+    """
+    Собрать ответ из частей и удалить их; вызывается в транзакции завершения запроса.
+    Без частей выполняется один SELECT
+    """
+    rows = list(AnswerChunk.objects.filter(query_id=query_id).order_by('id').values_list('id', 'text'))
+    if rows:
+        AnswerChunk.objects.filter(query_id=query_id, id__lte=rows[-1][0]).delete()
+    return ''.join(text for _, text in rows)
+
+
+def answer_text(query):
+    """answer_text для чтения: у незавершенного или отмененного запроса - из частей"""
+    if query.answer_text or query.status not in ('in_progress', 'cancelled'):
+        return query.answer_text
+    return assemble(query.pk)
@@ -0,0 +1,266 @@
+"""
+Async-представления для долгоживущих и массовых эндпоинтов.
+
+При запуске под ASGI (см. WORKER_SERVICE.md, "Развертывание под ASGI")
+ожидающее соединение стоит одну корутину, а не поток WSGI:
+
+- POST /api/queries/claim_next/wait/  - long-poll claim_next
+- GET  /api/queries/{id}/logs/stream/ - поток новых логов (Server-Sent Events)
+- POST /api/logs/bulk/                - пакетная запись логов
+
+Аутентификация та же, что у DRF (JWT, API-ключ), ответы - JSON в формате DRF.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from users.authentication import authenticate_request
+from webbuddy.database import release_pooled_connection
+from . import events, idempotency
+from .models import Query, QueryLog
+from .serializers import QueryLogSerializer, QuerySerializer
+from .services import claim_next_query, filter_logs, scope_to_user
+
+LOG_LEVELS = [value for value, _ in QueryLog.LEVEL_CHOICES]
+
+
+def _json_response(data, status=200):
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False,
+                        json_dumps_params={'ensure_ascii': False})
+
+
+async def _authenticate(request):
+    return await sync_to_async(authenticate_request)(request)
+
+
+def _unauthorized():
+    return _json_response({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+
+async def _wait(event, timeout):
+    """
+    Дождаться события или таймаута; событие сбрасывается перед ожиданием.
+    Соединение из пула БД на время ожидания возвращается в пул
+    """
+    event.clear()
+    await sync_to_async(release_pooled_connection)()
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+@csrf_exempt
+@require_POST
+async def claim_next_wait(request):
+    """
+    Long-poll версия claim_next.
+    Ждет появления запроса в очереди до ?timeout= секунд (не больше QUERY_LONGPOLL_MAX_WAIT)
+    Возвращает запрос (200) или 404, если за это время очередь осталась пустой
+    """
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+
+    try:
+        timeout = float(request.GET.get('timeout', settings.QUERY_LONGPOLL_MAX_WAIT))
+    except ValueError:
+        return _json_response({'detail': 'timeout must be a number'}, status=400)
+    timeout = max(0.0, min(timeout, settings.QUERY_LONGPOLL_MAX_WAIT))
+
+    queryset = scope_to_user(Query.objects.select_related('user', 'project'), user)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    event = events.query_queued.register()
+    try:
+        while True:
+            query = await sync_to_async(claim_next_query)(queryset)
+            if query is not None:
+                data = await sync_to_async(lambda: QuerySerializer(query).data)()
+                return _json_response(data)
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return _json_response({'detail': 'No queued queries available'}, status=404)
+            await _wait(event, min(remaining, settings.QUERY_LONGPOLL_INTERVAL))
+    finally:
+        events.query_queued.unregister(event)
+
+
+def _sse(event_id, event_type, data):
+    payload = json.dumps(data, cls=JSONEncoder, ensure_ascii=False)
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append(f'data: {payload}')
+    return '\n'.join(lines) + '\n\n'
+
+
+@require_GET
+async def query_log_stream(request, pk):
+    """
+    Поток новых логов запроса в формате Server-Sent Events.
+    Продолжение после обрыва - по заголовку Last-Event-ID или ?after=<id лога>.
+    Фильтры ?level=, ?agent=, ?step= - как у GET /api/queries/{id}/logs/.
+    Поток закрывается событием 'end', когда запрос завершен и новых логов нет
+    """
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+
+    if not await scope_to_user(Query.objects.filter(pk=pk), user).aexists():
+        return _json_response({'detail': 'No Query matches the given query.'}, status=404)
+
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.GET.get('after') or 0)
+    except ValueError:
+        last_id = 0
+
+    try:
+        logs_queryset = filter_logs(QueryLog.objects.filter(query_id=pk), request.GET)
+    except ValidationError as e:
+        return _json_response(e.detail, status=400)
+
+    async def stream():
+        nonlocal last_id
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.QUERY_STREAM_MAX_SECONDS
+        event = events.log_written.register()
+        try:
+            while True:
+                logs = [
+                    log async for log in logs_queryset.filter(
+                        id__gt=last_id
+                    ).order_by('id')[:settings.QUERY_STREAM_BATCH_SIZE]
+                ]
+                for log in logs:
+                    last_id = log.id
+                    yield _sse(log.id, 'log', QueryLogSerializer(log).data)
+                if logs:
+                    continue
+
+                query_status = await Query.objects.filter(pk=pk).values_list('status', flat=True).afirst()
+                if query_status is None or query_status in Query.FINISHED_STATUSES:
+                    yield _sse(None, 'end', {'status': query_status})
+                    return
+                if loop.time() >= deadline:
+                    return
+
+                # Комментарий-keepalive не дает прокси закрыть простаивающее соединение
+                yield ': keepalive\n\n'
+                await _wait(event, settings.QUERY_LONGPOLL_INTERVAL)
+        finally:
+            events.log_written.unregister(event)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def query_logs_bulk_create(request):
+    """
+    Пакетное создание логов одним INSERT.
+    Тело: список объектов {query, log_data[, project, level, agent, step, payload]} или {"logs": [...]}.
+    project можно не передавать - он берется из запроса.
+    В ответе cancelled_queries - отмененные запросы из пачки: воркеру пора остановиться.
+    Повтор пачки с тем же заголовком Idempotency-Key не создает логи второй раз
+    """
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+
+    try:
+        payload = json.loads(request.body or b'null')
+    except ValueError:
+        return _json_response({'detail': 'JSON parse error'}, status=400)
+
+    key = request.headers.get(idempotency.HEADER)
+    if key is None:
+        data, status_code = await _bulk_create_logs(user, payload)
+        return _json_response(data, status=status_code)
+    error = idempotency.validate_key(key)
+    if error:
+        return _json_response({'detail': error}, status=400)
+
+    record, replay = await sync_to_async(idempotency.begin)(
+        user, 'logs.bulk', key, idempotency.request_hash(payload)
+    )
+    if replay is not None:
+        response = _json_response(replay.data, status=replay.status_code)
+        for name, value in replay.headers.items():
+            response[name] = value
+        return response
+    try:
+        data, status_code = await _bulk_create_logs(user, payload)
+    except BaseException:
+        await sync_to_async(idempotency.release)(record)
+        raise
+    await sync_to_async(idempotency.finish)(record, status_code, data)
+    return _json_response(data, status=status_code)
+
+
+def _is_label(value):
+    return isinstance(value, str) and len(value) <= 100
+
+
+async def _bulk_create_logs(user, payload):
+    """Проверка и запись пачки логов; возвращает (тело ответа, HTTP-статус)"""
+    items = payload.get('logs') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        return {'detail': 'Expected a non-empty list of logs'}, 400
+    if len(items) > settings.QUERY_LOG_BULK_MAX_ITEMS:
+        return {'detail': f'Too many logs in one request (max {settings.QUERY_LOG_BULK_MAX_ITEMS})'}, 400
+
+    errors = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('log_data'), str):
+            errors[index] = 'log_data is required'
+        elif not isinstance(item.get('query'), int):
+            errors[index] = 'query must be an integer id'
+        elif item.get('level', 'info') not in LOG_LEVELS:
+            errors[index] = f"level must be one of: {', '.join(LOG_LEVELS)}"
+        elif not all(_is_label(item.get(name, '')) for name in ('agent', 'step')):
+            errors[index] = 'agent and step must be strings of at most 100 characters'
+    if errors:
+        return {'errors': errors}, 400
+
+    # Одна выборка проектов запросов вместо проверки каждого элемента отдельно
+    query_ids = {item['query'] for item in items}
+    query_projects = {}
+    cancelled = []
+    async for query_id, project_id, query_status in scope_to_user(
+        Query.objects.filter(id__in=query_ids), user
+    ).values_list('id', 'project_id', 'status'):
+        query_projects[query_id] = project_id
+        if query_status == 'cancelled':
+            cancelled.append(query_id)
+    for index, item in enumerate(items):
+        project_id = query_projects.get(item['query'])
+        if project_id is None:
+            errors[index] = f"Query {item['query']} not found"
+        elif item.get('project') not in (None, project_id):
+            errors[index] = f"Query {item['query']} belongs to project {project_id}"
+    if errors:
+        return {'errors': errors}, 400
+
+    logs = await QueryLog.objects.abulk_create([
+        QueryLog(
+            project_id=query_projects[item['query']], query_id=item['query'], log_data=item['log_data'],
+            level=item.get('level', 'info'), agent=item.get('agent', ''), step=item.get('step', ''),
+            payload=item.get('payload')
+        )
+        for item in items
+    ])
+    events.log_written.notify()
+    return {'created': len(logs), 'ids': [log.id for log in logs], 'cancelled_queries': sorted(cancelled)}, 201
@@ -0,0 +1,308 @@
+"""
+Нагрузочный бенчмарк WebBuddy.
+
+Поднимает (или использует внешний) WebBuddy, локальную заглушку
+FastAPI-эндпоинта /api/process-query и прогоняет сценарии конкурентными
+клиентами. Для каждого сценария считаются пропускная способность,
+перцентили задержки, коды ответов, ошибки блокировок БД и двойные
+захваты запросов через claim_next, а для сервера в процессе - число
+открытых соединений с БД (эффект CONN_MAX_AGE и пула соединений).
+Результат сохраняется в JSON, чтобы прогоны можно было сравнивать между собой.
+"""
+import json
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import requests
+from django.conf import settings
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+
+from webbuddy.performance import percentile
+
+LOCK_ERROR_MARKERS = ('database is locked', 'deadlock', 'could not serialize', 'lock timeout')
+
+
+class StubWorkerService:
+    """
+    Заглушка Worker Service: принимает POST /api/process-query и считает уведомления
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        stub = self
+        self.notifications = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                with stub._lock:
+                    stub.notifications += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(b'{"status": "accepted"}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class _PooledWSGIServer(WSGIServer):
+    """
+    WSGI-сервер с фиксированным пулом рабочих потоков, как gunicorn --threads:
+    поток и его соединение с БД переживают запрос, поэтому CONN_MAX_AGE работает
+    так же, как в production (при потоке на запрос каждое соединение было бы новым)
+    """
+    request_queue_size = 512
+
+    def __init__(self, *args, threads=8, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='benchmark-wsgi')
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class InProcessServer:
+    """
+    Многопоточный WSGI-сервер с приложением WebBuddy в текущем процессе
+    """
+    def __init__(self, host='127.0.0.1', port=0, threads=8):
+        from django.core.wsgi import get_wsgi_application
+        self.server = make_server(
+            host, port, get_wsgi_application(),
+            server_class=partial(_PooledWSGIServer, threads=threads), handler_class=_QuietHandler,
+        )
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ConnectionCounter:
+    """
+    Число физических соединений с БД, открытых в этом процессе.
+    Без пула каждое соединение - сигнал connection_created; с пулом psycopg сигнал
+    приходит на каждую выдачу соединения из пула, поэтому считается статистика пула
+    """
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self._created = 0
+        self._lock = threading.Lock()
+        connection_created.connect(self._on_created)
+
+    def _on_created(self, sender, connection, **kwargs):
+        if connection.alias == self.alias:
+            with self._lock:
+                self._created += 1
+
+    def pooled(self):
+        return getattr(connections[self.alias], 'pool', None) is not None
+
+    def count(self):
+        if self.pooled():
+            return connections[self.alias].pool.get_stats().get('connections_num', 0)
+        return self._created
+
+    def stop(self):
+        connection_created.disconnect(self._on_created)
+
+
+class ScenarioResult:
+    """
+    Результаты одного сценария
+    """
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.statuses = Counter()
+        self.lock_errors = 0
+        self.transport_errors = 0
+        self.extra = {}
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, latency, response):
+        with self._lock:
+            self.latencies.append(latency)
+            if response is None:
+                self.transport_errors += 1
+                return
+            self.statuses[response.status_code] += 1
+            if response.status_code >= 500:
+                body = response.text.lower()
+                if any(marker in body for marker in LOCK_ERROR_MARKERS):
+                    self.lock_errors += 1
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'requests': count,
+            'elapsed_s': round(self.elapsed, 3),
+            'throughput_rps': round(count / self.elapsed, 2) if self.elapsed else 0,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 0.50) * 1000, 2),
+                'p95': round(percentile(latencies, 0.95) * 1000, 2),
+                'p99': round(percentile(latencies, 0.99) * 1000, 2),
+                'max': round(latencies[-1] * 1000, 2) if latencies else 0,
+            },
+            'status_codes': {str(code): n for code, n in sorted(self.statuses.items())},
+            'errors_5xx': sum(n for code, n in self.statuses.items() if code >= 500),
+            'lock_errors': self.lock_errors,
+            'transport_errors': self.transport_errors,
+            **self.extra,
+        }
+
+
+class BenchmarkRunner:
+    """
+    Прогон сценариев против WebBuddy по адресу base_url
+    """
+    def __init__(self, base_url, user_headers, service_headers, project_ids,
+                 concurrency=16, requests_per_scenario=2000, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.user_headers = user_headers
+        self.service_headers = service_headers
+        self.project_ids = project_ids
+        self.concurrency = concurrency
+        self.requests_per_scenario = requests_per_scenario
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def _call(self, result, method, path, headers, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self._session().request(
+                method, f'{self.base_url}{path}', headers=headers, timeout=self.timeout, **kwargs
+            )
+        except requests.RequestException:
+            response = None
+        result.add(time.perf_counter() - start, response)
+        return response
+
+    def _run(self, name, task):
+        result = ScenarioResult(name)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            list(pool.map(lambda i: task(result, i), range(self.requests_per_scenario)))
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def scenario_create(self):
+        def task(result, i):
+            self._call(result, 'POST', '/api/queries/', self.user_headers, json={
+                'project': self.project_ids[i % len(self.project_ids)],
+                'query_text': f'Бенчмарк: протестировать авторизацию #{i}',
+            })
+        return self._run('create', task)
+
+    def scenario_claim(self):
+        claimed = Counter()
+        claimed_lock = threading.Lock()
+        empty = Counter()
+
+        def task(result, i):
+            response = self._call(result, 'POST', '/api/queries/claim_next/', self.service_headers)
+            if response is None:
+                return
+            if response.status_code == 200:
+                query_id = response.json()['id']
+                with claimed_lock:
+                    claimed[query_id] += 1
+                self._call(result, 'PATCH', f'/api/queries/{query_id}/', self.service_headers, json={
+                    'status': 'done', 'answer_text': 'benchmark answer',
+                })
+            elif response.status_code == 404:
+                with claimed_lock:
+                    empty['empty'] += 1
+
+        result = self._run('claim_next', task)
+        result.extra['claimed'] = len(claimed)
+        result.extra['double_claims'] = sum(n - 1 for n in claimed.values() if n > 1)
+        result.extra['empty_queue'] = empty['empty']
+        return result
+
+    def scenario_log_ingest(self, query_ids):
+        def task(result, i):
+            query_id, project_id = query_ids[i % len(query_ids)]
+            self._call(result, 'POST', '/api/logs/', self.service_headers, json={
+                'project': project_id, 'query': query_id, 'log_data': f'[benchmark] шаг {i}',
+            })
+        return self._run('log_ingest', task)
+
+    def scenario_get(self, name, path, headers):
+        def task(result, i):
+            self._call(result, 'GET', path, headers)
+        return self._run(name, task)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results, output_dir):
+    """
+    Сохранить результаты прогона в output_dir/<timestamp>-<vendor>.json
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = output_dir / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{connection.vendor}.json"
+    path.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+    return path
@@ -0,0 +1,97 @@
+"""
+Массовое удаление запросов и проектов без сборщика каскада Django.
+
+Model.delete()/QuerySet.delete() собирает связанные объекты в память: удаление проекта
+загружает все его запросы, а SET NULL для ссылок кэша ответов - объекты по одному.
+Здесь дочерние таблицы чистятся set-based DELETE ограниченными пачками:
+
+- запросы удаляются порциями по QUERY_DELETE_CHUNK_SIZE;
+- логи и логи токенов порции удаляются пачками по QUERY_DELETE_BATCH_SIZE строк, каждая
+  пачка - отдельная короткая транзакция (блокировки не держатся на все удаление);
+- транзакция с последней пачкой удаляет части ответа, обнуляет ссылки кэша ответов
+  (cached_from, AnswerCacheEntry.query) и удаляет строки запросов.
+
+Полнотекстовый индекс поддерживается триггерами БД и следует за DELETE без участия ORM.
+Прерванное удаление оставляет запрос без части логов; повторное удаление его завершает.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import AnswerCacheEntry, AnswerChunk, Query, QueryLog, TokenUsageLog
+
+# Таблицы, которые могут быть большими: чистятся пачками до удаления запросов
+BATCHED_CHILD_MODELS = (QueryLog, TokenUsageLog)
+
+
+def _raw_delete(queryset):
+    """DELETE по условию queryset без сборщика каскада и сигналов; возвращает число строк"""
+    return queryset._raw_delete(queryset.db)
+
+
+def _delete_batch(queryset, batch_size):
+    """Один DELETE ... WHERE id IN (SELECT id ... LIMIT batch_size); возвращает число строк"""
+    return _raw_delete(queryset.model.objects.filter(pk__in=queryset.order_by().values('pk')[:batch_size]))
+
+
+def delete_in_batches(queryset, batch_size=None):
+    """Удалить строки queryset пачками по batch_size, каждая пачка - отдельный DELETE"""
+    batch_size = batch_size or settings.QUERY_DELETE_BATCH_SIZE
+    deleted = 0
+    while True:
+        count = _delete_batch(queryset, batch_size)
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+
+def delete_query_ids(query_ids, batch_size=None):
+    """
+    Удалить запросы с id из query_ids вместе с логами, логами токенов и частями ответа.
+    Каждая транзакция удаляет не больше пачки строк из каждой таблицы логов; последняя
+    (неполная) пачка удаляется в одной транзакции со строками запросов, поэтому логи,
+    записанные во время удаления, не остаются без запроса
+    """
+    batch_size = batch_size or settings.QUERY_DELETE_BATCH_SIZE
+    query_ids = list(query_ids)
+    while True:
+        with transaction.atomic():
+            drained = True
+            for model in BATCHED_CHILD_MODELS:
+                if _delete_batch(model.objects.filter(query_id__in=query_ids), batch_size) == batch_size:
+                    drained = False
+            if drained:
+                _raw_delete(AnswerChunk.objects.filter(query_id__in=query_ids))
+                Query.objects.filter(cached_from_id__in=query_ids).update(cached_from=None)
+                AnswerCacheEntry.objects.filter(query_id__in=query_ids).update(query=None)
+                return _raw_delete(Query.objects.filter(id__in=query_ids))
+
+
+def delete_queries(queryset, chunk_size=None):
+    """
+    Удалить запросы queryset порциями по chunk_size (id по возрастанию).
+    Возвращает число удаленных запросов
+    """
+    chunk_size = chunk_size or settings.QUERY_DELETE_CHUNK_SIZE
+    ids_queryset = queryset.order_by('pk').values_list('pk', flat=True)
+    deleted = 0
+    last_id = 0
+    while True:
+        query_ids = list(ids_queryset.filter(pk__gt=last_id)[:chunk_size])
+        if not query_ids:
+            return deleted
+        deleted += delete_query_ids(query_ids)
+        if len(query_ids) < chunk_size:
+            return deleted
+        last_id = query_ids[-1]
+
+
+def delete_project(project):
+    """
+    Удалить проект: запросы проекта и его пользователей - через delete_queries.
+    Сам проект удаляется сборщиком каскада, которому остаются ограниченные по объему
+    таблицы: пользователи, ключи, кэш ответов, счетчики бюджета токенов и гистограммы задержек
+    """
+    delete_queries(Query.objects.filter(Q(project_id=project.pk) | Q(user__project_id=project.pk)))
+    with transaction.atomic():
+        project.delete()
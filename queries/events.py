@@ -0,0 +1,41 @@
+"""
+Пробуждение корутин, ожидающих изменений очереди или логов.
+
+Синхронный код (сигналы post_save, bulk-эндпоинты) вызывает notify(),
+а async-представления ждут события вместо частого опроса БД. Событие
+действует только внутри процесса: изменения из других процессов
+замечаются при периодическом опросе (QUERY_LONGPOLL_INTERVAL).
+"""
+import asyncio
+import threading
+
+
+class Wakeup:
+    """
+    Набор asyncio.Event ожидающих корутин, которые можно установить из любого потока:
+    {событие: цикл событий ожидающей корутины}
+    """
+    def __init__(self):
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    def register(self):
+        event = asyncio.Event()
+        with self._lock:
+            self._waiters[event] = asyncio.get_running_loop()
+        return event
+
+    def unregister(self, event):
+        with self._lock:
+            self._waiters.pop(event, None)
+
+    def notify(self):
+        with self._lock:
+            waiters = list(self._waiters.items())
+        for event, loop in waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(event.set)
+
+
+query_queued = Wakeup()
+log_written = Wakeup()
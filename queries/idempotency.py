@@ -0,0 +1,171 @@
+"""
+Идемпотентность создающих эндпоинтов по заголовку Idempotency-Key.
+
+Клиент, не дождавшийся ответа, повторяет запрос с тем же ключом и получает
+исходный ответ, а не второй созданный запрос (или вторую пачку логов).
+Ключ занимается INSERT'ом под уникальным ограничением (пользователь, эндпоинт, ключ):
+из одновременных повторов выполняется только один, остальные получают 409,
+пока первый не завершится, и сохраненный ответ после этого.
+
+- Сохраняются только успешные (2xx) ответы. При ошибке ключ освобождается,
+  и повтор с тем же ключом выполняется заново (например, после 429).
+- Тот же ключ с другим телом запроса - ошибка клиента (422).
+- Ключ действует IDEMPOTENCY_KEY_TTL_SECONDS; истекшие ключи удаляются
+  при повторном использовании и командой prune_idempotency_keys.
+- Ключ без ответа (запрос еще выполняется) занят не дольше IDEMPOTENCY_PROCESSING_LEASE_SECONDS:
+  если процесс умер посреди запроса, повтор после истечения аренды выполняет запрос заново.
+- Эндпоинты с id в URL (complete, fail, answer) ведут ключи отдельно для каждого объекта:
+  один ключ для разных запросов не считается повтором.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+class Replay:
+    """Результат повторного запроса с уже использованным ключом"""
+
+    def __init__(self, status_code, data, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+
+
+def request_hash(payload):
+    """Хэш тела запроса: повтор с тем же ключом должен совпадать с исходным запросом"""
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=False, cls=DjangoJSONEncoder)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def _expiry_threshold():
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS)
+
+
+def _lease_threshold():
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_PROCESSING_LEASE_SECONDS)
+
+
+def endpoint_scope(endpoint, kwargs):
+    """Область ключа: эндпоинт и аргументы URL (id объекта)"""
+    if not kwargs:
+        return endpoint
+    return ':'.join([endpoint, *(str(kwargs[name]) for name in sorted(kwargs))])
+
+
+def validate_key(key):
+    """Текст ошибки для некорректного ключа или None"""
+    if not key.strip() or len(key) > MAX_KEY_LENGTH:
+        return f'{HEADER} must be a non-empty string of at most {MAX_KEY_LENGTH} characters'
+    return None
+
+
+def begin(user, endpoint, key, payload_hash):
+    """
+    Занять ключ перед выполнением запроса.
+    Возвращает (запись ключа, None) - запрос нужно выполнить и затем вызвать finish/release;
+    или (None, Replay) - запрос с этим ключом уже был, ответить Replay
+    """
+    for _ in range(3):
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=user, endpoint=endpoint, key=key,
+                    request_hash=payload_hash, created_at=timezone.now()
+                )
+            return record, None
+        except IntegrityError:
+            pass
+
+        existing = IdempotencyKey.objects.filter(user=user, endpoint=endpoint, key=key).first()
+        if existing is None:
+            # Ключ освободили между INSERT и SELECT - пробуем занять снова
+            continue
+        if existing.created_at < _expiry_threshold():
+            # Истекший ключ удаляется условно: его мог уже заменить параллельный запрос
+            IdempotencyKey.objects.filter(pk=existing.pk, created_at=existing.created_at).delete()
+            continue
+        if existing.status_code is None and existing.created_at < _lease_threshold():
+            # Аренда брошенного ключа истекла (процесс умер посреди запроса) - освобождаем так же условно
+            IdempotencyKey.objects.filter(
+                pk=existing.pk, created_at=existing.created_at, status_code__isnull=True
+            ).delete()
+            continue
+        if existing.request_hash != payload_hash:
+            return None, Replay(
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+                {'detail': f'{HEADER} was already used with a different request body'}
+            )
+        if existing.status_code is None:
+            return None, Replay(
+                status.HTTP_409_CONFLICT,
+                {'detail': f'A request with this {HEADER} is still being processed'},
+                {'Retry-After': '1'}
+            )
+        return None, Replay(existing.status_code, existing.response, {REPLAYED_HEADER: 'true'})
+
+    return None, Replay(
+        status.HTTP_409_CONFLICT,
+        {'detail': f'A request with this {HEADER} is still being processed'},
+        {'Retry-After': '1'}
+    )
+
+
+def finish(record, status_code, data):
+    """Сохранить ответ успешного запроса; неуспешный освобождает ключ"""
+    if 200 <= status_code < 300:
+        IdempotencyKey.objects.filter(pk=record.pk).update(status_code=status_code, response=data)
+    else:
+        release(record)
+
+
+def release(record):
+    IdempotencyKey.objects.filter(pk=record.pk).delete()
+
+
+def prune():
+    """Удалить истекшие ключи; возвращает число удаленных"""
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=_expiry_threshold()).delete()
+    return deleted
+
+
+def idempotent(endpoint):
+    """
+    Декоратор метода DRF-представления: поддержка заголовка Idempotency-Key.
+    Без заголовка метод выполняется как обычно; аргументы URL (pk) входят в область ключа
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return view_method(self, request, *args, **kwargs)
+            error = validate_key(key)
+            if error:
+                return Response({'detail': error}, status=status.HTTP_400_BAD_REQUEST)
+
+            record, replay = begin(request.user, endpoint_scope(endpoint, kwargs), key, request_hash(request.data))
+            if replay is not None:
+                return Response(replay.data, status=replay.status_code, headers=replay.headers)
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except BaseException:
+                release(record)
+                raise
+            finish(record, response.status_code, response.data)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,14 @@
+"""
+Management command для удаления устаревших записей кэша ответов
+"""
+from django.core.management.base import BaseCommand
+
+from queries import answer_cache
+
+
+class Command(BaseCommand):
+    help = 'Удалить истекшие записи кэша ответов и записи со старой версией контекста проекта'
+
+    def handle(self, *args, **options):
+        deleted = answer_cache.prune()
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей кэша ответов: {deleted}'))
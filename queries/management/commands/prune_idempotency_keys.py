@@ -0,0 +1,14 @@
+"""
+Management command для удаления истекших ключей идемпотентности
+"""
+from django.core.management.base import BaseCommand
+
+from queries import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Удалить ключи Idempotency-Key старше IDEMPOTENCY_KEY_TTL_SECONDS'
+
+    def handle(self, *args, **options):
+        deleted = idempotency.prune()
+        self.stdout.write(self.style.SUCCESS(f'Удалено ключей идемпотентности: {deleted}'))
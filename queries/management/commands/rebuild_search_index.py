@@ -0,0 +1,17 @@
+"""
+Management command для перестроения полнотекстового индекса
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from queries.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Перестроить полнотекстовый индекс запросов и логов (SQLite FTS5); для PostgreSQL индекс обновляется сам'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.ensure_index(connection)
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Индекс перестроен ({connection.vendor})'))
@@ -0,0 +1,20 @@
+"""
+Management command для пересчета гистограмм задержек вызовов моделей из логов использования токенов
+"""
+from django.core.management.base import BaseCommand
+
+from queries import token_latency
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать часовые гистограммы задержек вызовов моделей из логов использования токенов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1,
+                            help='Число последних суток для пересчета')
+        parser.add_argument('--project', type=int, action='append', dest='projects',
+                            help='ID проекта (можно указать несколько раз; по умолчанию все проекты)')
+
+    def handle(self, *args, **options):
+        written = token_latency.rebuild(days=max(options['days'], 1), project_ids=options['projects'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано интервалов гистограмм: {written}'))
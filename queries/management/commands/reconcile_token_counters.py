@@ -0,0 +1,20 @@
+"""
+Management command для пересчета счетчиков бюджета токенов из логов
+"""
+from django.core.management.base import BaseCommand
+
+from queries import token_budget
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать счетчики расхода токенов проектов (дневные и месячные) из логов использования токенов (счетчики только увеличиваются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1,
+                            help='Число последних дней для пересчета (и затрагиваемых ими месяцев)')
+        parser.add_argument('--project', type=int, action='append', dest='projects',
+                            help='ID проекта (можно указать несколько раз; по умолчанию все проекты)')
+
+    def handle(self, *args, **options):
+        written = token_budget.reconcile(days=max(options['days'], 1), project_ids=options['projects'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано счетчиков токенов: {written}'))
@@ -0,0 +1,166 @@
+"""
+Management command для нагрузочного бенчмарка API
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from projects.models import Project
+from queries.benchmark import (
+    BenchmarkRunner, ConnectionCounter, InProcessServer, StubWorkerService, git_revision, save_results,
+)
+from queries.models import Query
+from users.api_keys import issue_api_key, revoke_api_key
+from users.models import User, UserRole
+
+SCENARIOS = ['create', 'claim', 'log_ingest', 'list', 'logs_list', 'token_usage_list', 'statistics']
+
+
+class Command(BaseCommand):
+    help = 'Прогнать нагрузочные сценарии (create, claim_next, логи, statistics, списки) и сохранить результаты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', type=str, help='Адрес запущенного WebBuddy (по умолчанию поднимается в процессе)')
+        parser.add_argument('--stub-port', type=int, default=0, help='Порт заглушки Worker Service (0 = случайный)')
+        parser.add_argument('--concurrency', type=int, default=16, help='Число параллельных клиентов')
+        parser.add_argument('--server-threads', type=int, default=8,
+                            help='Рабочих потоков сервера в процессе (как gunicorn --threads)')
+        parser.add_argument('--requests', type=int, default=2000, help='Запросов на сценарий')
+        parser.add_argument('--scenarios', type=str, default=','.join(SCENARIOS),
+                            help=f'Сценарии через запятую: {", ".join(SCENARIOS)}')
+        parser.add_argument('--prefix', type=str, default='bench', help='Префикс данных seed_benchmark_data')
+        parser.add_argument('--output-dir', type=str, default=str(settings.BASE_DIR / 'benchmark_results'),
+                            help='Каталог для JSON с результатами')
+        parser.add_argument('--label', type=str, default='', help='Метка прогона (попадает в результаты)')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+
+        projects = list(Project.objects.filter(project_name__startswith=f"{options['prefix']}-project-"))
+        if not projects:
+            raise CommandError('Нет данных для бенчмарка. Сначала выполните seed_benchmark_data')
+        user = User.objects.filter(project=projects[0], role=UserRole.USER).first()
+        if user is None:
+            raise CommandError(f'В проекте {projects[0]} нет пользователей')
+
+        service_user = self._get_service_user(options['prefix'])
+        api_key, raw_key = issue_api_key(service_user, 'benchmark')
+
+        stub = StubWorkerService(port=options['stub_port']).start()
+        server = None
+        counter = None
+        if options['url']:
+            base_url = options['url']
+            self.stdout.write(self.style.WARNING(
+                f'Внешний сервер: задайте на нем FASTAPI_URL={stub.url}, чтобы уведомления шли в заглушку'
+            ))
+        else:
+            settings.FASTAPI_URL = stub.url
+            server = InProcessServer(threads=options['server_threads']).start()
+            base_url = server.url
+            counter = ConnectionCounter()
+
+        runner = BenchmarkRunner(
+            base_url,
+            user_headers={'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'},
+            service_headers={'Authorization': f'Api-Key {raw_key}'},
+            project_ids=[user.project_id],
+            concurrency=options['concurrency'],
+            requests_per_scenario=options['requests'],
+        )
+
+        results = {
+            'timestamp': timezone.now().isoformat(),
+            'label': options['label'],
+            'git_revision': git_revision(),
+            'db_vendor': connection.vendor,
+            'database': {
+                'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+                'conn_health_checks': connection.settings_dict['CONN_HEALTH_CHECKS'],
+                'pool': connection.settings_dict['OPTIONS'].get('pool') or None,
+            },
+            'url': base_url,
+            'concurrency': options['concurrency'],
+            'server_threads': options['server_threads'] if server is not None else None,
+            'requests_per_scenario': options['requests'],
+            'dataset': {
+                'projects': len(projects),
+                'queries': Query.objects.count(),
+            },
+            'scenarios': {},
+        }
+
+        try:
+            for name in scenarios:
+                self.stdout.write(f'Сценарий {name}...')
+                connections_before = counter.count() if counter is not None else None
+                result = self._run_scenario(runner, name, projects)
+                if counter is not None:
+                    # Соединения, открытые сервером за сценарий: при CONN_MAX_AGE=0 - по одному
+                    # на запрос, при persistent-соединениях или пуле - порядка числа потоков
+                    opened = counter.count() - connections_before
+                    result.extra['db_connections'] = opened
+                    result.extra['db_connections_per_request'] = round(opened / max(len(result.latencies), 1), 3)
+                results['scenarios'][name] = result.as_dict()
+                self._print_result(name, results['scenarios'][name])
+        finally:
+            results['stub_notifications'] = stub.notifications
+            stub.stop()
+            if server is not None:
+                server.stop()
+            if counter is not None:
+                counter.stop()
+            revoke_api_key(api_key)
+
+        path = save_results(results, options['output_dir'])
+        self.stdout.write(self.style.SUCCESS(f'Результаты сохранены: {path}'))
+
+    def _get_service_user(self, prefix):
+        username = f'{prefix}-service'
+        service_user = User.objects.filter(username=username).first()
+        if service_user is None:
+            service_user = User(
+                username=username,
+                email=f'{username}@bench.local',
+                role=UserRole.SERVICE,
+                first_login=False,
+            )
+            service_user.set_unusable_password()
+            service_user.save()
+        return service_user
+
+    def _run_scenario(self, runner, name, projects):
+        if name == 'create':
+            return runner.scenario_create()
+        if name == 'claim':
+            return runner.scenario_claim()
+        if name == 'log_ingest':
+            query_ids = list(
+                Query.objects.filter(project__in=projects).values_list('id', 'project_id')[:500]
+            )
+            return runner.scenario_log_ingest(query_ids)
+        if name == 'list':
+            return runner.scenario_get(name, '/api/queries/', runner.user_headers)
+        if name == 'logs_list':
+            return runner.scenario_get(name, '/api/logs/', runner.service_headers)
+        if name == 'token_usage_list':
+            return runner.scenario_get(name, '/api/token-usage/', runner.service_headers)
+        return runner.scenario_get(name, '/api/token-usage/statistics/', runner.user_headers)
+
+    def _print_result(self, name, result):
+        latency = result['latency_ms']
+        line = (
+            f"  {name}: {result['requests']} req, {result['throughput_rps']} req/s, "
+            f"p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, "
+            f"5xx {result['errors_5xx']}, lock errors {result['lock_errors']}"
+        )
+        if 'db_connections' in result:
+            line += f", DB connections {result['db_connections']}"
+        if 'double_claims' in result:
+            line += f", claimed {result['claimed']}, double claims {result['double_claims']}"
+        self.stdout.write(line)
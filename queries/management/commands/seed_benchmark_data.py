@@ -0,0 +1,160 @@
+"""
+Management command для генерации синтетических данных для нагрузочных тестов
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from projects.models import Project
+from queries import token_budget, token_latency
+from queries.models import Query, QueryLog, TokenUsageLog
+from users.models import User, UserRole
+
+AGENTS = ['planner', 'test_designer', 'reviewer', 'jira_reader', 'testit_writer']
+MODELS = ['gpt-4o', 'gpt-4o-mini', 'claude-sonnet', 'qwen-72b']
+STATUS_WEIGHTS = [('done', 83), ('failed', 5), ('cancelled', 2), ('in_progress', 3), ('queued', 7)]
+
+
+class Command(BaseCommand):
+    help = 'Заполнить БД синтетическими проектами, запросами, логами и статистикой токенов для бенчмарков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=50, help='Количество проектов')
+        parser.add_argument('--users-per-project', type=int, default=2, help='Пользователей на проект')
+        parser.add_argument('--queries', type=int, default=100000, help='Всего запросов')
+        parser.add_argument('--logs-per-query', type=int, default=10, help='Логов на запрос')
+        parser.add_argument('--token-logs-per-query', type=int, default=3, help='Записей TokenUsageLog на запрос')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Размер пачки bulk_create')
+        parser.add_argument('--prefix', type=str, default='bench', help='Префикс имен проектов и пользователей')
+        parser.add_argument('--seed', type=int, default=42, help='Seed генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+        batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        projects, users_by_project = self._seed_projects_and_users(options, prefix)
+        self.stdout.write(f'Проектов: {len(projects)}, пользователей: {sum(len(u) for u in users_by_project.values())}')
+
+        statuses = [status for status, _ in STATUS_WEIGHTS]
+        weights = [weight for _, weight in STATUS_WEIGHTS]
+        now = timezone.now()
+
+        remaining = options['queries']
+        totals = {'queries': 0, 'logs': 0, 'token_logs': 0}
+        while remaining > 0:
+            size = min(batch_size, remaining)
+            with transaction.atomic():
+                batch = []
+                for _ in range(size):
+                    project = rng.choice(projects)
+                    status = rng.choices(statuses, weights)[0]
+                    started_at = now if status != 'queued' else None
+                    finished_at = now if status in Query.FINISHED_STATUSES else None
+                    batch.append(Query(
+                        project=project,
+                        user=rng.choice(users_by_project[project.id]),
+                        query_text=f'Протестировать сценарий #{rng.randint(1, 10 ** 6)}',
+                        answer_text='Сгенерированный ответ ' * 20 if status == 'done' else '',
+                        status=status,
+                        query_started=started_at,
+                        query_finished=finished_at,
+                    ))
+                created = Query.objects.bulk_create(batch, batch_size=batch_size)
+                totals['queries'] += len(created)
+
+                totals['logs'] += self._seed_logs(created, options['logs_per_query'], batch_size, rng)
+                totals['token_logs'] += self._seed_token_logs(created, options['token_logs_per_query'], batch_size, rng)
+
+            remaining -= size
+            self.stdout.write(
+                f"  запросов: {totals['queries']}, логов: {totals['logs']}, "
+                f"token usage: {totals['token_logs']} ({time.perf_counter() - started:.1f} c)"
+            )
+
+        # Логи токенов записаны bulk_create в обход счетчиков: пересчитываем бюджеты проектов
+        # и гистограммы задержек, иначе проверки бюджета и /api/token-usage/latency/ их не видят
+        project_ids = [project.id for project in projects]
+        days = (timezone.localdate() - timezone.localdate(now)).days + 1
+        counters = token_budget.reconcile(days=days, project_ids=project_ids)
+        buckets = token_latency.rebuild(days=days, project_ids=project_ids)
+        self.stdout.write(f'Счетчиков бюджета: {counters}, интервалов гистограмм задержек: {buckets}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {time.perf_counter() - started:.1f} c: "
+            f"{totals['queries']} запросов, {totals['logs']} логов, {totals['token_logs']} записей токенов"
+        ))
+
+    def _seed_projects_and_users(self, options, prefix):
+        projects = []
+        users_by_project = {}
+        for i in range(options['projects']):
+            project, _ = Project.objects.get_or_create(
+                project_name=f'{prefix}-project-{i}',
+                defaults={'project_context': 'Синтетический проект для нагрузочного тестирования'},
+            )
+            projects.append(project)
+            users = []
+            for j in range(options['users_per_project']):
+                username = f'{prefix}-user-{i}-{j}'
+                user = User.objects.filter(username=username).first()
+                if user is None:
+                    user = User(
+                        username=username,
+                        email=f'{username}@bench.local',
+                        role=UserRole.USER,
+                        project=project,
+                        first_login=False,
+                    )
+                    # Без PBKDF2: пароль для бенчмарк-пользователей не нужен
+                    user.set_unusable_password()
+                    user.save()
+                users.append(user)
+            users_by_project[project.id] = users
+        return projects, users_by_project
+
+    def _seed_logs(self, queries, per_query, batch_size, rng):
+        if per_query <= 0:
+            return 0
+        logs = [
+            QueryLog(
+                project_id=query.project_id,
+                query_id=query.id,
+                log_data=f'[{rng.choice(AGENTS)}] шаг {n}: обработка завершена',
+            )
+            for query in queries
+            for n in range(per_query)
+        ]
+        QueryLog.objects.bulk_create(logs, batch_size=batch_size)
+        return len(logs)
+
+    def _seed_token_logs(self, queries, per_query, batch_size, rng):
+        if per_query <= 0:
+            return 0
+        token_logs = []
+        for query in queries:
+            for _ in range(per_query):
+                prompt, completion = rng.randint(200, 4000), rng.randint(50, 1500)
+                duration = rng.randint(300, 60000)
+                token_logs.append(TokenUsageLog(
+                    ai_agent_name=rng.choice(AGENTS),
+                    project_id=query.project_id,
+                    query_id=query.id,
+                    request_to_ai_agent='Запрос агенту',
+                    ai_agent_answer='Ответ агента',
+                    model_name=rng.choice(MODELS),
+                    model_role='assistant',
+                    prompt_tokens=prompt,
+                    completion_tokens=completion,
+                    total_tokens=prompt + completion,
+                    input_tokens=prompt,
+                    output_tokens=completion,
+                    duration_ms=duration,
+                    time_to_first_token_ms=rng.randint(100, min(duration, 5000)),
+                ))
+        TokenUsageLog.objects.bulk_create(token_logs, batch_size=batch_size)
+        return len(token_logs)
@@ -0,0 +1,191 @@
+"""
+Метрики очереди в текстовом формате Prometheus.
+
+Счетчики и гистограммы живут в памяти процесса и обновляются на горячих
+путях (создание, claim_next, завершение, уведомление FastAPI). Глубина
+очереди берется из кэшированного снимка admission control, поэтому
+сбор метрик никогда не сканирует таблицы.
+
+При запуске в нескольких процессах каждый процесс отдает свои значения;
+суммирование выполняется на стороне Prometheus.
+"""
+import threading
+
+from rest_framework.renderers import BaseRenderer
+
+from webbuddy import performance
+from . import admission
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Counter:
+    """Монотонный счетчик с необязательными метками"""
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0)]
+        for key, value in items:
+            yield self.name, tuple(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами бакетов (в секундах)"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            self._sum += value
+            self._count += 1
+
+    def collect(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            yield f'{self.name}_bucket', (('le', _format_value(float(bound))),), cumulative
+        yield f'{self.name}_sum', (), total
+        yield f'{self.name}_count', (), count
+
+
+queries_created = Counter(
+    'webbuddy_queries_created_total', 'Queries accepted by QueryViewSet.create'
+)
+queries_rejected = Counter(
+    'webbuddy_queries_rejected_total', 'Queries rejected by admission control'
+)
+queries_claimed = Counter(
+    'webbuddy_queries_claimed_total', 'Queries claimed by workers via claim_next'
+)
+queries_completed = Counter(
+    'webbuddy_queries_completed_total', 'Queries moved to a terminal status', ('status',)
+)
+notifications = Counter(
+    'webbuddy_fastapi_notifications_total', 'Push notifications sent to the worker service', ('result',)
+)
+answer_cache_lookups = Counter(
+    'webbuddy_answer_cache_lookups_total', 'Answer cache lookups on query creation', ('result',)
+)
+wait_time = Histogram(
+    'webbuddy_query_wait_seconds', 'Time from query_created to query_started',
+    (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
+service_time = Histogram(
+    'webbuddy_query_service_seconds', 'Time from query_started to query_finished',
+    (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200),
+)
+
+REGISTRY = [
+    queries_created, queries_rejected, queries_claimed, queries_completed,
+    notifications, answer_cache_lookups, wait_time, service_time,
+]
+
+
+def observe_claim(query):
+    queries_claimed.inc()
+    if query.query_started and query.query_created:
+        wait_time.observe((query.query_started - query.query_created).total_seconds())
+
+
+def observe_completion(query):
+    queries_completed.inc(status=query.status)
+    # Отмененная обработка не отражает время ответа агентов
+    if query.status != 'cancelled' and query.query_started and query.query_finished:
+        service_time.observe((query.query_finished - query.query_started).total_seconds())
+
+
+def _queue_depth_samples():
+    snapshot = admission.get_queue_snapshot()
+    for (project_id, status), n in sorted(snapshot.items()):
+        yield 'webbuddy_queue_depth', (('project', project_id), ('status', status)), n
+
+
+def render_metrics():
+    """
+    Сформировать текст в формате Prometheus exposition 0.0.4
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type_name}')
+        for name, labels, value in metric.collect():
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+    lines.append('# HELP webbuddy_queue_depth Active queries per project and status (cached)')
+    lines.append('# TYPE webbuddy_queue_depth gauge')
+    for name, labels, value in _queue_depth_samples():
+        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+    lines.append('# HELP webbuddy_http_request_duration_ms Sampled request latency per route (rolling window)')
+    lines.append('# TYPE webbuddy_http_request_duration_ms summary')
+    for route, summary in performance.route_summaries().items():
+        if not summary['window']:
+            continue
+        for quantile in ('0.5', '0.95', '0.99'):
+            key = {'0.5': 'p50_ms', '0.95': 'p95_ms', '0.99': 'p99_ms'}[quantile]
+            labels = (('route', route), ('quantile', quantile))
+            lines.append(f'webbuddy_http_request_duration_ms{_format_labels(labels)} {summary[key]}')
+        lines.append(f'webbuddy_http_request_duration_ms_count{_format_labels((("route", route),))} {summary["count"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusRenderer(BaseRenderer):
+    """
+    Renderer для уже сформированного текста метрик
+    """
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # Ошибки (401/403) приходят как dict
+        return str(data).encode(self.charset)
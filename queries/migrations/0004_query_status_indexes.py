@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0001_initial'),
+        ('queries', '0003_query_query_started'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='query',
+            index=models.Index(fields=['status', 'query_created'], name='queries_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='query',
+            index=models.Index(fields=['query_finished'], name='queries_finished_idx'),
+        ),
+    ]
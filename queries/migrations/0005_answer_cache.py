@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0002_answer_cache'),
+        ('queries', '0004_query_status_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerCacheStats',
+            fields=[
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='answer_cache_stats', serialize=False, to='projects.project', verbose_name='Project')),
+                ('hits', models.PositiveBigIntegerField(default=0, verbose_name='Hits')),
+                ('misses', models.PositiveBigIntegerField(default=0, verbose_name='Misses')),
+            ],
+            options={
+                'verbose_name': 'Answer Cache Stats',
+                'verbose_name_plural': 'Answer Cache Stats',
+                'db_table': 'answer_cache_stats',
+            },
+        ),
+        migrations.AddField(
+            model_name='query',
+            name='cached_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cache_hits', to='queries.query', verbose_name='Cached From'),
+        ),
+        migrations.CreateModel(
+            name='AnswerCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('context_version', models.PositiveIntegerField(verbose_name='Context Version')),
+                ('text_hash', models.CharField(max_length=64, verbose_name='Normalized Text Hash')),
+                ('normalized_text', models.TextField(verbose_name='Normalized Text')),
+                ('answer_text', models.TextField(verbose_name='Answer Text')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='Hits')),
+                ('created_at', models.DateTimeField(verbose_name='Created At')),
+                ('last_used_at', models.DateTimeField(verbose_name='Last Used At')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answer_cache_entries', to='projects.project', verbose_name='Project')),
+                ('query', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='answer_cache_entries', to='queries.query', verbose_name='Source Query')),
+            ],
+            options={
+                'verbose_name': 'Answer Cache Entry',
+                'verbose_name_plural': 'Answer Cache Entries',
+                'db_table': 'answer_cache_entries',
+                'indexes': [models.Index(fields=['project', 'last_used_at'], name='answer_cache_lru_idx')],
+                'constraints': [models.UniqueConstraint(fields=('project', 'context_version', 'text_hash'), name='answer_cache_unique_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,139 @@
+"""
+Полнотекстовый индекс запросов и логов (см. queries/search.py).
+SQLite - FTS5-таблицы с триггерами, PostgreSQL - генерируемые tsvector-столбцы с GIN
+(для queries заменен триггером в 0013_query_search_vector_trigger).
+
+DDL записан в миграции, а не берется из queries.search: миграция должна создавать
+ту схему, что была на момент ее написания, независимо от последующих изменений кода.
+"""
+from django.conf import settings
+from django.db import migrations
+
+SQLITE_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS queries_fts USING fts5(
+        query_text, answer_text, project_id UNINDEXED, content='queries', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS query_logs_fts USING fts5(
+        log_data, query_id UNINDEXED, project_id UNINDEXED, content='query_logs', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS queries_fts_insert AFTER INSERT ON queries BEGIN
+        INSERT INTO queries_fts(rowid, query_text, answer_text, project_id)
+        VALUES (new.id, new.query_text, new.answer_text, new.project_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS queries_fts_delete AFTER DELETE ON queries BEGIN
+        INSERT INTO queries_fts(queries_fts, rowid, query_text, answer_text, project_id)
+        VALUES ('delete', old.id, old.query_text, old.answer_text, old.project_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS queries_fts_update AFTER UPDATE OF query_text, answer_text, project_id ON queries
+    WHEN old.query_text IS NOT new.query_text OR old.answer_text IS NOT new.answer_text
+        OR old.project_id IS NOT new.project_id BEGIN
+        INSERT INTO queries_fts(queries_fts, rowid, query_text, answer_text, project_id)
+        VALUES ('delete', old.id, old.query_text, old.answer_text, old.project_id);
+        INSERT INTO queries_fts(rowid, query_text, answer_text, project_id)
+        VALUES (new.id, new.query_text, new.answer_text, new.project_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS query_logs_fts_insert AFTER INSERT ON query_logs BEGIN
+        INSERT INTO query_logs_fts(rowid, log_data, query_id, project_id)
+        VALUES (new.id, new.log_data, new.query_id, new.project_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS query_logs_fts_delete AFTER DELETE ON query_logs BEGIN
+        INSERT INTO query_logs_fts(query_logs_fts, rowid, log_data, query_id, project_id)
+        VALUES ('delete', old.id, old.log_data, old.query_id, old.project_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS query_logs_fts_update AFTER UPDATE OF log_data, query_id, project_id ON query_logs
+    WHEN old.log_data IS NOT new.log_data OR old.query_id IS NOT new.query_id
+        OR old.project_id IS NOT new.project_id BEGIN
+        INSERT INTO query_logs_fts(query_logs_fts, rowid, log_data, query_id, project_id)
+        VALUES ('delete', old.id, old.log_data, old.query_id, old.project_id);
+        INSERT INTO query_logs_fts(rowid, log_data, query_id, project_id)
+        VALUES (new.id, new.log_data, new.query_id, new.project_id);
+    END
+    """,
+    "INSERT INTO queries_fts(queries_fts) VALUES('rebuild')",
+    "INSERT INTO query_logs_fts(query_logs_fts) VALUES('rebuild')",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS queries_fts_insert',
+    'DROP TRIGGER IF EXISTS queries_fts_delete',
+    'DROP TRIGGER IF EXISTS queries_fts_update',
+    'DROP TRIGGER IF EXISTS query_logs_fts_insert',
+    'DROP TRIGGER IF EXISTS query_logs_fts_delete',
+    'DROP TRIGGER IF EXISTS query_logs_fts_update',
+    'DROP TABLE IF EXISTS queries_fts',
+    'DROP TABLE IF EXISTS query_logs_fts',
+]
+
+
+def postgres_schema(config):
+    # Конфигурация подставляется литералом: выражение генерируемого столбца должно быть immutable
+    config = config.replace("'", "''")
+    return [
+        f"""
+        ALTER TABLE queries ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('{config}'::regconfig, coalesce(query_text, '')), 'A') ||
+            setweight(to_tsvector('{config}'::regconfig, coalesce(answer_text, '')), 'B')
+        ) STORED
+        """,
+        'CREATE INDEX queries_search_vector_idx ON queries USING GIN (search_vector)',
+        f"""
+        ALTER TABLE query_logs ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            to_tsvector('{config}'::regconfig, coalesce(log_data, ''))
+        ) STORED
+        """,
+        'CREATE INDEX query_logs_search_vector_idx ON query_logs USING GIN (search_vector)',
+    ]
+
+
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS queries_search_vector_idx',
+    'ALTER TABLE queries DROP COLUMN IF EXISTS search_vector',
+    'DROP INDEX IF EXISTS query_logs_search_vector_idx',
+    'ALTER TABLE query_logs DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def forward(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statements = SQLITE_SCHEMA
+    elif vendor == 'postgresql':
+        statements = postgres_schema(settings.FULL_TEXT_SEARCH_CONFIG)
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def backward(apps, schema_editor):
+    statements = {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queries', '0005_answer_cache'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queries', '0006_full_text_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='query',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('in_progress', 'In Progress'), ('done', 'Done'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=50, verbose_name='Status'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0003_token_budgets'),
+        ('queries', '0008_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectTokenCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('month', 'Month')], max_length=5, verbose_name='Period')),
+                ('period_start', models.DateField(verbose_name='Period Start')),
+                ('tokens', models.PositiveBigIntegerField(default=0, verbose_name='Tokens')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='token_counters', to='projects.project', verbose_name='Project')),
+            ],
+            options={
+                'verbose_name': 'Project Token Counter',
+                'verbose_name_plural': 'Project Token Counters',
+                'db_table': 'project_token_counters',
+                'indexes': [models.Index(fields=['period', 'period_start'], name='token_counter_period_idx')],
+                'constraints': [models.UniqueConstraint(fields=('project', 'period', 'period_start'), name='project_token_counter_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queries', '0009_project_token_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(verbose_name='Text')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('query', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='answer_chunks', to='queries.query', verbose_name='Query')),
+            ],
+            options={
+                'verbose_name': 'Answer Chunk',
+                'verbose_name_plural': 'Answer Chunks',
+                'db_table': 'query_answer_chunks',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['query', 'id'], name='answer_chunk_query_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:24
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0003_token_budgets'),
+        ('queries', '0010_answer_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='querylog',
+            name='agent',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Agent'),
+        ),
+        migrations.AddField(
+            model_name='querylog',
+            name='level',
+            field=models.CharField(choices=[('debug', 'Debug'), ('info', 'Info'), ('warning', 'Warning'), ('error', 'Error')], default='info', max_length=10, verbose_name='Level'),
+        ),
+        migrations.AddField(
+            model_name='querylog',
+            name='payload',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True, verbose_name='Payload'),
+        ),
+        migrations.AddField(
+            model_name='querylog',
+            name='step',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Step'),
+        ),
+        migrations.AddIndex(
+            model_name='querylog',
+            index=models.Index(fields=['query', 'level', 'create_dtime'], name='query_log_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='querylog',
+            index=models.Index(fields=['query', 'agent', 'create_dtime'], name='query_log_agent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='querylog',
+            index=models.Index(fields=['project', 'level', 'create_dtime'], name='query_log_project_level_idx'),
+        ),
+    ]
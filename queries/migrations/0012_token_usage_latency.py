@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0003_token_budgets'),
+        ('queries', '0011_query_log_structured_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tokenusagelog',
+            name='duration_ms',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Duration (ms)'),
+        ),
+        migrations.AddField(
+            model_name='tokenusagelog',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Finished At'),
+        ),
+        migrations.AddField(
+            model_name='tokenusagelog',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Started At'),
+        ),
+        migrations.AddField(
+            model_name='tokenusagelog',
+            name='time_to_first_token_ms',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Time To First Token (ms)'),
+        ),
+        migrations.CreateModel(
+            name='TokenLatencyBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='Hour')),
+                ('model_name', models.CharField(max_length=50, verbose_name='Model Name')),
+                ('ai_agent_name', models.CharField(max_length=50, verbose_name='AI Agent Name')),
+                ('metric', models.CharField(choices=[('duration', 'Duration'), ('ttft', 'Time to first token')], max_length=8, verbose_name='Metric')),
+                ('bucket', models.PositiveSmallIntegerField(verbose_name='Bucket')),
+                ('calls', models.PositiveBigIntegerField(default=0, verbose_name='Calls')),
+                ('total_ms', models.PositiveBigIntegerField(default=0, verbose_name='Total (ms)')),
+                ('output_tokens', models.PositiveBigIntegerField(default=0, verbose_name='Output Tokens')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='token_latency_buckets', to='projects.project', verbose_name='Project')),
+            ],
+            options={
+                'verbose_name': 'Token Latency Bucket',
+                'verbose_name_plural': 'Token Latency Buckets',
+                'db_table': 'token_latency_buckets',
+                'constraints': [models.UniqueConstraint(fields=('hour', 'project', 'model_name', 'ai_agent_name', 'metric', 'bucket'), name='token_latency_bucket_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,94 @@
+"""
+PostgreSQL: queries.search_vector - обычный столбец, который заполняет триггер,
+вместо генерируемого STORED-столбца из 0006_full_text_search.
+
+Генерируемый столбец пересчитывается при каждом UPDATE строки, в том числе при
+смене статуса (PATCH, claim_next, finish_query), где текст не меняется, а
+to_tsvector по длинному answer_text - основная стоимость такого UPDATE.
+Триггер срабатывает при INSERT и при UPDATE, только если изменились query_text
+или answer_text. query_logs.search_vector остается генерируемым: логи
+после записи не обновляются.
+
+Для SQLite и других СУБД миграция ничего не делает (FTS5-триггеры уже условные).
+"""
+from django.conf import settings
+from django.db import migrations
+
+
+def postgres_schema(config):
+    config = config.replace("'", "''")
+    return [
+        'DROP INDEX IF EXISTS queries_search_vector_idx',
+        'ALTER TABLE queries DROP COLUMN IF EXISTS search_vector',
+        'ALTER TABLE queries ADD COLUMN search_vector tsvector',
+        f"""
+        CREATE OR REPLACE FUNCTION queries_search_vector_refresh() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector :=
+                setweight(to_tsvector('{config}'::regconfig, coalesce(NEW.query_text, '')), 'A') ||
+                setweight(to_tsvector('{config}'::regconfig, coalesce(NEW.answer_text, '')), 'B');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE TRIGGER queries_search_vector_insert BEFORE INSERT ON queries
+        FOR EACH ROW EXECUTE FUNCTION queries_search_vector_refresh()
+        """,
+        # save() перечисляет в SET все столбцы, поэтому одного UPDATE OF недостаточно
+        """
+        CREATE TRIGGER queries_search_vector_update BEFORE UPDATE OF query_text, answer_text ON queries
+        FOR EACH ROW WHEN (
+            OLD.query_text IS DISTINCT FROM NEW.query_text OR OLD.answer_text IS DISTINCT FROM NEW.answer_text
+        ) EXECUTE FUNCTION queries_search_vector_refresh()
+        """,
+        f"""
+        UPDATE queries SET search_vector =
+            setweight(to_tsvector('{config}'::regconfig, coalesce(query_text, '')), 'A') ||
+            setweight(to_tsvector('{config}'::regconfig, coalesce(answer_text, '')), 'B')
+        """,
+        'CREATE INDEX queries_search_vector_idx ON queries USING GIN (search_vector)',
+    ]
+
+
+def generated_schema(config):
+    config = config.replace("'", "''")
+    return [
+        'DROP TRIGGER IF EXISTS queries_search_vector_insert ON queries',
+        'DROP TRIGGER IF EXISTS queries_search_vector_update ON queries',
+        'DROP FUNCTION IF EXISTS queries_search_vector_refresh()',
+        'DROP INDEX IF EXISTS queries_search_vector_idx',
+        'ALTER TABLE queries DROP COLUMN IF EXISTS search_vector',
+        f"""
+        ALTER TABLE queries ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('{config}'::regconfig, coalesce(query_text, '')), 'A') ||
+            setweight(to_tsvector('{config}'::regconfig, coalesce(answer_text, '')), 'B')
+        ) STORED
+        """,
+        'CREATE INDEX queries_search_vector_idx ON queries USING GIN (search_vector)',
+    ]
+
+
+def forward(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for statement in postgres_schema(settings.FULL_TEXT_SEARCH_CONFIG):
+        schema_editor.execute(statement)
+
+
+def backward(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for statement in generated_schema(settings.FULL_TEXT_SEARCH_CONFIG):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queries', '0012_token_usage_latency'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
 
 
 class Query(models.Model):
@@ -11,7 +12,17 @@ class Query(models.Model):
         ('in_progress', 'In Progress'),
         ('done', 'Done'),
         ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
     ]
+    # Запрос еще обрабатывается (или ждет обработки) и может быть отменен
+    ACTIVE_STATUSES = ('queued', 'in_progress')
+    # Запрос завершен: ответ, ошибка или отмена пользователем
+    FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+    # Допустимые переходы статуса; из завершенных статусов переходов нет
+    STATUS_TRANSITIONS = {
+        'queued': ('in_progress', 'cancelled'),
+        'in_progress': ('done', 'failed', 'cancelled'),
+    }
 
     project = models.ForeignKey(
         'projects.Project',
@@ -36,21 +47,54 @@ class Query(models.Model):
     query_created = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
     query_started = models.DateTimeField(null=True, blank=True, verbose_name='Started At')
     query_finished = models.DateTimeField(null=True, blank=True, verbose_name='Finished At')
+    # Запрос, чей ответ был выдан из кэша ответов вместо обработки
+    cached_from = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='cache_hits',
+        verbose_name='Cached From'
+    )
 
     class Meta:
         db_table = 'queries'
         verbose_name = 'Query'
         verbose_name_plural = 'Queries'
         ordering = ['-query_created']
+        indexes = [
+            # claim_next и подсчет глубины очереди
+            models.Index(fields=['status', 'query_created'], name='queries_status_created_idx'),
+            # скорость завершения запросов для оценки Retry-After
+            models.Index(fields=['query_finished'], name='queries_finished_idx'),
+        ]
 
     def __str__(self):
         return f"Query #{self.id} - {self.status}"
 
+    @classmethod
+    def can_transition(cls, old_status, new_status):
+        return new_status in cls.STATUS_TRANSITIONS.get(old_status, ())
+
+    @classmethod
+    def statuses_before(cls, new_status):
+        """Статусы, из которых допустим переход в new_status"""
+        return [old for old, targets in cls.STATUS_TRANSITIONS.items() if new_status in targets]
+
 
 class QueryLog(models.Model):
     """
-    Модель для логов выполнения запросов
+    Модель для логов выполнения запросов.
+    Кроме текста лог может содержать уровень, агента, шаг и JSON с данными шага -
+    по ним логи фильтруются на сервере (?level=error&agent=planner)
     """
+    LEVEL_CHOICES = [
+        ('debug', 'Debug'),
+        ('info', 'Info'),
+        ('warning', 'Warning'),
+        ('error', 'Error'),
+    ]
+
     project = models.ForeignKey(
         'projects.Project',
         on_delete=models.CASCADE,
@@ -64,6 +108,10 @@ class QueryLog(models.Model):
         verbose_name='Query'
     )
     log_data = models.TextField(verbose_name='Log Data')
+    level = models.CharField(max_length=10, choices=LEVEL_CHOICES, default='info', verbose_name='Level')
+    agent = models.CharField(max_length=100, blank=True, default='', verbose_name='Agent')
+    step = models.CharField(max_length=100, blank=True, default='', verbose_name='Step')
+    payload = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder, verbose_name='Payload')
     create_dtime = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
 
     class Meta:
@@ -71,9 +119,16 @@ class QueryLog(models.Model):
         verbose_name = 'Query Log'
         verbose_name_plural = 'Query Logs'
         ordering = ['create_dtime']
+        indexes = [
+            # логи запроса с фильтром по уровню или агенту (GET /api/queries/{id}/logs/)
+            models.Index(fields=['query', 'level', 'create_dtime'], name='query_log_level_idx'),
+            models.Index(fields=['query', 'agent', 'create_dtime'], name='query_log_agent_idx'),
+            # логи проекта с фильтром по уровню (GET /api/logs/)
+            models.Index(fields=['project', 'level', 'create_dtime'], name='query_log_project_level_idx'),
+        ]
 
     def __str__(self):
-        return f"Log for Query #{self.query.id}"
+        return f"Log for Query #{self.query_id}"
 
 
 class TokenUsageLog(models.Model):
@@ -107,6 +162,11 @@ class TokenUsageLog(models.Model):
     system_prompt = models.TextField(blank=True, verbose_name='System Prompt')
     user_prompt = models.TextField(blank=True, verbose_name='User Prompt')
     agent_prompt = models.TextField(blank=True, verbose_name='Agent Prompt')
+    # Время вызова модели по часам агента; duration_ms без started_at/finished_at - тоже допустимо
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Started At')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Finished At')
+    duration_ms = models.PositiveIntegerField(null=True, blank=True, verbose_name='Duration (ms)')
+    time_to_first_token_ms = models.PositiveIntegerField(null=True, blank=True, verbose_name='Time To First Token (ms)')
 
     class Meta:
         db_table = 'token_usage_logs'
@@ -115,4 +175,228 @@ class TokenUsageLog(models.Model):
         ordering = ['-datetime']
 
     def __str__(self):
-        return f"{self.ai_agent_name} - {self.total_tokens} tokens"
\ No newline at end of file
+        return f"{self.ai_agent_name} - {self.total_tokens} tokens"
+
+
+class ProjectTokenCounter(models.Model):
+    """
+    Расход токенов проекта за день или месяц для проверки бюджета без SUM по TokenUsageLog.
+    Увеличивается атомарным UPDATE при записи TokenUsageLog (queries/token_budget.py),
+    пересчитывается из логов командой reconcile_token_counters
+    """
+    PERIOD_DAY = 'day'
+    PERIOD_MONTH = 'month'
+    PERIOD_CHOICES = [
+        (PERIOD_DAY, 'Day'),
+        (PERIOD_MONTH, 'Month'),
+    ]
+
+    project = models.ForeignKey(
+        'projects.Project',
+        on_delete=models.CASCADE,
+        related_name='token_counters',
+        verbose_name='Project'
+    )
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES, verbose_name='Period')
+    # Первый день периода (дня или месяца) в часовом поясе TIME_ZONE
+    period_start = models.DateField(verbose_name='Period Start')
+    tokens = models.PositiveBigIntegerField(default=0, verbose_name='Tokens')
+
+    class Meta:
+        db_table = 'project_token_counters'
+        verbose_name = 'Project Token Counter'
+        verbose_name_plural = 'Project Token Counters'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['project', 'period', 'period_start'], name='project_token_counter_unique'
+            ),
+        ]
+        indexes = [
+            # проекты сверх бюджета за текущий период (claim_next)
+            models.Index(fields=['period', 'period_start'], name='token_counter_period_idx'),
+        ]
+
+    def __str__(self):
+        return f"Project #{self.project_id} {self.period} {self.period_start}: {self.tokens} tokens"
+
+
+class AnswerChunk(models.Model):
+    """
+    Часть ответа, которую агент публикует по мере генерации (queries/answer_chunks.py).
+    Части дописываются без изменения строки Query; порядок - по id.
+    При завершении запроса части собираются в Query.answer_text и удаляются
+    """
+    query = models.ForeignKey(
+        Query,
+        on_delete=models.CASCADE,
+        related_name='answer_chunks',
+        # Покрывается индексом (query, id)
+        db_index=False,
+        verbose_name='Query'
+    )
+    text = models.TextField(verbose_name='Text')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
+
+    class Meta:
+        db_table = 'query_answer_chunks'
+        verbose_name = 'Answer Chunk'
+        verbose_name_plural = 'Answer Chunks'
+        ordering = ['id']
+        indexes = [
+            # части ответа запроса после ?after=<id>
+            models.Index(fields=['query', 'id'], name='answer_chunk_query_idx'),
+        ]
+
+    def __str__(self):
+        return f"Answer chunk #{self.id} of Query #{self.query_id}"
+
+
+class AnswerCacheEntry(models.Model):
+    """
+    Закешированный ответ на запрос проекта.
+    Ключ - нормализованный текст запроса и версия контекста проекта
+    """
+    project = models.ForeignKey(
+        'projects.Project',
+        on_delete=models.CASCADE,
+        related_name='answer_cache_entries',
+        verbose_name='Project'
+    )
+    context_version = models.PositiveIntegerField(verbose_name='Context Version')
+    text_hash = models.CharField(max_length=64, verbose_name='Normalized Text Hash')
+    normalized_text = models.TextField(verbose_name='Normalized Text')
+    answer_text = models.TextField(verbose_name='Answer Text')
+    query = models.ForeignKey(
+        Query,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='answer_cache_entries',
+        verbose_name='Source Query'
+    )
+    hits = models.PositiveIntegerField(default=0, verbose_name='Hits')
+    created_at = models.DateTimeField(verbose_name='Created At')
+    last_used_at = models.DateTimeField(verbose_name='Last Used At')
+
+    class Meta:
+        db_table = 'answer_cache_entries'
+        verbose_name = 'Answer Cache Entry'
+        verbose_name_plural = 'Answer Cache Entries'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['project', 'context_version', 'text_hash'], name='answer_cache_unique_key'
+            ),
+        ]
+        indexes = [
+            # вытеснение давно не использованных записей
+            models.Index(fields=['project', 'last_used_at'], name='answer_cache_lru_idx'),
+        ]
+
+    def __str__(self):
+        return f"Cached answer for project #{self.project_id}: {self.normalized_text[:50]}"
+
+
+class AnswerCacheStats(models.Model):
+    """
+    Счетчики попаданий и промахов кэша ответов по проекту
+    """
+    project = models.OneToOneField(
+        'projects.Project',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='answer_cache_stats',
+        verbose_name='Project'
+    )
+    hits = models.PositiveBigIntegerField(default=0, verbose_name='Hits')
+    misses = models.PositiveBigIntegerField(default=0, verbose_name='Misses')
+
+    class Meta:
+        db_table = 'answer_cache_stats'
+        verbose_name = 'Answer Cache Stats'
+        verbose_name_plural = 'Answer Cache Stats'
+
+    def __str__(self):
+        return f"Answer cache stats for project #{self.project_id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Ключ идемпотентности (заголовок Idempotency-Key) и сохраненный ответ на запрос с ним.
+    Уникальность ключа обеспечивает ограничение БД, поэтому из одновременных повторов
+    запрос выполняет только один (см. queries/idempotency.py)
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys',
+        verbose_name='User'
+    )
+    endpoint = models.CharField(max_length=50, verbose_name='Endpoint')
+    key = models.CharField(max_length=255, verbose_name='Key')
+    request_hash = models.CharField(max_length=64, verbose_name='Request Body Hash')
+    # Пока запрос выполняется, ответа еще нет
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='Response Status')
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder, verbose_name='Response Body')
+    created_at = models.DateTimeField(verbose_name='Created At')
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        verbose_name = 'Idempotency Key'
+        verbose_name_plural = 'Idempotency Keys'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'endpoint', 'key'], name='idempotency_key_unique'),
+        ]
+        indexes = [
+            # удаление истекших ключей
+            models.Index(fields=['created_at'], name='idempotency_key_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key} (user #{self.user_id})"
+
+
+class TokenLatencyBucket(models.Model):
+    """
+    Часовая гистограмма задержек вызовов моделей для отчета о перцентилях без чтения TokenUsageLog:
+    число вызовов проекта, модели и агента за час, попавших в интервал LATENCY_BUCKETS_MS.
+    Увеличивается атомарным UPDATE при записи TokenUsageLog с duration_ms или
+    time_to_first_token_ms (queries/token_latency.py), пересчитывается командой rebuild_token_latency
+    """
+    METRIC_DURATION = 'duration'
+    METRIC_TTFT = 'ttft'
+    METRIC_CHOICES = [
+        (METRIC_DURATION, 'Duration'),
+        (METRIC_TTFT, 'Time to first token'),
+    ]
+
+    project = models.ForeignKey(
+        'projects.Project',
+        on_delete=models.CASCADE,
+        related_name='token_latency_buckets',
+        verbose_name='Project'
+    )
+    # Начало часа (UTC)
+    hour = models.DateTimeField(verbose_name='Hour')
+    model_name = models.CharField(max_length=50, verbose_name='Model Name')
+    ai_agent_name = models.CharField(max_length=50, verbose_name='AI Agent Name')
+    metric = models.CharField(max_length=8, choices=METRIC_CHOICES, verbose_name='Metric')
+    # Индекс интервала в token_latency.LATENCY_BUCKETS_MS (последний - больше всех границ)
+    bucket = models.PositiveSmallIntegerField(verbose_name='Bucket')
+    calls = models.PositiveBigIntegerField(default=0, verbose_name='Calls')
+    total_ms = models.PositiveBigIntegerField(default=0, verbose_name='Total (ms)')
+    # Выходные токены вызовов (для скорости генерации; только у METRIC_DURATION)
+    output_tokens = models.PositiveBigIntegerField(default=0, verbose_name='Output Tokens')
+
+    class Meta:
+        db_table = 'token_latency_buckets'
+        verbose_name = 'Token Latency Bucket'
+        verbose_name_plural = 'Token Latency Buckets'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hour', 'project', 'model_name', 'ai_agent_name', 'metric', 'bucket'],
+                name='token_latency_bucket_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Project #{self.project_id} {self.model_name}/{self.ai_agent_name} {self.metric} {self.hour}: {self.calls}"
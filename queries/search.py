@@ -0,0 +1,289 @@
+"""
+Полнотекстовый поиск по запросам и логам.
+
+Индекс хранится в самой БД и обновляется ею же при каждой записи строки,
+поэтому его поддерживают и обычные save(), и bulk_create/update/delete:
+
+- SQLite: внешние FTS5-таблицы queries_fts и query_logs_fts и триггеры
+  на queries/query_logs (токенизатор unicode61, поиск по префиксам слов);
+- PostgreSQL: столбцы search_vector (tsvector) с GIN-индексами, конфигурация
+  FULL_TEXT_SEARCH_CONFIG (по умолчанию 'russian', со стеммингом); у queries
+  столбец заполняет триггер только при изменении query_text/answer_text (смена
+  статуса его не пересчитывает), у query_logs - генерируемый столбец.
+
+Для остальных СУБД используется icontains (без индекса).
+Схема создается миграциями 0006_full_text_search и 0013_query_search_vector_trigger
+(DDL записан в самих миграциях). SQLite пересоздает таблицу
+при части ALTER TABLE и теряет ее триггеры, поэтому после каждого migrate
+триггеры проверяются и при необходимости восстанавливаются (ensure_index).
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Query, QueryLog
+
+# Ответ и логи весят меньше текста самого запроса
+QUERY_TEXT_WEIGHT = 2.0
+ANSWER_TEXT_WEIGHT = 1.0
+LOG_MATCH_WEIGHT = 0.5
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+# Совпадают с триггерами миграции 0006_full_text_search
+SQLITE_TRIGGERS = {
+    'queries_fts_insert': """
+        CREATE TRIGGER IF NOT EXISTS queries_fts_insert AFTER INSERT ON queries BEGIN
+            INSERT INTO queries_fts(rowid, query_text, answer_text, project_id)
+            VALUES (new.id, new.query_text, new.answer_text, new.project_id);
+        END
+    """,
+    'queries_fts_delete': """
+        CREATE TRIGGER IF NOT EXISTS queries_fts_delete AFTER DELETE ON queries BEGIN
+            INSERT INTO queries_fts(queries_fts, rowid, query_text, answer_text, project_id)
+            VALUES ('delete', old.id, old.query_text, old.answer_text, old.project_id);
+        END
+    """,
+    'queries_fts_update': """
+        CREATE TRIGGER IF NOT EXISTS queries_fts_update AFTER UPDATE OF query_text, answer_text, project_id ON queries
+        WHEN old.query_text IS NOT new.query_text OR old.answer_text IS NOT new.answer_text
+            OR old.project_id IS NOT new.project_id BEGIN
+            INSERT INTO queries_fts(queries_fts, rowid, query_text, answer_text, project_id)
+            VALUES ('delete', old.id, old.query_text, old.answer_text, old.project_id);
+            INSERT INTO queries_fts(rowid, query_text, answer_text, project_id)
+            VALUES (new.id, new.query_text, new.answer_text, new.project_id);
+        END
+    """,
+    'query_logs_fts_insert': """
+        CREATE TRIGGER IF NOT EXISTS query_logs_fts_insert AFTER INSERT ON query_logs BEGIN
+            INSERT INTO query_logs_fts(rowid, log_data, query_id, project_id)
+            VALUES (new.id, new.log_data, new.query_id, new.project_id);
+        END
+    """,
+    'query_logs_fts_delete': """
+        CREATE TRIGGER IF NOT EXISTS query_logs_fts_delete AFTER DELETE ON query_logs BEGIN
+            INSERT INTO query_logs_fts(query_logs_fts, rowid, log_data, query_id, project_id)
+            VALUES ('delete', old.id, old.log_data, old.query_id, old.project_id);
+        END
+    """,
+    'query_logs_fts_update': """
+        CREATE TRIGGER IF NOT EXISTS query_logs_fts_update AFTER UPDATE OF log_data, query_id, project_id ON query_logs
+        WHEN old.log_data IS NOT new.log_data OR old.query_id IS NOT new.query_id
+            OR old.project_id IS NOT new.project_id BEGIN
+            INSERT INTO query_logs_fts(query_logs_fts, rowid, log_data, query_id, project_id)
+            VALUES ('delete', old.id, old.log_data, old.query_id, old.project_id);
+            INSERT INTO query_logs_fts(rowid, log_data, query_id, project_id)
+            VALUES (new.id, new.log_data, new.query_id, new.project_id);
+        END
+    """,
+}
+
+
+class SearchBackend:
+    """
+    Общий интерфейс: методы возвращают списки (id, score), отсортированные
+    по убыванию score. project_ids=None - без ограничения по проектам
+    """
+    vendor = None
+
+    def search_queries(self, text, project_ids=None, limit=50):
+        raise NotImplementedError
+
+    def search_logs(self, text, project_ids=None, limit=50):
+        """Возвращает (query_id, score) запросов, в логах которых найден текст"""
+        raise NotImplementedError
+
+    def search_log_ids(self, text, project_ids=None, limit=1000):
+        """Возвращает id самих логов (для админки)"""
+        raise NotImplementedError
+
+    def ensure_index(self, db_connection):
+        """Восстановить недостающие части индекса; возвращает True, если что-то восстановлено"""
+        return False
+
+    def rebuild(self):
+        """Перестроить индекс целиком (после восстановления из дампа и т.п.)"""
+
+    @staticmethod
+    def _project_filter(column, project_ids):
+        if project_ids is None:
+            return '', []
+        project_ids = [int(project_id) for project_id in project_ids]
+        if not project_ids:
+            return ' AND 1 = 0', []
+        placeholders = ', '.join(['%s'] * len(project_ids))
+        return f' AND {column} IN ({placeholders})', project_ids
+
+    @staticmethod
+    def _fetch(sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(row[0], float(row[1])) for row in cursor.fetchall()]
+
+
+class SQLiteSearchBackend(SearchBackend):
+    vendor = 'sqlite'
+
+    @staticmethod
+    def match_expression(text):
+        """Каждое слово - префиксный терм FTS5; все слова должны встретиться"""
+        words = _WORD.findall(text)
+        return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+    def search_queries(self, text, project_ids=None, limit=50):
+        match = self.match_expression(text)
+        if not match:
+            return []
+        project_sql, project_params = self._project_filter('project_id', project_ids)
+        # bm25 тем меньше, чем лучше совпадение; project_id хранится в самой FTS-таблице,
+        # потому что bm25 доступна, только когда выборку ведет FTS-таблица
+        return self._fetch(
+            'SELECT rowid, -bm25(queries_fts, %s, %s, 0) AS score FROM queries_fts '
+            f'WHERE queries_fts MATCH %s{project_sql} '
+            'ORDER BY score DESC LIMIT %s',
+            [QUERY_TEXT_WEIGHT, ANSWER_TEXT_WEIGHT, match, *project_params, limit]
+        )
+
+    def search_logs(self, text, project_ids=None, limit=50):
+        match = self.match_expression(text)
+        if not match:
+            return []
+        project_sql, project_params = self._project_filter('project_id', project_ids)
+        return self._fetch(
+            # LIMIT -1 не дает SQLite развернуть подзапрос в GROUP BY, где bm25 недоступна
+            'SELECT query_id, MAX(score) AS score FROM ('
+            '  SELECT query_id, -bm25(query_logs_fts) AS score FROM query_logs_fts '
+            f'  WHERE query_logs_fts MATCH %s{project_sql} LIMIT -1'
+            ') GROUP BY query_id ORDER BY score DESC LIMIT %s',
+            [match, *project_params, limit]
+        )
+
+    def search_log_ids(self, text, project_ids=None, limit=1000):
+        match = self.match_expression(text)
+        if not match:
+            return []
+        project_sql, project_params = self._project_filter('project_id', project_ids)
+        return self._fetch(
+            'SELECT rowid, -bm25(query_logs_fts) AS score FROM query_logs_fts '
+            f'WHERE query_logs_fts MATCH %s{project_sql} '
+            'ORDER BY score DESC LIMIT %s',
+            [match, *project_params, limit]
+        )
+
+    def ensure_index(self, db_connection):
+        with db_connection.cursor() as cursor:
+            cursor.execute('SELECT name FROM sqlite_master WHERE name LIKE %s', ['%fts%'])
+            existing = {name for (name,) in cursor.fetchall()}
+            if 'queries_fts' not in existing:
+                # Миграция индекса еще не применена (или откачена)
+                return False
+            missing = [sql for name, sql in SQLITE_TRIGGERS.items() if name not in existing]
+            for statement in missing:
+                cursor.execute(statement)
+        if missing:
+            self._rebuild(db_connection)
+        return bool(missing)
+
+    def rebuild(self):
+        self._rebuild(connection)
+
+    @staticmethod
+    def _rebuild(db_connection):
+        with db_connection.cursor() as cursor:
+            cursor.execute("INSERT INTO queries_fts(queries_fts) VALUES('rebuild')")
+            cursor.execute("INSERT INTO query_logs_fts(query_logs_fts) VALUES('rebuild')")
+
+
+class PostgresSearchBackend(SearchBackend):
+    vendor = 'postgresql'
+
+    def search_queries(self, text, project_ids=None, limit=50):
+        if not _WORD.search(text):
+            return []
+        project_sql, project_params = self._project_filter('q.project_id', project_ids)
+        # Веса: A - текст запроса, B - ответ (см. миграцию); {D, C, B, A}
+        return self._fetch(
+            'SELECT q.id, ts_rank_cd(%s::float4[], q.search_vector, tsq) AS score '
+            'FROM queries q, websearch_to_tsquery(%s::regconfig, %s) tsq '
+            f'WHERE q.search_vector @@ tsq{project_sql} '
+            'ORDER BY score DESC LIMIT %s',
+            [[0.1, 0.2, ANSWER_TEXT_WEIGHT / QUERY_TEXT_WEIGHT, 1.0],
+             settings.FULL_TEXT_SEARCH_CONFIG, text, *project_params, limit]
+        )
+
+    def search_logs(self, text, project_ids=None, limit=50):
+        if not _WORD.search(text):
+            return []
+        project_sql, project_params = self._project_filter('l.project_id', project_ids)
+        return self._fetch(
+            'SELECT l.query_id, MAX(ts_rank_cd(l.search_vector, tsq)) AS score '
+            'FROM query_logs l, websearch_to_tsquery(%s::regconfig, %s) tsq '
+            f'WHERE l.search_vector @@ tsq{project_sql} '
+            'GROUP BY l.query_id ORDER BY score DESC LIMIT %s',
+            [settings.FULL_TEXT_SEARCH_CONFIG, text, *project_params, limit]
+        )
+
+    def search_log_ids(self, text, project_ids=None, limit=1000):
+        if not _WORD.search(text):
+            return []
+        project_sql, project_params = self._project_filter('l.project_id', project_ids)
+        return self._fetch(
+            'SELECT l.id, ts_rank_cd(l.search_vector, tsq) AS score '
+            'FROM query_logs l, websearch_to_tsquery(%s::regconfig, %s) tsq '
+            f'WHERE l.search_vector @@ tsq{project_sql} '
+            'ORDER BY score DESC LIMIT %s',
+            [settings.FULL_TEXT_SEARCH_CONFIG, text, *project_params, limit]
+        )
+
+
+class FallbackSearchBackend(SearchBackend):
+    """Поиск без индекса для СУБД без поддержки полнотекстового поиска"""
+
+    def search_queries(self, text, project_ids=None, limit=50):
+        queryset = Query.objects.filter(Q(query_text__icontains=text) | Q(answer_text__icontains=text))
+        if project_ids is not None:
+            queryset = queryset.filter(project_id__in=project_ids)
+        return [(pk, 1.0) for pk in queryset.values_list('id', flat=True)[:limit]]
+
+    def search_logs(self, text, project_ids=None, limit=50):
+        queryset = QueryLog.objects.filter(log_data__icontains=text)
+        if project_ids is not None:
+            queryset = queryset.filter(project_id__in=project_ids)
+        query_ids = queryset.order_by().values_list('query_id', flat=True).distinct()[:limit]
+        return [(pk, 1.0) for pk in query_ids]
+
+    def search_log_ids(self, text, project_ids=None, limit=1000):
+        queryset = QueryLog.objects.filter(log_data__icontains=text)
+        if project_ids is not None:
+            queryset = queryset.filter(project_id__in=project_ids)
+        return [(pk, 1.0) for pk in queryset.values_list('id', flat=True)[:limit]]
+
+
+_BACKENDS = {
+    'sqlite': SQLiteSearchBackend(),
+    'postgresql': PostgresSearchBackend(),
+}
+_FALLBACK = FallbackSearchBackend()
+
+
+def get_backend(vendor=None):
+    return _BACKENDS.get(vendor or connection.vendor, _FALLBACK)
+
+
+def search(text, project_ids=None, limit=20):
+    """
+    Ранжированный поиск запросов по тексту запроса, ответу и логам.
+    Возвращает список (query_id, score, match), match - 'query' или 'log'
+    """
+    backend = get_backend()
+    ranked = {}
+    for query_id, score in backend.search_queries(text, project_ids, limit):
+        ranked[query_id] = (score, 'query')
+    for query_id, score in backend.search_logs(text, project_ids, limit):
+        score *= LOG_MATCH_WEIGHT
+        if query_id not in ranked or ranked[query_id][0] < score:
+            ranked[query_id] = (score, 'log')
+    results = sorted(ranked.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+    return [(query_id, score, match) for query_id, (score, match) in results]
@@ -1,4 +1,8 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import cached_property
 from rest_framework import serializers
+from . import answer_chunks, token_latency
 from .models import Query, QueryLog, TokenUsageLog
 
 
@@ -8,7 +12,7 @@ class QueryLogSerializer(serializers.ModelSerializer):
     """
     class Meta:
         model = QueryLog
-        fields = ['id', 'project', 'query', 'log_data', 'create_dtime']
+        fields = ['id', 'project', 'query', 'log_data', 'level', 'agent', 'step', 'payload', 'create_dtime']
         read_only_fields = ['id', 'create_dtime']
 
 
@@ -25,11 +29,14 @@ class QuerySerializer(serializers.ModelSerializer):
         fields = [
             'id', 'project', 'project_name', 'user', 'user_name',
             'query_text', 'answer_text', 'status',
-            'query_created', 'query_started', 'query_finished', 'logs_count'
+            'query_created', 'query_started', 'query_finished', 'logs_count', 'cached_from'
         ]
-        read_only_fields = ['id', 'query_created', 'query_started', 'query_finished', 'user']
+        read_only_fields = ['id', 'query_created', 'query_started', 'query_finished', 'user', 'cached_from']
 
     def get_logs_count(self, obj):
+        # В списках значение приходит аннотацией из QueryViewSet.get_queryset
+        if hasattr(obj, 'annotated_logs_count'):
+            return obj.annotated_logs_count
         return obj.logs.count()
 
 
@@ -37,15 +44,31 @@ class QueryCreateSerializer(serializers.ModelSerializer):
     """
     Serializer for creating Query
     """
+    # False - always queue the query even if the project has a cached answer
+    use_cache = serializers.BooleanField(write_only=True, required=False, default=True)
+
     class Meta:
         model = Query
-        fields = ['project', 'query_text']
+        fields = ['project', 'query_text', 'use_cache']
 
     def create(self, validated_data):
+        validated_data.pop('use_cache', None)
         # User will be set from request.user in viewset
         return Query.objects.create(**validated_data, status='queued')
 
 
+class QueryBulkItemSerializer(serializers.ModelSerializer):
+    """
+    Item of a bulk query submission.
+    project is a plain id: the view resolves all projects of the batch with a single lookup
+    """
+    project = serializers.IntegerField()
+
+    class Meta:
+        model = Query
+        fields = ['project', 'query_text']
+
+
 class QueryDetailSerializer(QuerySerializer):
     """
     Detailed serializer for Query with logs
@@ -55,8 +78,35 @@ class QueryDetailSerializer(QuerySerializer):
     class Meta(QuerySerializer.Meta):
         fields = QuerySerializer.Meta.fields + ['logs']
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # The answer of a query in progress is read from the published chunks
+        data['answer_text'] = answer_chunks.answer_text(instance)
+        return data
 
-class TokenUsageLogSerializer(serializers.ModelSerializer):
+
+class TokenUsageTimingMixin:
+    """
+    Validates the model call timing of a token usage record:
+    duration_ms is derived from started_at/finished_at when not sent explicitly
+    """
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        started_at, finished_at = attrs.get('started_at'), attrs.get('finished_at')
+        if started_at and finished_at:
+            if finished_at < started_at:
+                raise serializers.ValidationError({'finished_at': 'finished_at is earlier than started_at'})
+            if attrs.get('duration_ms') is None:
+                attrs['duration_ms'] = round((finished_at - started_at).total_seconds() * 1000)
+        duration_ms, ttft_ms = attrs.get('duration_ms'), attrs.get('time_to_first_token_ms')
+        if duration_ms is not None and ttft_ms is not None and ttft_ms > duration_ms:
+            raise serializers.ValidationError(
+                {'time_to_first_token_ms': 'time_to_first_token_ms exceeds duration_ms'}
+            )
+        return attrs
+
+
+class TokenUsageLogSerializer(TokenUsageTimingMixin, serializers.ModelSerializer):
     """
     Serializer for TokenUsageLog model
     """
@@ -67,11 +117,104 @@ class TokenUsageLogSerializer(serializers.ModelSerializer):
             'ai_agent_answer', 'datetime', 'model_name', 'model_role',
             'prompt_tokens', 'completion_tokens', 'total_tokens',
             'precached_prompt_tokens', 'input_tokens', 'output_tokens',
-            'system_prompt', 'user_prompt', 'agent_prompt'
+            'system_prompt', 'user_prompt', 'agent_prompt',
+            'started_at', 'finished_at', 'duration_ms', 'time_to_first_token_ms'
         ]
         read_only_fields = ['id', 'datetime']
 
 
+class TokenUsageLogBulkItemSerializer(TokenUsageTimingMixin, serializers.ModelSerializer):
+    """
+    Item of a bulk token usage write.
+    query/project are plain ids: the view resolves them with a single lookup
+    """
+    query = serializers.IntegerField()
+    project = serializers.IntegerField(required=False)
+
+    class Meta:
+        model = TokenUsageLog
+        fields = [
+            'ai_agent_name', 'project', 'query', 'request_to_ai_agent',
+            'ai_agent_answer', 'model_name', 'model_role',
+            'prompt_tokens', 'completion_tokens', 'total_tokens',
+            'precached_prompt_tokens', 'input_tokens', 'output_tokens',
+            'system_prompt', 'user_prompt', 'agent_prompt',
+            'started_at', 'finished_at', 'duration_ms', 'time_to_first_token_ms'
+        ]
+
+
+class QueryFinishLogSerializer(serializers.ModelSerializer):
+    """
+    Final log line of a query sent with complete/fail
+    """
+    class Meta:
+        model = QueryLog
+        fields = ['log_data', 'level', 'agent', 'step', 'payload']
+
+
+class QueryFinishTokenUsageSerializer(TokenUsageTimingMixin, serializers.ModelSerializer):
+    """
+    Token usage record sent with complete/fail; query and project are taken from the query
+    """
+    class Meta:
+        model = TokenUsageLog
+        fields = [
+            field for field in TokenUsageLogBulkItemSerializer.Meta.fields if field not in ('project', 'query')
+        ]
+
+
+class QueryFinishSerializer(serializers.Serializer):
+    """
+    Body of POST /api/queries/{id}/fail/: answer, final logs and token usage written in one transaction
+    """
+    answer_text = serializers.CharField(allow_blank=True, required=False)
+    logs = QueryFinishLogSerializer(many=True, default=list)
+    token_usage = QueryFinishTokenUsageSerializer(many=True, default=list)
+
+    def validate(self, attrs):
+        limit = settings.QUERY_LOG_BULK_MAX_ITEMS
+        for name in ('logs', 'token_usage'):
+            if len(attrs[name]) > limit:
+                raise serializers.ValidationError({name: f'Too many records in one request (max {limit})'})
+        return attrs
+
+
+class QueryCompleteSerializer(QueryFinishSerializer):
+    """
+    Body of POST /api/queries/{id}/complete/.
+    Without answer_text the answer is assembled from the published answer chunks
+    """
+    answer_text = serializers.CharField(required=False)
+
+
+class AnswerChunkSerializer(serializers.Serializer):
+    """
+    Body of POST /api/queries/{id}/answer/: the next part of the answer
+    """
+    text = serializers.CharField(trim_whitespace=False)
+
+
+class QueryBulkDeleteSerializer(serializers.Serializer):
+    """
+    Body of POST /api/queries/bulk_delete/: filters selecting finished queries to delete.
+    ids or finished_before is required so that an empty body never deletes everything
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    status = serializers.ListField(
+        child=serializers.ChoiceField(choices=Query.FINISHED_STATUSES), required=False, allow_empty=False
+    )
+    finished_before = serializers.DateTimeField(required=False)
+    project = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        if 'ids' not in attrs and 'finished_before' not in attrs:
+            raise serializers.ValidationError('Specify ids or finished_before')
+        limit = settings.QUERY_BULK_DELETE_MAX_IDS
+        if len(attrs.get('ids', ())) > limit:
+            raise serializers.ValidationError({'ids': f'Too many ids in one request (max {limit})'})
+        return attrs
+
+
 class TokenUsageStatsSerializer(serializers.Serializer):
     """
     Serializer for token usage statistics
@@ -79,4 +222,91 @@ class TokenUsageStatsSerializer(serializers.Serializer):
     total_tokens = serializers.IntegerField()
     total_requests = serializers.IntegerField()
     by_agent = serializers.DictField()
-    by_model = serializers.DictField()
\ No newline at end of file
+    by_model = serializers.DictField()
+
+
+class TokenLatencyReportSerializer(serializers.Serializer):
+    """
+    Query parameters of GET /api/token-usage/latency/.
+    since/until default to the last 24 hours; group_by is a comma-separated subset of project, model, agent
+    """
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    project = serializers.IntegerField(required=False)
+    model = serializers.CharField(required=False)
+    agent = serializers.CharField(required=False)
+    group_by = serializers.CharField(required=False, default=','.join(token_latency.GROUP_FIELDS))
+
+    def validate_group_by(self, value):
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in token_latency.GROUP_FIELDS]
+        if unknown or not names:
+            raise serializers.ValidationError(f"Expected a subset of: {', '.join(token_latency.GROUP_FIELDS)}")
+        return tuple(dict.fromkeys(names))
+
+    def validate(self, attrs):
+        since, until = attrs.get('since'), attrs.get('until')
+        if since and until and until <= since:
+            raise serializers.ValidationError({'until': 'until must be later than since'})
+        return attrs
+
+
+class ValuesSerializer:
+    """
+    Serializer-free read path for hot list endpoints: rows of queryset.values()
+    are turned into dicts with the same keys, order and values as serializer_class.
+
+    Field handling is derived from serializer_class itself, so adding a field to the
+    serializer is enough. Fields whose representation equals the database value
+    (ids, strings, integers, choices, JSON) are copied as is; datetime fields go
+    through the serializer field's own to_representation; None stays None, as in DRF.
+    sources maps fields without a model attribute (SerializerMethodField) to an
+    annotation of the queryset
+    """
+    PASSTHROUGH_FIELDS = (
+        serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+        serializers.ChoiceField, serializers.JSONField, serializers.PrimaryKeyRelatedField,
+    )
+    CONVERTED_FIELDS = (serializers.DateTimeField, serializers.DateField)
+
+    def __init__(self, serializer_class, sources=None):
+        self.serializer_class = serializer_class
+        self.sources = sources or {}
+
+    @cached_property
+    def columns(self):
+        """(output key, values() lookup, converter or None) per readable field"""
+        columns = []
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if name in self.sources:
+                columns.append((name, self.sources[name], None))
+            elif isinstance(field, self.CONVERTED_FIELDS):
+                columns.append((name, field.source.replace('.', '__'), field.to_representation))
+            elif isinstance(field, self.PASSTHROUGH_FIELDS) and not getattr(field, 'binary', False):
+                columns.append((name, field.source.replace('.', '__'), None))
+            else:
+                raise ImproperlyConfigured(
+                    f'{self.serializer_class.__name__}.{name}: {type(field).__name__} has no values() fast path'
+                )
+        return columns
+
+    def values(self, queryset):
+        return queryset.values(*{lookup: None for _, lookup, _ in self.columns})
+
+    def to_representation(self, rows):
+        columns = self.columns
+        data = []
+        for row in rows:
+            item = {}
+            for name, lookup, convert in columns:
+                value = row[lookup]
+                item[name] = value if convert is None or value is None else convert(value)
+            data.append(item)
+        return data
+
+
+query_values = ValuesSerializer(QuerySerializer, sources={'logs_count': 'annotated_logs_count'})
+query_log_values = ValuesSerializer(QueryLogSerializer)
+token_usage_log_values = ValuesSerializer(TokenUsageLogSerializer)
@@ -0,0 +1,154 @@
+"""
+Операции над очередью запросов, общие для sync (DRF) и async представлений
+"""
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from . import answer_chunks, events, metrics, token_budget, token_latency
+from .models import QueryLog, TokenUsageLog
+
+
+def scope_to_user(queryset, user):
+    """
+    Ограничить queryset проектом пользователя.
+    Сервисные аккаунты и администраторы видят все проекты
+    """
+    if user.has_cross_project_access():
+        return queryset
+    return queryset.filter(project_id=user.project_id)
+
+
+def filter_logs(queryset, params):
+    """
+    Серверные фильтры логов: ?level=warning,error&agent=planner&step=review.
+    Неизвестный уровень - ValidationError (400)
+    """
+    levels = [level.strip() for level in params.get('level', '').split(',') if level.strip()]
+    if levels:
+        unknown = set(levels) - {value for value, _ in QueryLog.LEVEL_CHOICES}
+        if unknown:
+            raise ValidationError({'level': [f"Unknown log level: {', '.join(sorted(unknown))}"]})
+        queryset = queryset.filter(level__in=levels)
+    for name in ('agent', 'step'):
+        value = params.get(name)
+        if value:
+            queryset = queryset.filter(**{name: value})
+    return queryset
+
+
+class QueryCancelled(APIException):
+    """Запрос отменен пользователем: воркеру больше нельзя менять его статус и ответ"""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Query was cancelled'
+    default_code = 'query_cancelled'
+
+
+class InvalidStatusTransition(APIException):
+    """Переход запроса в новый статус из текущего недопустим (см. Query.STATUS_TRANSITIONS)"""
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_code = 'invalid_status_transition'
+
+    def __init__(self, old_status, new_status):
+        super().__init__(f"Нельзя перевести запрос из статуса '{old_status}' в '{new_status}'")
+
+
+def claim_next_query(queryset):
+    """
+    Атомарно взять первый запрос из очереди и перевести его в 'in_progress'.
+    Отмененные запросы не берутся: отмена меняет статус 'queued' на 'cancelled'.
+    Запросы проектов, исчерпавших бюджет токенов, остаются в очереди.
+    Возвращает запрос или None, если очередь пуста.
+
+    Проигранная гонка (строку между выборкой и UPDATE забрал другой воркер) не
+    означает пустую очередь: выборка повторяется, пока не вернет None. Цикл конечен -
+    каждая проигранная гонка убирает из очереди строку, взятую другим воркером
+    """
+    while True:
+        with transaction.atomic():
+            # Блокировка строки; уже заблокированные другими воркерами пропускаются
+            query = queryset.select_for_update(skip_locked=True, of=('self',)).filter(
+                status='queued'
+            ).exclude(
+                project_id__in=token_budget.over_budget_project_ids()
+            ).order_by('query_created').first()
+
+            if query is None:
+                return None
+
+            # Условный UPDATE: без SELECT ... FOR UPDATE (SQLite) строку мог уже забрать другой воркер
+            now = timezone.now()
+            claimed = type(query).objects.filter(pk=query.pk, status='queued').update(
+                status='in_progress', query_started=now
+            )
+        if claimed:
+            query.status = 'in_progress'
+            query.query_started = now
+            metrics.observe_claim(query)
+            return query
+
+
+def cancel_query(query):
+    """
+    Отменить запрос в статусе 'queued' или 'in_progress'.
+    Условный UPDATE не дает отмене перезаписать запрос, который воркер успел завершить,
+    а claim_next - взять запрос, отмененный между выборкой и захватом.
+    Возвращает True, если запрос отменен этим вызовом
+    """
+    now = timezone.now()
+    cancelled = type(query).objects.filter(pk=query.pk, status__in=query.ACTIVE_STATUSES).update(
+        status='cancelled', query_finished=now
+    )
+    if cancelled:
+        query.status = 'cancelled'
+        query.query_finished = now
+        metrics.observe_completion(query)
+    return bool(cancelled)
+
+
+def finish_query(query, new_status, answer_text=None, logs=(), token_usage=()):
+    """
+    Завершить запрос ('done' или 'failed') одной транзакцией: ответ, время завершения
+    (по часам сервера), последние логи и использование токенов вместе со счетчиками бюджета.
+    answer_text=None - ответ собирается из опубликованных частей (answer_chunks);
+    части в любом случае удаляются.
+    logs и token_usage - проверенные данные записей без query/project.
+    Условный UPDATE не дает завершить отмененный или уже завершенный запрос:
+    тогда ничего не записывается и выбрасывается QueryCancelled или InvalidStatusTransition
+    """
+    now = timezone.now()
+    model = type(query)
+    with transaction.atomic():
+        chunks = answer_chunks.collapse(query.pk)
+        if answer_text is None:
+            answer_text = chunks
+        if new_status == 'done' and not answer_text:
+            raise ValidationError({'answer_text': ['Answer is required: pass answer_text or publish answer chunks']})
+
+        finished = model.objects.filter(pk=query.pk, status__in=model.statuses_before(new_status)).update(
+            status=new_status, answer_text=answer_text, query_finished=now
+        )
+        if not finished:
+            # Исключение внутри транзакции откатывает и удаление частей ответа
+            current_status = model.objects.filter(pk=query.pk).values_list('status', flat=True).first()
+            if current_status == 'cancelled':
+                raise QueryCancelled()
+            raise InvalidStatusTransition(current_status, new_status)
+
+        QueryLog.objects.bulk_create([
+            QueryLog(project_id=query.project_id, query_id=query.pk, **log) for log in logs
+        ])
+        token_logs = TokenUsageLog.objects.bulk_create([
+            TokenUsageLog(project_id=query.project_id, query_id=query.pk, **record) for record in token_usage
+        ])
+        token_budget.record_usage(token_logs)
+        token_latency.record_latency(token_logs)
+
+    query.status = new_status
+    query.answer_text = answer_text
+    query.query_finished = now
+    metrics.observe_completion(query)
+    # Будим потоки логов (SSE): новые логи и событие завершения
+    events.log_written.notify()
+    return query
@@ -1,9 +1,9 @@
-from django.db.models.signals import post_save
+from django.db import connections
+from django.db.models.signals import post_migrate, post_save
 from django.dispatch import receiver
-from django.conf import settings
-from .models import Query
+from .models import Query, QueryLog
 from .utils import notify_fastapi_async
-import threading
+from . import events, search
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,17 +17,32 @@ def handle_query_created(sender, instance, created, **kwargs):
     Если FastAPI недоступен - запрос останется в БД со статусом 'queued'
     и будет обработан через polling механизм (claim_next endpoint).
 
-    Уведомление отправляется в отдельном потоке, чтобы не блокировать
-    ответ пользователю.
+    Уведомление отправляется в фоновом event loop, чтобы не блокировать
+    ответ пользователю. Ожидающие long-poll claim в этом процессе будятся сразу.
     """
     if created and instance.status == 'queued':
         logger.info(f"New query {instance.id} created, notifying FastAPI...")
+        notify_fastapi_async(instance.id)
+        events.query_queued.notify()
 
-        # Запускаем отправку в отдельном потоке
-        # daemon=True означает, что поток завершится при завершении программы
-        thread = threading.Thread(
-            target=notify_fastapi_async,
-            args=(instance.id,),
-            daemon=True
-        )
-        thread.start()
\ No newline at end of file
+
+@receiver(post_save, sender=QueryLog)
+def handle_log_created(sender, instance, created, **kwargs):
+    """
+    Будим подписчиков потока логов (SSE) в этом процессе
+    """
+    if created:
+        events.log_written.notify()
+
+
+@receiver(post_migrate)
+def ensure_search_index(sender, using, **kwargs):
+    """
+    Восстанавливаем триггеры полнотекстового индекса SQLite, если миграция
+    пересоздала таблицу queries/query_logs
+    """
+    if sender.name != 'queries':
+        return
+    db_connection = connections[using]
+    if search.get_backend(db_connection.vendor).ensure_index(db_connection):
+        logger.info("Full-text search triggers were missing and have been restored")
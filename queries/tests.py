@@ -1,3 +1,1679 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from projects.models import Project
+from users.models import User
+from webbuddy.testing import ApiTestCase, QueryBudgetMixin, jwt_async_client, jwt_client
+from . import admission, deletion, events, idempotency, metrics, search, services, token_budget, token_latency
+from .models import (
+    AnswerCacheEntry, AnswerChunk, IdempotencyKey, ProjectTokenCounter, Query, QueryLog, TokenLatencyBucket,
+    TokenUsageLog
+)
+
+
+def create_queries(project, user, count, logs_per_query=5, token_logs_per_query=2, status='done'):
+    queries = Query.objects.bulk_create([
+        Query(project=project, user=user, query_text=f'Query {i}', status=status)
+        for i in range(count)
+    ])
+    QueryLog.objects.bulk_create([
+        QueryLog(project=project, query=query, log_data=f'log {n}')
+        for query in queries for n in range(logs_per_query)
+    ])
+    TokenUsageLog.objects.bulk_create([
+        TokenUsageLog(
+            ai_agent_name='planner', project=project, query=query,
+            request_to_ai_agent='req', ai_agent_answer='ans',
+            model_name='gpt-4o', model_role='assistant', total_tokens=100,
+        )
+        for query in queries for _ in range(token_logs_per_query)
+    ])
+    return queries
+
+
+def spend_tokens(project, tokens, moment=None):
+    """Учесть расход токенов проекта в счетчиках бюджета без записи лога"""
+    token_budget.record_usage([
+        TokenUsageLog(project_id=project.id, total_tokens=tokens, datetime=moment or timezone.now())
+    ])
+
+
+class QueryApiQueryBudgetTests(ApiTestCase):
+    """
+    Бюджеты SQL-запросов для эндпоинтов queries.
+    Бюджет включает аутентификацию по JWT (1 запрос) и не зависит от размера страницы
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.queries = create_queries(cls.project, cls.user, 20)
+        create_queries(cls.other_project, cls.other_user, 10)
+
+    def grow_queries(self, count=25):
+        return lambda: create_queries(self.project, self.user, count)
+
+    def test_list(self):
+        with self.assertQueryBudget(3, 'GET /api/queries/'):
+            response = self.client.get('/api/queries/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['logs_count'], 5)
+        self.assertQueryCountIndependentOf(
+            lambda: self.client.get('/api/queries/'), self.grow_queries(), 'GET /api/queries/'
+        )
+
+    def test_list_cross_project(self):
+        with self.assertQueryBudget(3, 'GET /api/queries/ (service)'):
+            response = self.service_client.get('/api/queries/')
+        self.assertEqual(response.data['count'], 30)
+
+    def test_by_status(self):
+        with self.assertQueryBudget(3, 'GET /api/queries/by_status/'):
+            response = self.client.get('/api/queries/by_status/?status=done')
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryCountIndependentOf(
+            lambda: self.client.get('/api/queries/by_status/?status=done'), self.grow_queries(),
+            'GET /api/queries/by_status/'
+        )
+
+    def test_retrieve(self):
+        query = self.queries[0]
+        with self.assertQueryBudget(4, 'GET /api/queries/{id}/'):
+            response = self.client.get(f'/api/queries/{query.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryCountIndependentOf(
+            lambda: self.client.get(f'/api/queries/{query.id}/'),
+            lambda: QueryLog.objects.bulk_create([
+                QueryLog(project=self.project, query=query, log_data='extra') for _ in range(30)
+            ]),
+            'GET /api/queries/{id}/'
+        )
+
+    def test_logs(self):
+        query = self.queries[0]
+        with self.assertQueryBudget(4, 'GET /api/queries/{id}/logs/'):
+            response = self.client.get(f'/api/queries/{query.id}/logs/')
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryCountIndependentOf(
+            lambda: self.client.get(f'/api/queries/{query.id}/logs/'),
+            lambda: QueryLog.objects.bulk_create([
+                QueryLog(project=self.project, query=query, log_data='extra') for _ in range(30)
+            ]),
+            'GET /api/queries/{id}/logs/'
+        )
+
+    def test_create(self):
+        with self.assertQueryBudget(4, 'POST /api/queries/'):
+            response = self.client.post(
+                '/api/queries/', {'project': self.project.id, 'query_text': 'New'}, format='json'
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def test_partial_update(self):
+        query = Query.objects.create(project=self.project, user=self.user, query_text='q', status='in_progress')
+        # +3: SAVEPOINT/RELEASE и выборка частей ответа при завершении
+        with self.assertQueryBudget(8, 'PATCH /api/queries/{id}/'):
+            response = self.service_client.patch(
+                f'/api/queries/{query.id}/', {'status': 'done', 'answer_text': 'ok'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_destroy(self):
+        query = self.queries[0]
+        # Пачки логов и логов токенов, части ответа, SET NULL для ссылок кэша ответов
+        # и DELETE запроса в одной транзакции (SAVEPOINT/RELEASE)
+        with self.assertQueryBudget(10, 'DELETE /api/queries/{id}/'):
+            response = self.client.delete(f'/api/queries/{query.id}/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_claim_next(self):
+        Query.objects.create(project=self.project, user=self.user, query_text='q', status='queued')
+        # Включая SAVEPOINT/RELEASE транзакции захвата
+        with self.assertQueryBudget(6, 'POST /api/queries/claim_next/'):
+            response = self.service_client.post('/api/queries/claim_next/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_claim_next_retries_lost_races(self):
+        Query.objects.update(status='done')
+        queued = create_queries(self.project, self.user, 8, 0, 0, status='queued')
+        races = []
+
+        def steal_selected_row():
+            # Другой воркер забирает выбранную строку между SELECT и условным UPDATE
+            if len(races) < 7:
+                stolen = Query.objects.filter(status='queued').order_by('query_created').first()
+                Query.objects.filter(pk=stolen.pk).update(status='in_progress')
+                races.append(stolen.pk)
+            return timezone.now()
+
+        with mock.patch.object(services, 'timezone', **{'now.side_effect': steal_selected_row}):
+            response = self.service_client.post('/api/queries/claim_next/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(races), 7)
+        remaining, = set(query.id for query in queued) - set(races)
+        self.assertEqual(response.data['id'], remaining)
+
+        Query.objects.filter(pk=remaining).update(status='queued')
+        races.clear()
+        with mock.patch.object(services, 'timezone', **{'now.side_effect': steal_selected_row}):
+            response = self.service_client.post('/api/queries/claim_next/')
+        # Последнюю строку забрал другой воркер: очередь действительно пуста
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(races, [remaining])
+
+    def test_metrics(self):
+        with self.assertQueryBudget(3, 'GET /api/metrics/'):
+            response = self.service_client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        # Повторный сбор берет глубину очереди из кэшированного снимка
+        with self.assertQueryBudget(1, 'GET /api/metrics/ (cached)'):
+            self.service_client.get('/api/metrics/')
+
+
+class LogApiQueryBudgetTests(ApiTestCase):
+    """
+    Бюджеты SQL-запросов для /api/logs/ и /api/token-usage/
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.queries = create_queries(cls.project, cls.user, 10)
+
+    def grow(self):
+        create_queries(self.project, self.user, 10)
+
+    def open_token_counters(self):
+        # Счетчики периода уже созданы: бюджет измеряет обычную запись, а не первую за день
+        spend_tokens(self.project, 1)
+
+    def test_logs_list(self):
+        with self.assertQueryBudget(3, 'GET /api/logs/'):
+            response = self.client.get('/api/logs/')
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryCountIndependentOf(lambda: self.client.get('/api/logs/'), self.grow, 'GET /api/logs/')
+
+    def test_log_retrieve(self):
+        log = QueryLog.objects.filter(project=self.project).first()
+        with self.assertQueryBudget(2, 'GET /api/logs/{id}/'):
+            response = self.client.get(f'/api/logs/{log.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_log_create(self):
+        query = self.queries[0]
+        with self.assertQueryBudget(4, 'POST /api/logs/'):
+            response = self.service_client.post(
+                '/api/logs/', {'project': self.project.id, 'query': query.id, 'log_data': 'step'}, format='json'
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def test_log_partial_update(self):
+        log = QueryLog.objects.filter(project=self.project).first()
+        with self.assertQueryBudget(3, 'PATCH /api/logs/{id}/'):
+            response = self.service_client.patch(f'/api/logs/{log.id}/', {'log_data': 'edited'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_log_destroy(self):
+        log = QueryLog.objects.filter(project=self.project).first()
+        with self.assertQueryBudget(3, 'DELETE /api/logs/{id}/'):
+            response = self.service_client.delete(f'/api/logs/{log.id}/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_token_usage_retrieve(self):
+        token_log = TokenUsageLog.objects.filter(project=self.project).first()
+        with self.assertQueryBudget(2, 'GET /api/token-usage/{id}/'):
+            response = self.client.get(f'/api/token-usage/{token_log.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_token_usage_list(self):
+        with self.assertQueryBudget(3, 'GET /api/token-usage/'):
+            response = self.client.get('/api/token-usage/')
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryCountIndependentOf(
+            lambda: self.client.get('/api/token-usage/'), self.grow, 'GET /api/token-usage/'
+        )
+
+    def test_token_usage_create(self):
+        query = self.queries[0]
+        payload = {
+            'ai_agent_name': 'planner', 'project': self.project.id, 'query': query.id,
+            'request_to_ai_agent': 'req', 'ai_agent_answer': 'ans',
+            'model_name': 'gpt-4o', 'model_role': 'assistant',
+            'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15,
+        }
+        self.open_token_counters()
+        # +4: SAVEPOINT/RELEASE и UPDATE дневного и месячного счетчиков бюджета токенов
+        with self.assertQueryBudget(8, 'POST /api/token-usage/'):
+            response = self.service_client.post('/api/token-usage/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_token_usage_bulk(self):
+        payload = [
+            {
+                'ai_agent_name': 'planner', 'query': query.id,
+                'request_to_ai_agent': 'req', 'ai_agent_answer': 'ans',
+                'model_name': 'gpt-4o', 'model_role': 'assistant', 'total_tokens': 15,
+            }
+            for query in self.queries[:10]
+        ]
+        self.open_token_counters()
+        # +4: SAVEPOINT/RELEASE и UPDATE дневного и месячного счетчиков (один проект в пачке)
+        with self.assertQueryBudget(7, 'POST /api/token-usage/bulk/'):
+            response = self.service_client.post('/api/token-usage/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 10)
+        self.assertEqual(TokenUsageLog.objects.get(id=response.data['ids'][0]).project_id, self.project.id)
+
+    def test_statistics(self):
+        with self.assertQueryBudget(4, 'GET /api/token-usage/statistics/'):
+            response = self.client.get('/api/token-usage/statistics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_requests'], 20)
+        self.assertQueryCountIndependentOf(
+            lambda: self.client.get('/api/token-usage/statistics/'), self.grow, 'GET /api/token-usage/statistics/'
+        )
+
+
+class FastReadPathTests(ApiTestCase):
+    """
+    Списки из values() без ModelSerializer: ответ побайтно совпадает с ответом через сериализатор
+    """
+
+    project_fields = {'project_name': 'Альфа'}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        source, query, queued = create_queries(cls.project, cls.user, 3, logs_per_query=3)
+        Query.objects.filter(id=query.id).update(
+            cached_from=source, answer_text='Ответ \u2028 с "кавычками"',
+            query_started=timezone.now(), query_finished=timezone.now()
+        )
+        Query.objects.filter(id=queued.id).update(status='queued')
+        QueryLog.objects.create(
+            project=cls.project, query=query, log_data='Шаг', level='error', agent='planner', step='plan',
+            payload={'code': 42, 'ratio': 0.5, 'items': ['a', None]}
+        )
+        TokenUsageLog.objects.create(
+            ai_agent_name='planner', project=cls.project, query=query, model_name='gpt-4o',
+            total_tokens=12, system_prompt='Системный промпт'
+        )
+
+    def test_output_is_byte_identical(self):
+        query = Query.objects.filter(cached_from__isnull=False).get()
+        urls = [
+            (self.client, '/api/queries/'),
+            (self.client, '/api/queries/?page=1'),
+            (self.client, f'/api/queries/{query.id}/logs/'),
+            (self.client, f'/api/queries/{query.id}/logs/?level=error'),
+            (self.service_client, '/api/logs/'),
+            (self.service_client, '/api/token-usage/'),
+        ]
+        for client, url in urls:
+            with self.subTest(url=url):
+                with override_settings(API_FAST_READ_PATHS=False):
+                    expected = client.get(url)
+                with self.assertQueryBudget(4, url):
+                    response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, expected.content)
+                self.assertGreater(len(response.json()['results']), 0)
+
+
+class StructuredLogTests(ApiTestCase):
+    """
+    Структурированные логи: уровень, агент, шаг, JSON-данные и фильтры на сервере
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.query, = create_queries(cls.project, cls.user, 1, logs_per_query=3, token_logs_per_query=0)
+
+    def write(self, *logs):
+        response = self.service_client.post(
+            '/api/logs/bulk/', [{'query': self.query.id, **log} for log in logs], format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_free_text_and_structured_writes(self):
+        response = self.service_client.post(
+            '/api/logs/', {'project': self.project.id, 'query': self.query.id, 'log_data': 'plain'}, format='json'
+        )
+        self.assertEqual((response.status_code, response.data['level'], response.data['payload']), (201, 'info', None))
+        self.write({'log_data': 'boom', 'level': 'error', 'agent': 'planner', 'step': 'plan', 'payload': {'code': 42}})
+        log = QueryLog.objects.get(log_data='boom')
+        self.assertEqual((log.level, log.agent, log.step, log.payload), ('error', 'planner', 'plan', {'code': 42}))
+
+        response = self.service_client.post(
+            '/api/logs/bulk/', [{'query': self.query.id, 'log_data': 'x', 'level': 'fatal'}], format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_filters_on_query_logs(self):
+        self.write(
+            {'log_data': 'warn', 'level': 'warning', 'agent': 'planner'},
+            {'log_data': 'err', 'level': 'error', 'agent': 'reviewer'},
+            {'log_data': 'plan', 'agent': 'planner', 'step': 'plan'},
+        )
+        url = f'/api/queries/{self.query.id}/logs/'
+        with self.assertQueryBudget(4, 'GET /api/queries/{id}/logs/?level='):
+            response = self.client.get(url, {'level': 'warning,error'})
+        self.assertEqual([log['log_data'] for log in response.data['results']], ['warn', 'err'])
+        response = self.client.get(url, {'agent': 'planner', 'step': 'plan'})
+        self.assertEqual([log['log_data'] for log in response.data['results']], ['plan'])
+        self.assertEqual(self.client.get(url, {'level': 'fatal'}).status_code, 400)
+
+    def test_filters_on_logs_list(self):
+        self.write({'log_data': 'err', 'level': 'error', 'agent': 'reviewer'})
+        with self.assertQueryBudget(3, 'GET /api/logs/?level=&agent='):
+            response = self.client.get('/api/logs/', {'level': 'error', 'agent': 'reviewer'})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['log_data'], 'err')
+
+
+@override_settings(QUERY_LONGPOLL_INTERVAL=0.05)
+class AsyncViewTests(ApiTestCase):
+    """
+    Async-эндпоинты: long-poll claim_next, поток логов (SSE) и пакетная запись логов
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.query = Query.objects.create(project=cls.project, user=cls.user, query_text='q', status='in_progress')
+        cls.other_query = Query.objects.create(
+            project=cls.other_project, user=cls.user, query_text='other', status='in_progress'
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client = jwt_async_client(self.user)
+        self.service_client = jwt_async_client(self.service)
+
+    @staticmethod
+    def parse_sse(body):
+        events = []
+        for block in body.decode().split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+            if 'event' in fields:
+                events.append((fields['event'], json.loads(fields['data'])))
+        return events
+
+    async def test_claim_next_wait_requires_authentication(self):
+        response = await AsyncClient().post('/api/queries/claim_next/wait/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_claim_next_wait_times_out_on_empty_queue(self):
+        response = await self.service_client.post('/api/queries/claim_next/wait/?timeout=0.1')
+        self.assertEqual(response.status_code, 404)
+        response = await self.service_client.post('/api/queries/claim_next/wait/?timeout=soon')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_claim_next_wait_claims_queued_query(self):
+        queued = await Query.objects.acreate(project=self.project, user=self.user, query_text='new', status='queued')
+        response = await self.service_client.post('/api/queries/claim_next/wait/?timeout=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], queued.id)
+        self.assertEqual(await Query.objects.filter(pk=queued.pk).values_list('status', flat=True).aget(), 'in_progress')
+
+    async def test_claim_next_wait_wakes_on_new_query(self):
+        async def enqueue():
+            await asyncio.sleep(0.2)
+            return await Query.objects.acreate(project=self.project, user=self.user, query_text='new', status='queued')
+
+        started = time.monotonic()
+        response, queued = await asyncio.gather(
+            self.service_client.post('/api/queries/claim_next/wait/?timeout=5'), enqueue()
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], queued.id)
+        self.assertLess(time.monotonic() - started, 4)
+
+    async def test_log_stream_ends_when_query_finished(self):
+        await QueryLog.objects.abulk_create([
+            QueryLog(project=self.project, query=self.query, log_data='plan', level='info'),
+            QueryLog(project=self.project, query=self.query, log_data='boom', level='error'),
+        ])
+        await Query.objects.filter(pk=self.query.pk).aupdate(status='failed')
+
+        response = await self.client.get(f'/api/queries/{self.query.id}/logs/stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = self.parse_sse(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual([(name, data.get('log_data')) for name, data in events], [
+            ('log', 'plan'), ('log', 'boom'), ('end', None),
+        ])
+        self.assertEqual(events[-1][1], {'status': 'failed'})
+
+        response = await self.client.get(f'/api/queries/{self.query.id}/logs/stream/?level=error')
+        events = self.parse_sse(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual([data.get('log_data') for _, data in events], ['boom', None])
+
+        response = await self.client.get(f'/api/queries/{self.query.id}/logs/stream/?level=loud')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_log_stream_follows_running_query(self):
+        response = await self.client.get(
+            f'/api/queries/{self.query.id}/logs/stream/', headers={'Last-Event-ID': '0'}
+        )
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b': keepalive\n\n')
+
+        await QueryLog.objects.acreate(project=self.project, query=self.query, log_data='step 1')
+        await Query.objects.filter(pk=self.query.pk).aupdate(status='done')
+        events = self.parse_sse(b''.join([chunk async for chunk in chunks]))
+        self.assertEqual([name for name, _ in events], ['log', 'end'])
+        self.assertEqual(events[0][1]['log_data'], 'step 1')
+
+    async def test_log_stream_scoped_to_project(self):
+        await Query.objects.filter(pk=self.other_query.pk).aupdate(status='done')
+        response = await self.client.get(f'/api/queries/{self.other_query.id}/logs/stream/')
+        self.assertEqual(response.status_code, 404)
+        response = await self.service_client.get(f'/api/queries/{self.other_query.id}/logs/stream/')
+        self.assertEqual(response.status_code, 200)
+        events = self.parse_sse(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual(events, [('end', {'status': 'done'})])
+        response = await AsyncClient().get(f'/api/queries/{self.other_query.id}/logs/stream/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_logs_bulk_validation(self):
+        url = '/api/logs/bulk/'
+        response = await self.service_client.post(url, [], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = await self.service_client.post(url, b'{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = await self.service_client.post(url, [
+            {'query': self.query.id, 'log_data': 'ok'},
+            {'query': self.query.id},
+            {'query': str(self.query.id), 'log_data': 'x'},
+            {'query': self.query.id, 'log_data': 'x', 'level': 'loud'},
+            {'query': self.query.id, 'log_data': 'x', 'agent': 'a' * 101},
+        ], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.json()['errors']), ['1', '2', '3', '4'])
+        with override_settings(QUERY_LOG_BULK_MAX_ITEMS=1):
+            response = await self.service_client.post(
+                url, [{'query': self.query.id, 'log_data': 'x'}] * 2, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(await QueryLog.objects.aexists())
+
+    async def test_logs_bulk_scoped_to_project(self):
+        await Query.objects.filter(pk=self.query.pk).aupdate(status='cancelled')
+        response = await jwt_async_client(self.other_user).post(
+            '/api/logs/bulk/', [{'query': self.query.id, 'log_data': 'x'}], content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], {'0': f'Query {self.query.id} not found'})
+
+        response = await self.service_client.post('/api/logs/bulk/', {'logs': [
+            {'query': self.query.id, 'log_data': 'x', 'project': self.other_project.id},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = await self.service_client.post('/api/logs/bulk/', {'logs': [
+            {'query': self.query.id, 'log_data': 'x', 'level': 'warning', 'agent': 'planner'},
+            {'query': self.other_query.id, 'log_data': 'y'},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['cancelled_queries'], [self.query.id])
+        self.assertEqual(
+            sorted([row async for row in QueryLog.objects.values_list('project_id', 'level')]),
+            sorted([(self.project.id, 'warning'), (self.other_project.id, 'info')])
+        )
+
+    async def test_logs_bulk_idempotency_key(self):
+        logs = [{'query': self.query.id, 'log_data': 'x'}]
+        headers = {'Idempotency-Key': 'batch-1'}
+        first = await self.service_client.post('/api/logs/bulk/', logs, content_type='application/json', headers=headers)
+        second = await self.service_client.post('/api/logs/bulk/', logs, content_type='application/json', headers=headers)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(await QueryLog.objects.acount(), 1)
+
+        response = await self.service_client.post(
+            '/api/logs/bulk/', logs * 2, content_type='application/json', headers=headers
+        )
+        self.assertEqual(response.status_code, 422)
+        response = await self.service_client.post(
+            '/api/logs/bulk/', logs, content_type='application/json', headers={'Idempotency-Key': ' '}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class WakeupTests(SimpleTestCase):
+    """
+    Пробуждение ожидающих корутин
+    """
+
+    async def test_notify_sets_registered_events(self):
+        wakeup = events.Wakeup()
+        first, second = wakeup.register(), wakeup.register()
+        wakeup.unregister(first)
+        wakeup.unregister(first)
+        wakeup.notify()
+        await asyncio.wait_for(second.wait(), 1)
+        self.assertFalse(first.is_set())
+
+
+class CancellationTests(ApiTestCase):
+    """
+    Отмена запросов пользователем и сигналы отмены для воркеров
+    """
+
+    def create_query(self, status):
+        return Query.objects.create(project=self.project, user=self.user, query_text='q', status=status)
+
+    def test_cancel_queued_query_is_not_claimed(self):
+        query = self.create_query('queued')
+        with self.assertQueryBudget(4, 'POST /api/queries/{id}/cancel/'):
+            response = self.client.post(f'/api/queries/{query.id}/cancel/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'cancelled')
+        query.refresh_from_db()
+        self.assertEqual(query.status, 'cancelled')
+        self.assertIsNotNone(query.query_finished)
+
+        response = self.service_client.post('/api/queries/claim_next/')
+        self.assertEqual(response.status_code, 404)
+
+        # Повторная отмена - не ошибка
+        response = self.client.post(f'/api/queries/{query.id}/cancel/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_worker_sees_cancellation(self):
+        query = self.create_query('in_progress')
+        self.client.post(f'/api/queries/{query.id}/cancel/')
+
+        with self.assertQueryBudget(2, 'GET /api/queries/{id}/status/'):
+            response = self.service_client.get(f'/api/queries/{query.id}/status/')
+        self.assertEqual(response.data, {'id': query.id, 'status': 'cancelled', 'cancelled': True})
+
+        response = self.service_client.post(
+            '/api/logs/', {'project': self.project.id, 'query': query.id, 'log_data': 'step'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['query_cancelled'])
+
+        running = self.create_query('in_progress')
+        payload = [
+            {
+                'ai_agent_name': 'planner', 'query': query_id,
+                'request_to_ai_agent': 'req', 'ai_agent_answer': 'ans',
+                'model_name': 'gpt-4o', 'model_role': 'assistant', 'total_tokens': 15,
+            }
+            for query_id in (query.id, running.id)
+        ]
+        response = self.service_client.post('/api/token-usage/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['cancelled_queries'], [query.id])
+
+        # Воркер не может завершить отмененный запрос
+        response = self.service_client.patch(
+            f'/api/queries/{query.id}/', {'status': 'done', 'answer_text': 'late'}, format='json'
+        )
+        self.assertEqual(response.status_code, 409)
+        query.refresh_from_db()
+        self.assertEqual(query.status, 'cancelled')
+        self.assertEqual(query.answer_text, '')
+
+    def test_cannot_cancel_finished_query(self):
+        query = self.create_query('done')
+        response = self.client.post(f'/api/queries/{query.id}/cancel/')
+        self.assertEqual(response.status_code, 400)
+        query.refresh_from_db()
+        self.assertEqual(query.status, 'done')
+
+    def test_cancel_other_project_query(self):
+        query = Query.objects.create(project=self.other_project, user=self.other_user, query_text='q')
+        response = self.client.post(f'/api/queries/{query.id}/cancel/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get(f'/api/queries/{query.id}/status/').status_code, 404)
+
+    def test_status_of_non_numeric_id_is_not_found(self):
+        self.assertEqual(self.service_client.get('/api/queries/abc/status/').status_code, 404)
+        self.assertEqual(self.service_client.get('/api/queries/1.5/status/').status_code, 404)
+
+    def test_cancelled_query_can_be_deleted(self):
+        query = self.create_query('queued')
+        self.assertEqual(self.client.delete(f'/api/queries/{query.id}/').status_code, 400)
+        self.client.post(f'/api/queries/{query.id}/cancel/')
+        self.assertEqual(self.client.delete(f'/api/queries/{query.id}/').status_code, 204)
+
+
+class QueryFinishTests(ApiTestCase):
+    """
+    Завершение запроса одним вызовом: ответ, логи и токены одной транзакцией, переходы статусов
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.query = Query.objects.create(project=self.project, user=self.user, query_text='q', status='in_progress')
+
+    def payload(self, **extra):
+        return {
+            'answer_text': 'ok',
+            'logs': [{'log_data': 'step 1'}, {'log_data': 'step 2'}],
+            'token_usage': [{
+                'ai_agent_name': 'planner', 'request_to_ai_agent': 'req', 'ai_agent_answer': 'ans',
+                'model_name': 'gpt-4o', 'model_role': 'assistant', 'total_tokens': 40,
+            }],
+            **extra,
+        }
+
+    def test_complete_writes_everything_at_once(self):
+        spend_tokens(self.project, 1)  # счетчики периода уже созданы
+        # Выборка частей ответа, UPDATE, два INSERT и два UPDATE счетчиков в транзакции;
+        # query_finished - время сервера
+        with self.assertQueryBudget(11, 'POST /api/queries/{id}/complete/'):
+            response = self.service_client.post(
+                f'/api/queries/{self.query.id}/complete/',
+                self.payload(query_finished='2000-01-01T00:00:00Z'), format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['status'], response.data['logs_count']), ('done', 2))
+        self.query.refresh_from_db()
+        self.assertEqual((self.query.status, self.query.answer_text), ('done', 'ok'))
+        self.assertGreater(self.query.query_finished, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(
+            list(self.query.logs.order_by('id').values_list('log_data', flat=True)), ['step 1', 'step 2']
+        )
+        token_log = TokenUsageLog.objects.get(query=self.query)
+        self.assertEqual((token_log.project_id, token_log.total_tokens), (self.project.id, 40))
+        self.assertEqual(ProjectTokenCounter.objects.get(project=self.project, period='day').tokens, 41)
+
+    def test_fail_without_answer(self):
+        response = self.service_client.post(f'/api/queries/{self.query.id}/fail/', {}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertIsNotNone(response.data['query_finished'])
+
+    def test_complete_requires_answer(self):
+        response = self.service_client.post(f'/api/queries/{self.query.id}/complete/', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Query.objects.get(id=self.query.id).status, 'in_progress')
+
+    def test_cancelled_query_is_not_finished(self):
+        self.client.post(f'/api/queries/{self.query.id}/cancel/')
+        response = self.service_client.post(f'/api/queries/{self.query.id}/complete/', self.payload(), format='json')
+        self.assertEqual(response.status_code, 409)
+        self.query.refresh_from_db()
+        self.assertEqual((self.query.status, self.query.answer_text), ('cancelled', ''))
+        self.assertFalse(self.query.logs.exists())
+        self.assertFalse(TokenUsageLog.objects.filter(query=self.query).exists())
+
+    def test_invalid_transitions(self):
+        response = self.service_client.post(f'/api/queries/{self.query.id}/complete/', self.payload(), format='json')
+        self.assertEqual(response.status_code, 200)
+        # Повторное завершение ничего не дописывает
+        response = self.service_client.post(f'/api/queries/{self.query.id}/fail/', self.payload(), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.query.logs.count(), 2)
+
+        queued = Query.objects.create(project=self.project, user=self.user, query_text='q', status='queued')
+        response = self.service_client.post(f'/api/queries/{queued.id}/complete/', self.payload(), format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.service_client.patch(f'/api/queries/{self.query.id}/', {'status': 'in_progress'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_idempotent_retry(self):
+        url = f'/api/queries/{self.query.id}/complete/'
+        first = self.service_client.post(url, self.payload(), format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        retry = self.service_client.post(url, self.payload(), format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual((first.status_code, retry.status_code), (200, 200))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.query.logs.count(), 2)
+
+
+class AnswerChunkTests(ApiTestCase):
+    """
+    Ответ частями: дописывание без перезаписи Query, чтение новых частей, сборка при завершении
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.query = Query.objects.create(project=self.project, user=self.user, query_text='q', status='in_progress')
+        self.url = f'/api/queries/{self.query.id}/answer/'
+
+    def append(self, text):
+        response = self.service_client.post(self.url, {'text': text}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_append_does_not_touch_query_row(self):
+        # Пользователь, запрос и INSERT части - без UPDATE строки Query
+        with self.assertQueryBudget(3, 'POST /api/queries/{id}/answer/'):
+            response = self.service_client.post(self.url, {'text': 'Часть 1. '}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Query.objects.get(id=self.query.id).answer_text, '')
+
+    def test_watcher_reads_only_new_chunks(self):
+        first = self.append('Часть 1. ')
+        self.append('Часть 2.')
+        with self.assertQueryBudget(3, 'GET /api/queries/{id}/answer/'):
+            response = self.client.get(self.url, {'after': first})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([chunk['text'] for chunk in response.data['chunks']], ['Часть 2.'])
+        self.assertEqual(response.data['status'], 'in_progress')
+        # Чтение запроса собирает ответ из частей
+        self.assertEqual(self.client.get(f'/api/queries/{self.query.id}/').data['answer_text'], 'Часть 1. Часть 2.')
+
+    def test_non_numeric_id_is_not_found(self):
+        self.assertEqual(self.client.get('/api/queries/abc/answer/').status_code, 404)
+        # Как любой неизвестный URL: маршрут API не совпадает, POST отклоняет маршрут React-приложения
+        response = self.service_client.post('/api/queries/abc/answer/', {'text': 'x'}, format='json')
+        self.assertEqual(response.status_code, 405)
+
+    def test_complete_assembles_chunks(self):
+        self.append('Часть 1. ')
+        self.append('Часть 2.')
+        response = self.service_client.post(f'/api/queries/{self.query.id}/complete/', {}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['answer_text'], 'Часть 1. Часть 2.')
+        self.assertFalse(self.query.answer_chunks.exists())
+        response = self.client.get(self.url, {'after': 0})
+        self.assertEqual((response.data['status'], response.data['chunks']), ('done', []))
+        self.assertEqual(response.data['answer_text'], 'Часть 1. Часть 2.')
+
+    def test_patch_done_assembles_chunks(self):
+        self.append('Ответ')
+        response = self.service_client.patch(f'/api/queries/{self.query.id}/', {'status': 'done'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Query.objects.get(id=self.query.id).answer_text, 'Ответ')
+        self.assertFalse(self.query.answer_chunks.exists())
+
+    def test_append_to_finished_or_cancelled_query(self):
+        self.client.post(f'/api/queries/{self.query.id}/cancel/')
+        self.assertEqual(self.service_client.post(self.url, {'text': 'x'}, format='json').status_code, 409)
+        done = Query.objects.create(project=self.project, user=self.user, query_text='q', status='done')
+        response = self.service_client.post(f'/api/queries/{done.id}/answer/', {'text': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class AdmissionTests(ApiTestCase):
+    """
+    Admission control: 429 с Retry-After при переполненной очереди и снимок очереди под нагрузкой потоков
+    """
+
+    def create(self):
+        return self.client.post('/api/queries/', {'project': self.project.id, 'query_text': 'q'}, format='json')
+
+    @override_settings(QUERY_ADMISSION_PROJECT_LIMIT=2, QUERY_ADMISSION_DEFAULT_RETRY_AFTER=45)
+    def test_single_create_rejected_over_project_limit(self):
+        self.assertEqual(self.create().status_code, 201)
+        self.assertEqual(self.create().status_code, 201)
+        # Второй запрос учтен в снимке локально, без нового COUNT
+        response = self.create()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '45')
+        self.assertEqual(Query.objects.count(), 2)
+
+    @override_settings(QUERY_ADMISSION_GLOBAL_LIMIT=3)
+    def test_retry_after_from_finish_rate(self):
+        create_queries(self.project, self.user, 3, 0, 0, status='queued')
+        # 30 завершений за окно 300 с - 0.1 запроса в секунду: место освободится через 10 с
+        create_queries(self.project, self.user, 30, 0, 0, status='done')
+        Query.objects.filter(status='done').update(query_finished=timezone.now())
+        response = self.create()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+
+    def test_snapshot_readable_while_admitting_from_threads(self):
+        snapshot = admission.QueueSnapshot({(1, 'queued'): 2, (1, 'in_progress'): 1}, 0, time.monotonic())
+        with mock.patch.object(admission, '_snapshot', snapshot):
+            errors = []
+
+            def admit():
+                # Каждый вызов добавляет в снимок новый ключ
+                for project_id in range(2, 3002):
+                    admission.note_admitted(project_id)
+
+            def read():
+                try:
+                    while writer.is_alive():
+                        list(metrics._queue_depth_samples())
+                        snapshot.for_project(1)
+                except RuntimeError as exc:
+                    errors.append(exc)
+
+            writer = threading.Thread(target=admit)
+            writer.start()
+            read()
+            writer.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(snapshot.for_project(1), 3)
+        self.assertEqual(snapshot.total(), sum(n for _, n in snapshot.items()))
+
+    def test_concurrent_refresh_takes_one_snapshot(self):
+        calls = []
+
+        def slow_snapshot():
+            calls.append(1)
+            time.sleep(0.1)
+            return admission.QueueSnapshot({}, 0, time.monotonic())
+
+        with mock.patch.object(admission, '_take_snapshot', slow_snapshot):
+            threads = [threading.Thread(target=admission.get_queue_snapshot) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+
+
+class BulkSubmissionTests(ApiTestCase):
+    """
+    Пакетное создание запросов: один INSERT и одно уведомление на пакет, проверки для всего пакета
+    """
+
+    def items(self, count, project=None):
+        return [{'project': (project or self.project).id, 'query_text': f'Test case {i}'} for i in range(count)]
+
+    def test_creates_batch_in_order_with_one_notification(self):
+        with mock.patch('queries.views.notify_fastapi_async') as notify:
+            # Аутентификация, выборка проектов и один INSERT независимо от размера пакета
+            with self.assertQueryBudget(3, 'POST /api/queries/bulk/'):
+                response = self.client.post('/api/queries/bulk/', {'queries': self.items(50)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 50)
+        ids = response.data['ids']
+        self.assertEqual(
+            list(Query.objects.filter(id__in=ids).order_by('id').values_list('query_text', flat=True)),
+            [f'Test case {i}' for i in range(50)]
+        )
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(set(Query.objects.filter(id__in=ids).values_list('status', 'user_id')), {('queued', self.user.id)})
+        notify.assert_called_once_with(ids[0], ids)
+
+    def test_foreign_project_rejects_whole_batch(self):
+        items = self.items(2) + self.items(1, project=self.other_project)
+        response = self.client.post('/api/queries/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], {2: f'Project {self.other_project.id} not found'})
+        self.assertFalse(Query.objects.exists())
+
+        response = self.service_client.post('/api/queries/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Query.objects.filter(project=self.other_project).count(), 1)
+
+    def test_validation(self):
+        self.assertEqual(self.client.post('/api/queries/bulk/', [], format='json').status_code, 400)
+        response = self.client.post('/api/queries/bulk/', [{'project': self.project.id}], format='json')
+        self.assertEqual(response.status_code, 400)
+        with override_settings(QUERY_BULK_CREATE_MAX_ITEMS=3):
+            self.assertEqual(self.client.post('/api/queries/bulk/', self.items(4), format='json').status_code, 400)
+
+    @override_settings(QUERY_ADMISSION_PROJECT_LIMIT=5, QUERY_ADMISSION_GLOBAL_LIMIT=8)
+    def test_admission_limits_apply_to_whole_batch(self):
+        create_queries(self.project, self.user, 2, status='queued')
+        response = self.client.post('/api/queries/bulk/', self.items(4), format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(Query.objects.count(), 2)
+
+        items = self.items(3) + self.items(4, project=self.other_project)
+        response = self.service_client.post('/api/queries/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 429)
+
+        response = self.client.post('/api/queries/bulk/', self.items(3), format='json')
+        self.assertEqual(response.status_code, 201)
+        # Снимок очереди учитывает только что созданный пакет
+        self.assertEqual(self.client.post('/api/queries/bulk/', self.items(1), format='json').status_code, 429)
+
+    def test_token_budget(self):
+        Project.objects.filter(id=self.project.id).update(daily_token_budget=10)
+        spend_tokens(self.project, 10)
+        response = self.client.post('/api/queries/bulk/', self.items(2), format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(Query.objects.exists())
+
+    def test_idempotent_retry(self):
+        first = self.client.post('/api/queries/bulk/', self.items(3), format='json', HTTP_IDEMPOTENCY_KEY='batch-1')
+        retry = self.client.post('/api/queries/bulk/', self.items(3), format='json', HTTP_IDEMPOTENCY_KEY='batch-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Query.objects.count(), 3)
+
+
+class BulkDeletionTests(ApiTestCase):
+    """
+    Массовое удаление: логи пачками без сборщика каскада, число SQL не зависит от числа логов
+    """
+
+    def test_batches_children_and_clears_references(self):
+        query, source = create_queries(self.project, self.user, 2, logs_per_query=7, token_logs_per_query=3)
+        Query.objects.filter(id=query.id).update(cached_from=source)
+        AnswerChunk.objects.create(query=source, text='part')
+        now = timezone.now()
+        entry = AnswerCacheEntry.objects.create(
+            project=self.project, context_version=1, text_hash='h', normalized_text='q', answer_text='a',
+            query=source, created_at=now, last_used_at=now
+        )
+
+        self.assertEqual(deletion.delete_query_ids([source.id], batch_size=2), 1)
+
+        self.assertFalse(Query.objects.filter(id=source.id).exists())
+        self.assertFalse(QueryLog.objects.filter(query_id=source.id).exists())
+        self.assertFalse(TokenUsageLog.objects.filter(query_id=source.id).exists())
+        self.assertFalse(AnswerChunk.objects.filter(query_id=source.id).exists())
+        self.assertIsNone(Query.objects.get(id=query.id).cached_from_id)
+        entry.refresh_from_db()
+        self.assertIsNone(entry.query_id)
+        self.assertEqual(QueryLog.objects.filter(query=query).count(), 7)
+
+    def test_bulk_delete_by_filter(self):
+        old = create_queries(self.project, self.user, 3)
+        Query.objects.filter(id__in=[q.id for q in old]).update(query_finished=timezone.now() - timedelta(days=40))
+        recent = create_queries(self.project, self.user, 2)
+        active = create_queries(self.project, self.user, 1, status='in_progress')[0]
+        foreign = create_queries(self.other_project, self.other_user, 1)[0]
+
+        with override_settings(QUERY_DELETE_CHUNK_SIZE=2):
+            response = self.client.post('/api/queries/bulk_delete/', {
+                'finished_before': (timezone.now() - timedelta(days=30)).isoformat(),
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'deleted': 3})
+
+        # Активные и чужие запросы не удаляются даже по явным id
+        response = self.client.post('/api/queries/bulk_delete/', {
+            'ids': [recent[0].id, active.id, foreign.id], 'status': ['done'],
+        }, format='json')
+        self.assertEqual(response.data, {'deleted': 1})
+        self.assertCountEqual(
+            Query.objects.values_list('id', flat=True), [recent[1].id, active.id, foreign.id]
+        )
+        self.assertEqual(QueryLog.objects.filter(query__in=old).count(), 0)
+
+    def test_bulk_delete_requires_filter(self):
+        create_queries(self.project, self.user, 1)
+        self.assertEqual(self.client.post('/api/queries/bulk_delete/', {}, format='json').status_code, 400)
+        response = self.client.post('/api/queries/bulk_delete/', {'ids': [1], 'status': ['queued']}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Query.objects.count(), 1)
+
+    def test_bulk_delete_query_count_is_independent_of_logs(self):
+        counts = []
+        for logs_per_query in (5, 200):
+            create_queries(self.project, self.user, 3, logs_per_query=logs_per_query)
+            Query.objects.update(query_finished=timezone.now())
+            # Выборка id, затем одна транзакция на порцию: пачки логов, части ответа,
+            # ссылки кэша ответов и DELETE запросов
+            with self.assertQueryBudget(11, 'POST /api/queries/bulk_delete/') as context:
+                response = self.client.post('/api/queries/bulk_delete/', {
+                    'finished_before': (timezone.now() + timedelta(minutes=1)).isoformat(),
+                }, format='json')
+            self.assertEqual(response.data, {'deleted': 3})
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_project_deletion_goes_through_bulk_path(self):
+        project = Project.objects.create(project_name='Disposable')
+        user = User.objects.create_user(username='carol', email='carol@example.com', password='x', project=project)
+        queries = create_queries(project, user, 5, logs_per_query=30)
+        ProjectTokenCounter.objects.create(project=project, period='day', period_start=timezone.localdate(), tokens=1)
+
+        with override_settings(QUERY_DELETE_CHUNK_SIZE=2, QUERY_DELETE_BATCH_SIZE=25):
+            response = self.service_client.delete(f'/api/projects/{project.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Project.objects.filter(id=project.id).exists())
+        self.assertFalse(User.objects.filter(id=user.id).exists())
+        self.assertFalse(Query.objects.filter(id__in=[q.id for q in queries]).exists())
+        self.assertFalse(QueryLog.objects.filter(project_id=project.id).exists())
+        self.assertFalse(ProjectTokenCounter.objects.filter(project_id=project.id).exists())
+
+
+class IdempotencyTests(ApiTestCase):
+    """
+    Заголовок Idempotency-Key на создании запросов и пакетной записи
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.query = Query.objects.create(project=cls.project, user=cls.user, query_text='q', status='in_progress')
+
+    def create(self, key, text='New'):
+        return self.client.post(
+            '/api/queries/', {'project': self.project.id, 'query_text': text}, format='json',
+            HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_returns_original_query(self):
+        first = self.create('key-1')
+        self.assertEqual(first.status_code, 201)
+        # Включая SAVEPOINT/ROLLBACK неудавшейся вставки ключа
+        with self.assertQueryBudget(6, 'POST /api/queries/ (idempotent replay)'):
+            second = self.create('key-1')
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Query.objects.filter(query_text='New').count(), 1)
+
+        # Ключи разных пользователей не пересекаются
+        other = jwt_client(User.objects.create_user(
+            username='carol', email='carol@example.com', password='x', project=self.project
+        ))
+        response = other.post(
+            '/api/queries/', {'project': self.project.id, 'query_text': 'New'}, format='json',
+            HTTP_IDEMPOTENCY_KEY='key-1'
+        )
+        self.assertNotEqual(response.data['id'], first.data['id'])
+
+    def test_key_reused_with_different_body(self):
+        self.create('key-1')
+        response = self.create('key-1', text='Other')
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(Query.objects.filter(query_text='Other').exists())
+
+    def test_concurrent_retry_while_first_is_processing(self):
+        # Первый запрос занял ключ, но еще не ответил
+        IdempotencyKey.objects.create(
+            user=self.user, endpoint='queries.create', key='key-1',
+            request_hash=idempotency.request_hash({'project': self.project.id, 'query_text': 'New'}),
+            created_at=timezone.now()
+        )
+        response = self.create('key-1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Query.objects.filter(query_text='New').exists())
+
+    def test_abandoned_processing_key_is_reclaimed_after_lease(self):
+        # Процесс умер посреди запроса: ключ остался без ответа
+        IdempotencyKey.objects.create(
+            user=self.user, endpoint='queries.create', key='key-1',
+            request_hash=idempotency.request_hash({'project': self.project.id, 'query_text': 'New'}),
+            created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_PROCESSING_LEASE_SECONDS + 1)
+        )
+        response = self.create('key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+
+    def test_same_key_for_different_queries_is_not_a_replay(self):
+        other = Query.objects.create(project=self.project, user=self.user, query_text='q2', status='in_progress')
+        body = {'answer_text': 'done'}
+        for query in (self.query, other):
+            response = self.service_client.post(
+                f'/api/queries/{query.id}/complete/', body, format='json', HTTP_IDEMPOTENCY_KEY='finish-1'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(
+            set(Query.objects.filter(id__in=[self.query.id, other.id]).values_list('status', flat=True)), {'done'}
+        )
+        response = self.service_client.post(
+            f'/api/queries/{other.id}/complete/', body, format='json', HTTP_IDEMPOTENCY_KEY='finish-1'
+        )
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+    def test_failed_request_releases_key(self):
+        response = self.client.post(
+            '/api/queries/', {'project': self.project.id}, format='json', HTTP_IDEMPOTENCY_KEY='key-1'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.create('key-1').status_code, 201)
+
+    def test_expired_key_is_reused(self):
+        first = self.create('key-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        second = self.create('key-1')
+        self.assertNotEqual(second.data['id'], first.data['id'])
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(idempotency.prune(), 1)
+
+    def test_bulk_writes(self):
+        logs = [{'query': self.query.id, 'log_data': 'step'}]
+        for _ in range(2):
+            response = self.service_client.post('/api/logs/bulk/', logs, format='json', HTTP_IDEMPOTENCY_KEY='batch-1')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(QueryLog.objects.filter(query=self.query).count(), 1)
+
+        token_usage = [{
+            'ai_agent_name': 'planner', 'query': self.query.id,
+            'request_to_ai_agent': 'req', 'ai_agent_answer': 'ans',
+            'model_name': 'gpt-4o', 'model_role': 'assistant', 'total_tokens': 15,
+        }]
+        for _ in range(2):
+            response = self.service_client.post(
+                '/api/token-usage/bulk/', token_usage, format='json', HTTP_IDEMPOTENCY_KEY='batch-1'
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(TokenUsageLog.objects.filter(query=self.query).count(), 1)
+
+
+class AnswerCacheTests(ApiTestCase):
+    """
+    Кэш ответов: попадание при создании, запись при завершении, инвалидация при изменении проекта
+    """
+
+    project_fields = {'answer_cache_enabled': True}
+
+    def answer(self, query_text, answer_text='cached answer'):
+        query = Query.objects.create(project=self.project, user=self.user, query_text=query_text, status='in_progress')
+        response = self.service_client.patch(
+            f'/api/queries/{query.id}/', {'status': 'done', 'answer_text': answer_text}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return query
+
+    def create(self, query_text, **extra):
+        return self.client.post(
+            '/api/queries/', {'project': self.project.id, 'query_text': query_text, **extra}, format='json'
+        )
+
+    def test_hit_returns_done_query_without_queueing(self):
+        source = self.answer('Протестировать авторизацию')
+        self.create('Протестировать авторизацию')  # первое попадание создает строку статистики
+        with self.assertQueryBudget(6, 'POST /api/queries/ (cache hit)'):
+            response = self.create('  протестировать   АВТОРИЗАЦИЮ! ')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], 'done')
+        self.assertEqual(response.data['answer_text'], 'cached answer')
+        self.assertEqual(response.data['cached_from'], source.id)
+        self.assertFalse(Query.objects.filter(status='queued').exists())
+
+    def test_miss_and_opt_out_queue_the_query(self):
+        self.answer('Протестировать авторизацию')
+        self.assertEqual(self.create('Протестировать регистрацию').data['status'], 'queued')
+        self.assertEqual(self.create('Протестировать авторизацию', use_cache=False).data['status'], 'queued')
+
+    def test_project_change_invalidates(self):
+        self.answer('Протестировать авторизацию')
+        response = self.client.patch(f'/api/projects/{self.project.id}/', {'project_context': 'new'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.create('Протестировать авторизацию').data['status'], 'queued')
+
+    @override_settings(ANSWER_CACHE_TTL_SECONDS=0)
+    def test_expired_entry_is_not_used(self):
+        self.answer('Протестировать авторизацию')
+        self.assertEqual(self.create('Протестировать авторизацию').data['status'], 'queued')
+
+    @override_settings(ANSWER_CACHE_MAX_ENTRIES=2)
+    def test_eviction(self):
+        for i in range(4):
+            self.answer(f'Query {i}')
+        self.assertEqual(self.project.answer_cache_entries.count(), 2)
+
+    def test_disabled_project_does_not_touch_cache(self):
+        Project.objects.filter(id=self.project.id).update(answer_cache_enabled=False)
+        with self.assertQueryBudget(4, 'POST /api/queries/ (cache disabled)'):
+            response = self.create('Протестировать авторизацию')
+        self.assertEqual(response.data['status'], 'queued')
+
+    def test_stats(self):
+        self.answer('Протестировать авторизацию')
+        self.create('Протестировать авторизацию')
+        self.create('Другой запрос')
+        with self.assertQueryBudget(2, 'GET /api/queries/answer_cache/'):
+            response = self.client.get('/api/queries/answer_cache/')
+        self.assertEqual(response.status_code, 200)
+        stats, = response.data
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+
+class TokenBudgetTests(ApiTestCase):
+    """
+    Бюджеты токенов проектов: счетчики при записи расхода, отказ в создании, удержание в очереди
+    """
+
+    project_fields = {'daily_token_budget': 100, 'answer_cache_enabled': True}
+
+    def counter(self, project, period=ProjectTokenCounter.PERIOD_DAY):
+        starts = token_budget.period_starts()
+        counter = ProjectTokenCounter.objects.filter(project=project, period=period, period_start=starts[period]).first()
+        return counter.tokens if counter else 0
+
+    def usage(self, query, total_tokens):
+        return {
+            'ai_agent_name': 'planner', 'query': query.id,
+            'request_to_ai_agent': 'req', 'ai_agent_answer': 'ans',
+            'model_name': 'gpt-4o', 'model_role': 'assistant', 'total_tokens': total_tokens,
+        }
+
+    def create(self, query_text='Протестировать авторизацию'):
+        return self.client.post('/api/queries/', {'project': self.project.id, 'query_text': query_text}, format='json')
+
+    def test_single_and_bulk_usage_update_counters(self):
+        query, = create_queries(self.project, self.user, 1, 0, 0)
+        other_query, = create_queries(self.other_project, self.user, 1, 0, 0)
+        response = self.service_client.post(
+            '/api/token-usage/', {**self.usage(query, 30), 'project': self.project.id}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.service_client.post(
+            '/api/token-usage/bulk/', [self.usage(query, 20), self.usage(query, 5), self.usage(other_query, 7)],
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.counter(self.project), 55)
+        self.assertEqual(self.counter(self.project, ProjectTokenCounter.PERIOD_MONTH), 55)
+        self.assertEqual(self.counter(self.other_project), 7)
+
+    def test_create_rejected_over_budget(self):
+        self.assertEqual(self.create().status_code, 201)
+        spend_tokens(self.project, 100)
+        response = self.create()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertIn('бюджет токенов', response.data['detail'])
+
+    def test_monthly_budget(self):
+        Project.objects.filter(id=self.project.id).update(daily_token_budget=None, monthly_token_budget=500)
+        spend_tokens(self.project, 499)
+        self.assertEqual(self.create().status_code, 201)
+        spend_tokens(self.project, 1)
+        self.assertEqual(self.create().status_code, 429)
+
+    def test_cache_hit_allowed_over_budget(self):
+        query = Query.objects.create(project=self.project, user=self.user, query_text='Кэш', status='in_progress')
+        self.service_client.patch(f'/api/queries/{query.id}/', {'status': 'done', 'answer_text': 'ok'}, format='json')
+        spend_tokens(self.project, 100)
+        response = self.create('Кэш')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], 'done')
+
+    def test_claim_next_holds_over_budget_projects(self):
+        held, = create_queries(self.project, self.user, 1, 0, 0, status='queued')
+        other, = create_queries(self.other_project, self.user, 1, 0, 0, status='queued')
+        spend_tokens(self.project, 100)
+        response = self.service_client.post('/api/queries/claim_next/')
+        self.assertEqual(response.data['id'], other.id)
+        self.assertEqual(self.service_client.post('/api/queries/claim_next/').status_code, 404)
+        Project.objects.filter(id=self.project.id).update(daily_token_budget=1000)
+        self.assertEqual(self.service_client.post('/api/queries/claim_next/').data['id'], held.id)
+
+    def test_reconcile_recomputes_counters(self):
+        create_queries(self.project, self.user, 2, 0, 1)
+        create_queries(self.other_project, self.user, 1, 0, 1)
+        spend_tokens(self.project, 5000)
+        spend_tokens(self.other_project, 1)
+        call_command('reconcile_token_counters', stdout=StringIO())
+        # Заниженный счетчик поднимается до суммы логов, завышенный не уменьшается
+        self.assertEqual(self.counter(self.project), 5000)
+        self.assertEqual(self.counter(self.other_project), 100)
+        self.assertEqual(self.counter(self.other_project, ProjectTokenCounter.PERIOD_MONTH), 100)
+        self.assertEqual(self.create().status_code, 429)
+
+    def test_reconcile_after_deletion_keeps_spent_budget(self):
+        queries = create_queries(self.project, self.user, 2, 0, 1)
+        token_budget.record_usage(TokenUsageLog.objects.filter(query__in=queries))
+        self.assertEqual(self.counter(self.project), 200)
+        response = self.client.post(
+            '/api/queries/bulk_delete/', {'ids': [query.id for query in queries]}, format='json'
+        )
+        self.assertEqual(response.data, {'deleted': 2})
+        self.assertFalse(TokenUsageLog.objects.filter(project=self.project).exists())
+
+        token_budget.reconcile()
+        self.assertEqual(self.counter(self.project), 200)
+        self.assertEqual(self.counter(self.project, ProjectTokenCounter.PERIOD_MONTH), 200)
+        self.assertEqual(self.create().status_code, 429)
+
+    def test_usage_counted_in_period_of_log(self):
+        query, = create_queries(self.project, self.user, 1, 0, 0)
+        log = TokenUsageLog.objects.create(
+            project=self.project, query=query, ai_agent_name='planner', model_name='gpt-4o', total_tokens=40
+        )
+        # Лог записан в последнюю секунду вчерашнего дня, счетчик обновляется уже сегодня
+        log.datetime = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(seconds=1)
+        TokenUsageLog.objects.filter(pk=log.pk).update(datetime=log.datetime)
+        token_budget.record_usage([log])
+
+        daily = ProjectTokenCounter.objects.filter(project=self.project, period=ProjectTokenCounter.PERIOD_DAY)
+        yesterday = timezone.localdate(log.datetime)
+        self.assertEqual(dict(daily.values_list('period_start', 'tokens')), {yesterday: 40})
+        token_budget.reconcile(days=2)
+        self.assertEqual(dict(daily.values_list('period_start', 'tokens')), {yesterday: 40})
+
+    def test_token_usage_cannot_be_changed_or_deleted(self):
+        query, = create_queries(self.project, self.user, 1, 0, 0)
+        response = self.service_client.post(
+            '/api/token-usage/', {**self.usage(query, 30), 'project': self.project.id}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        url = f'/api/token-usage/{TokenUsageLog.objects.get(query=query).id}/'
+        self.assertEqual(self.service_client.patch(url, {'total_tokens': 1}, format='json').status_code, 405)
+        self.assertEqual(self.service_client.put(url, self.usage(query, 1), format='json').status_code, 405)
+        self.assertEqual(self.service_client.delete(url).status_code, 405)
+        self.assertEqual(self.service_client.get(url).data['total_tokens'], 30)
+        self.assertEqual(self.counter(self.project), 30)
+
+    def test_seed_benchmark_data_fills_counters_and_histograms(self):
+        call_command(
+            'seed_benchmark_data', projects=2, users_per_project=1, queries=20, logs_per_query=0,
+            token_logs_per_query=2, batch_size=7, prefix='seed', stdout=StringIO()
+        )
+        logs = TokenUsageLog.objects.filter(project__project_name__startswith='seed-')
+        self.assertEqual(logs.count(), 40)
+        totals = dict(logs.order_by().values('project_id').annotate(tokens=Sum('total_tokens')).values_list(
+            'project_id', 'tokens'
+        ))
+        for project_id, tokens in totals.items():
+            self.assertEqual(self.counter(project_id), tokens)
+            self.assertEqual(self.counter(project_id, ProjectTokenCounter.PERIOD_MONTH), tokens)
+        calls = TokenLatencyBucket.objects.filter(
+            project_id__in=totals, metric=TokenLatencyBucket.METRIC_DURATION
+        ).aggregate(calls=Sum('calls'))['calls']
+        self.assertEqual(calls, 40)
+
+
+class TokenLatencyTests(ApiTestCase):
+    """
+    Задержки вызовов моделей: время вызова в логах токенов, часовые гистограммы и отчет о перцентилях
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.query, = create_queries(self.project, self.user, 1, 0, 0, status='in_progress')
+
+    def usage(self, duration_ms, ttft_ms=None, model_name='gpt-4o', agent='planner', query=None, **fields):
+        return {
+            'ai_agent_name': agent, 'query': (query or self.query).id,
+            'request_to_ai_agent': 'req', 'ai_agent_answer': 'ans',
+            'model_name': model_name, 'model_role': 'assistant', 'completion_tokens': 50, 'total_tokens': 80,
+            'duration_ms': duration_ms, 'time_to_first_token_ms': ttft_ms, **fields,
+        }
+
+    def bulk(self, records):
+        response = self.service_client.post('/api/token-usage/bulk/', records, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response
+
+    def report(self, client=None, **params):
+        response = (client or self.service_client).get('/api/token-usage/latency/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['results']
+
+    def test_duration_derived_from_start_and_finish(self):
+        started = timezone.now() - timedelta(seconds=3)
+        record = self.usage(
+            None, 400, started_at=started.isoformat(), finished_at=(started + timedelta(milliseconds=2500)).isoformat()
+        )
+        del record['duration_ms']
+        response = self.service_client.post('/api/token-usage/', {**record, 'project': self.project.id}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['duration_ms'], 2500)
+        buckets = TokenLatencyBucket.objects.filter(project=self.project)
+        self.assertEqual(
+            sorted(buckets.values_list('metric', 'bucket', 'calls', 'total_ms', 'output_tokens')),
+            [
+                ('duration', token_latency.bucket_index(2500), 1, 2500, 50),
+                ('ttft', token_latency.bucket_index(400), 1, 400, 0),
+            ]
+        )
+
+    def test_invalid_timing_rejected(self):
+        started = timezone.now()
+        response = self.service_client.post('/api/token-usage/bulk/', [
+            self.usage(None, started_at=started.isoformat(), finished_at=(started - timedelta(seconds=1)).isoformat())
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.service_client.post('/api/token-usage/bulk/', [self.usage(100, 200)], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TokenLatencyBucket.objects.exists())
+
+    def test_usage_without_timing_writes_no_histograms(self):
+        self.bulk([self.usage(None)])
+        self.assertFalse(TokenLatencyBucket.objects.exists())
+
+    def test_bulk_increments_one_counter_per_bucket(self):
+        self.bulk([self.usage(1200, 300) for _ in range(3)])
+        self.bulk([self.usage(1300)])
+        duration = TokenLatencyBucket.objects.get(metric='duration')
+        self.assertEqual((duration.calls, duration.total_ms, duration.output_tokens), (4, 4900, 200))
+        self.assertEqual(TokenLatencyBucket.objects.get(metric='ttft').calls, 3)
+
+    def test_finish_records_latency(self):
+        response = self.service_client.post(f'/api/queries/{self.query.id}/complete/', {
+            'answer_text': 'ok',
+            'token_usage': [{key: value for key, value in self.usage(800, 100).items() if key != 'query'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(TokenLatencyBucket.objects.get(metric='duration').total_ms, 800)
+
+    def test_report_percentiles_and_tokens_per_second(self):
+        self.bulk([self.usage(ms, ms // 10) for ms in range(100, 1100, 100)])
+        self.bulk([self.usage(5000, model_name='gpt-4o-mini', agent='writer')])
+
+        results = self.report(group_by='model')
+        self.assertEqual([item['model'] for item in results], ['gpt-4o', 'gpt-4o-mini'])
+        item = results[0]
+        self.assertEqual(item['duration_ms']['calls'], 10)
+        self.assertEqual(item['duration_ms']['mean'], 550.0)
+        self.assertTrue(500 <= item['duration_ms']['p50'] <= 750)
+        self.assertTrue(750 <= item['duration_ms']['p90'] <= 1000)
+        self.assertEqual(item['time_to_first_token_ms']['calls'], 10)
+        self.assertEqual(item['tokens_per_second'], round(500 * 1000 / 5500, 2))
+        self.assertIsNone(results[1]['time_to_first_token_ms'])
+
+        results = self.report(group_by='project,agent', agent='writer')
+        self.assertEqual(results, [{
+            'project': self.project.id, 'agent': 'writer',
+            'duration_ms': results[0]['duration_ms'], 'time_to_first_token_ms': None,
+            'output_tokens': 50, 'tokens_per_second': 10.0,
+        }])
+
+    def test_report_range_and_project_scope(self):
+        other_query, = create_queries(self.other_project, self.user, 1, 0, 0, status='in_progress')
+        old = timezone.now() - timedelta(days=3)
+        self.bulk([self.usage(500), self.usage(700, query=other_query), self.usage(900, started_at=old.isoformat())])
+
+        self.assertEqual(len(self.report(group_by='project')), 2)
+        own = self.report(self.client, group_by='project')
+        self.assertEqual([(item['project'], item['duration_ms']['calls']) for item in own], [(self.project.id, 1)])
+        self.assertEqual(self.report(self.client, group_by='project', project=self.other_project.id)[0]['project'], self.project.id)
+
+        since = (old - timedelta(hours=1)).isoformat()
+        results = self.report(group_by='project', project=self.project.id, since=since)
+        self.assertEqual(results[0]['duration_ms']['calls'], 2)
+
+        response = self.service_client.get('/api/token-usage/latency/', {'group_by': 'query'})
+        self.assertEqual(response.status_code, 400)
+        response = self.service_client.get('/api/token-usage/latency/', {'since': since, 'until': since})
+        self.assertEqual(response.status_code, 400)
+
+    def test_report_reads_histograms_not_logs(self):
+        self.bulk([self.usage(300 + i, 90) for i in range(5)])
+        with self.assertQueryBudget(2, 'GET /api/token-usage/latency/') as context:
+            self.service_client.get('/api/token-usage/latency/')
+        self.assertNotIn('token_usage_logs', context.captured_queries[-1]['sql'])
+        self.assertQueryCountIndependentOf(
+            lambda: self.service_client.get('/api/token-usage/latency/'),
+            lambda: token_latency.record_latency(TokenUsageLog.objects.bulk_create([
+                TokenUsageLog(
+                    project=self.project, query=self.query, model_name=f'model-{i % 3}', ai_agent_name='planner',
+                    duration_ms=100 + i * 37, time_to_first_token_ms=20 + i, completion_tokens=50
+                )
+                for i in range(200)
+            ])),
+            'GET /api/token-usage/latency/'
+        )
+
+    def test_rebuild_recomputes_histograms(self):
+        self.bulk([self.usage(ms, 50) for ms in (150, 150, 2000, 45000)])
+        expected = sorted(TokenLatencyBucket.objects.values_list('metric', 'bucket', 'calls', 'total_ms', 'output_tokens'))
+        TokenLatencyBucket.objects.update(calls=999)
+        call_command('rebuild_token_latency', stdout=StringIO())
+        self.assertEqual(
+            sorted(TokenLatencyBucket.objects.values_list('metric', 'bucket', 'calls', 'total_ms', 'output_tokens')),
+            expected
+        )
+
+
+class SearchTests(ApiTestCase):
+    """
+    Полнотекстовый поиск: ранжирование, ограничение проектом, инкрементальное обновление индекса
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        create_queries(cls.project, cls.user, 20)
+        cls.auth_query = Query.objects.create(
+            project=cls.project, user=cls.user, query_text='Протестировать авторизацию', answer_text='Тест-кейсы входа'
+        )
+        cls.answer_query = Query.objects.create(
+            project=cls.project, user=cls.user, query_text='Проверить форму', answer_text='Нужна авторизация по SSO'
+        )
+        cls.log_query = Query.objects.create(project=cls.project, user=cls.user, query_text='Регрессия')
+        QueryLog.objects.create(project=cls.project, query=cls.log_query, log_data='Шаг: авторизация пользователя')
+        cls.other_query = Query.objects.create(
+            project=cls.other_project, user=cls.service, query_text='Протестировать авторизацию'
+        )
+
+    def search(self, client, **params):
+        response = client.get('/api/queries/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [(item['id'], item['match']) for item in response.data['results']]
+
+    def test_ranked_and_project_scoped(self):
+        with self.assertQueryBudget(4, 'GET /api/queries/search/'):
+            results = self.search(self.client, q='авторизац')
+        # Совпадение в тексте запроса выше совпадений в ответе и логах
+        self.assertEqual(results[0], (self.auth_query.id, 'query'))
+        self.assertCountEqual(results, [
+            (self.auth_query.id, 'query'), (self.answer_query.id, 'query'), (self.log_query.id, 'log'),
+        ])
+
+    def test_cross_project_search(self):
+        ids = [query_id for query_id, _ in self.search(self.service_client, q='протестировать авторизацию')]
+        self.assertCountEqual(ids, [self.auth_query.id, self.other_query.id])
+        ids = [query_id for query_id, _ in self.search(
+            self.service_client, q='протестировать авторизацию', project=self.other_project.id
+        )]
+        self.assertEqual(ids, [self.other_query.id])
+
+    def test_index_follows_writes(self):
+        query = Query.objects.create(project=self.project, user=self.user, query_text='Новый запрос')
+        self.assertEqual(self.search(self.client, q='экспорт'), [])
+        Query.objects.filter(id=query.id).update(answer_text='Экспорт в TestIt')
+        self.assertEqual(self.search(self.client, q='экспорт'), [(query.id, 'query')])
+        query.delete()
+        self.assertEqual(self.search(self.client, q='экспорт'), [])
+
+    def test_requires_text(self):
+        self.assertEqual(self.client.get('/api/queries/search/').status_code, 400)
+        self.assertEqual(self.service_client.get('/api/queries/search/?q=x&project=abc').status_code, 400)
+        self.assertEqual(self.search(self.client, q='!!!'), [])
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser(username='root', email='root@example.com', password='x')
+        self.client.force_login(admin)
+        response = self.client.get('/admin/queries/query/', {'q': 'авторизац'})
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual(
+            [query.id for query in response.context['cl'].result_list],
+            [self.auth_query.id, self.answer_query.id, self.other_query.id]
+        )
+        response = self.client.get('/admin/queries/querylog/', {'q': 'авторизац'})
+        self.assertEqual(
+            [log.query_id for log in response.context['cl'].result_list], [self.log_query.id]
+        )
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 triggers exist only on SQLite')
+    def test_missing_triggers_are_restored(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER queries_fts_insert')
+        self.assertTrue(search.get_backend().ensure_index(connection))
+        query = Query.objects.create(project=self.project, user=self.user, query_text='Миграция данных')
+        self.assertEqual(self.search(self.client, q='миграция'), [(query.id, 'query')])
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 triggers exist only on SQLite')
+    def test_restored_triggers_match_migration(self):
+        # ensure_index восстанавливает триггеры из search.py, миграция создает свои копии
+        def normalize(sql):
+            return ' '.join(sql.replace('IF NOT EXISTS ', '').split())
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", ['%fts%'])
+            installed = {name: normalize(sql) for name, sql in cursor.fetchall()}
+        self.assertEqual(installed, {name: normalize(sql) for name, sql in search.SQLITE_TRIGGERS.items()})
+
+
+@override_settings(PERF_SAMPLE_RATE=0, ADMIN_QUERY_LOGS_PREVIEW=10)
+class AdminTests(QueryBudgetMixin, TestCase):
+    """
+    Админка больших таблиц: число SQL не зависит от объема данных, без неограниченных COUNT и inline
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = Project.objects.create(project_name='Alpha')
+        cls.user = User.objects.create_user(username='alice', email='alice@example.com', password='x', project=cls.project)
+        cls.admin = User.objects.create_superuser(username='root', email='root@example.com', password='x')
+        cls.queries = create_queries(cls.project, cls.user, 20, logs_per_query=30)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def grow(self):
+        create_queries(self.project, self.user, 20, logs_per_query=30)
+
+    def test_changelists(self):
+        for url in ['/admin/queries/query/', '/admin/queries/querylog/', '/admin/queries/tokenusagelog/']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertQueryCountIndependentOf(lambda: self.client.get(url), self.grow, url)
+
+    def test_token_usage_changelist_defers_prompts(self):
+        response = self.client.get('/admin/queries/tokenusagelog/')
+        token_log = response.context['cl'].result_list[0]
+        self.assertIn('system_prompt', token_log.get_deferred_fields())
+
+    def test_filters_by_id(self):
+        query = self.queries[0]
+        response = self.client.get('/admin/queries/querylog/', {'query_id': query.id})
+        self.assertEqual(response.context['cl'].result_count, 30)
+        response = self.client.get('/admin/queries/query/', {'project_id': self.project.id, 'status': 'done'})
+        self.assertEqual(response.context['cl'].result_count, 20)
+        self.assertContains(response, f'name="project_id" value="{self.project.id}"')
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=100)
+    def test_estimated_and_capped_counts(self):
+        response = self.client.get('/admin/queries/querylog/')
+        self.assertEqual(response.context['cl'].paginator.count, QueryLog.objects.order_by('-id').first().id)
+        response = self.client.get('/admin/queries/querylog/', {'project_id': self.project.id})
+        self.assertEqual(response.context['cl'].paginator.count, 101)
+
+    def test_change_page_shows_bounded_log_preview(self):
+        query = self.queries[0]
+        response = self.client.get(f'/admin/queries/query/{query.id}/change/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Latest 10 logs')
+        self.assertContains(response, f'/admin/queries/querylog/?query_id={query.id}')
+        self.assertContains(response, 'log 29')
+        self.assertNotContains(response, 'log 19<')
+
+    def test_delete_selected_uses_bulk_path(self):
+        selected = [query.id for query in self.queries[:3]]
+        data = {'action': 'delete_selected', '_selected_action': selected}
+        # Страница подтверждения не собирает логи выбранных запросов
+        response = self.client.post('/admin/queries/query/', data)
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryCountIndependentOf(
+            lambda: self.client.post('/admin/queries/query/', data), self.grow, 'delete_selected confirmation'
+        )
+        response = self.client.post('/admin/queries/query/', {**data, 'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Query.objects.filter(id__in=selected).exists())
+        self.assertFalse(QueryLog.objects.filter(query_id__in=selected).exists())
@@ -0,0 +1,172 @@
+"""
+Бюджеты токенов проектов на день и месяц.
+
+Расход не считается через SUM(total_tokens) по TokenUsageLog на каждый claim/create:
+запись TokenUsageLog (одиночная или пакетная) в той же транзакции увеличивает счетчики
+ProjectTokenCounter дня и месяца лога: UPDATE ... SET tokens = tokens + N на счетчик,
+пакет логов - одно увеличение на проект и период. Логи после записи не изменяются и
+не удаляются через API, поэтому счетчики не расходятся с ними.
+
+- Создание запроса проекта сверх бюджета отклоняется (429, Retry-After - до начала
+  следующего периода); ответ из кэша ответов токенов не тратит и выдается всегда.
+- claim_next не выдает запросы проектов сверх бюджета: они остаются в очереди до
+  начала следующего периода или увеличения бюджета.
+- Работа, начатая до превышения, не прерывается: бюджет может быть превышен на расход
+  уже выполняющихся запросов.
+- Команда reconcile_token_counters пересчитывает счетчики из логов.
+
+Периоды считаются в часовом поясе TIME_ZONE.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+
+from .models import ProjectTokenCounter, TokenUsageLog
+
+DAY = ProjectTokenCounter.PERIOD_DAY
+MONTH = ProjectTokenCounter.PERIOD_MONTH
+BUDGET_FIELDS = {DAY: 'daily_token_budget', MONTH: 'monthly_token_budget'}
+PERIOD_NAMES = {DAY: 'дневной', MONTH: 'месячный'}
+
+
+def period_starts(now=None):
+    """Первые дни текущих периодов: {'day': дата, 'month': дата}"""
+    today = timezone.localdate(now)
+    return {DAY: today, MONTH: today.replace(day=1)}
+
+
+def next_period_start(period, start):
+    if period == DAY:
+        return start + timedelta(days=1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def record_usage(logs):
+    """
+    Учесть расход токенов записанных логов TokenUsageLog.
+    Период определяется по времени лога (TokenUsageLog.datetime), как и в reconcile:
+    лог, записанный на границе суток, попадает в тот же счетчик, что и при пересчете.
+    Вызывается в транзакции записи логов: по одному UPDATE на счетчик дня и месяца
+    проекта (INSERT - только для первой записи проекта в периоде)
+    """
+    increments = {}
+    for log in logs:
+        if log.total_tokens <= 0:
+            continue
+        for period, start in period_starts(log.datetime).items():
+            key = (log.project_id, period, start)
+            increments[key] = increments.get(key, 0) + log.total_tokens
+
+    for (project_id, period, start), tokens in increments.items():
+        counter = ProjectTokenCounter.objects.filter(project_id=project_id, period=period, period_start=start)
+        if counter.update(tokens=F('tokens') + tokens):
+            continue
+        try:
+            with transaction.atomic():
+                ProjectTokenCounter.objects.create(
+                    project_id=project_id, period=period, period_start=start, tokens=tokens
+                )
+        except IntegrityError:
+            # Параллельная запись создала счетчик первой
+            counter.update(tokens=F('tokens') + tokens)
+
+
+def over_budget_project_ids(now=None):
+    """
+    Подзапрос id проектов, исчерпавших дневной или месячный бюджет.
+    Не коррелирован с очередью: вычисляется один раз по счетчикам текущих периодов
+    """
+    starts = period_starts(now)
+    return ProjectTokenCounter.objects.filter(
+        Q(period=DAY, period_start=starts[DAY], tokens__gte=F('project__daily_token_budget'))
+        | Q(period=MONTH, period_start=starts[MONTH], tokens__gte=F('project__monthly_token_budget'))
+    ).values('project_id')
+
+
+def exceeded_budget(project, now=None):
+    """
+    Исчерпанный бюджет проекта: (период, расход, бюджет, начало следующего периода) или None.
+    Для проектов без бюджета SQL не выполняется, иначе - один SELECT по счетчикам
+    """
+    if not project.has_token_budget():
+        return None
+    starts = period_starts(now)
+    used = dict(
+        ProjectTokenCounter.objects.filter(
+            Q(period=DAY, period_start=starts[DAY]) | Q(period=MONTH, period_start=starts[MONTH]),
+            project_id=project.id
+        ).values_list('period', 'tokens')
+    )
+    for period in (MONTH, DAY):
+        budget = getattr(project, BUDGET_FIELDS[period])
+        if budget is not None and used.get(period, 0) >= budget:
+            return period, used.get(period, 0), budget, _start_of(next_period_start(period, starts[period]))
+    return None
+
+
+def check_budget(project):
+    """
+    Проверить бюджет токенов проекта перед созданием запроса.
+    Выбрасывает Throttled (429 + Retry-After до начала следующего периода), если бюджет исчерпан
+    """
+    exceeded = exceeded_budget(project)
+    if exceeded is None:
+        return
+    period, used, budget, resets_at = exceeded
+    raise Throttled(
+        wait=max(1, int((resets_at - timezone.now()).total_seconds())),
+        detail=f"Исчерпан {PERIOD_NAMES[period]} бюджет токенов проекта ({used} из {budget}). "
+               f"Бюджет обновится {timezone.localtime(resets_at):%d.%m.%Y %H:%M}."
+    )
+
+
+def reconcile(days=1, project_ids=None, now=None):
+    """
+    Пересчитать счетчики из TokenUsageLog: дневные - за последние days дней,
+    месячные - за месяцы, которые эти дни затрагивают.
+    Счетчики блокируются на время пересчета: параллельная запись логов ждет и увеличивает
+    уже пересчитанное значение. Счетчики только увеличиваются: логи удаляются вместе с запросами,
+    и пересчет после удаления не должен возвращать проекту потраченный бюджет.
+    Возвращает число записанных счетчиков
+    """
+    today = timezone.localdate(now)
+    periods = [(DAY, today - timedelta(days=offset)) for offset in range(days)]
+    periods += sorted({(MONTH, day.replace(day=1)) for _, day in periods})
+
+    written = 0
+    for period, start in periods:
+        with transaction.atomic():
+            counters = ProjectTokenCounter.objects.select_for_update().filter(period=period, period_start=start)
+            logs = TokenUsageLog.objects.filter(
+                datetime__gte=_start_of(start), datetime__lt=_start_of(next_period_start(period, start))
+            )
+            if project_ids is not None:
+                counters = counters.filter(project_id__in=project_ids)
+                logs = logs.filter(project_id__in=project_ids)
+            existing = {project_id: (counter_id, tokens) for project_id, counter_id, tokens in counters.values_list(
+                'project_id', 'id', 'tokens'
+            )}
+            totals = dict(
+                logs.order_by().values('project_id').annotate(tokens=Sum('total_tokens')).values_list(
+                    'project_id', 'tokens'
+                )
+            )
+
+            ProjectTokenCounter.objects.bulk_create([
+                ProjectTokenCounter(project_id=project_id, period=period, period_start=start, tokens=tokens or 0)
+                for project_id, tokens in totals.items() if project_id not in existing
+            ])
+            updated = [
+                ProjectTokenCounter(id=counter_id, tokens=totals[project_id])
+                for project_id, (counter_id, tokens) in existing.items() if (totals.get(project_id) or 0) > tokens
+            ]
+            ProjectTokenCounter.objects.bulk_update(updated, ['tokens'], batch_size=500)
+            written += len(totals) - len(set(totals) & set(existing)) + len(updated)
+    return written
@@ -0,0 +1,212 @@
+"""
+Задержки вызовов моделей: перцентили по модели, агенту и проекту без чтения TokenUsageLog.
+
+Агент передает в записи использования токенов длительность вызова (duration_ms или
+started_at/finished_at) и время до первого токена (time_to_first_token_ms).
+Запись TokenUsageLog в той же транзакции увеличивает счетчики TokenLatencyBucket -
+часовую гистограмму с фиксированными границами LATENCY_BUCKETS_MS: по одному
+UPDATE ... SET calls = calls + N на интервал (пакет логов - одно увеличение на интервал).
+
+Отчет (GET /api/token-usage/latency/) суммирует интервалы за диапазон часов одним
+GROUP BY; перцентили интерполируются внутри интервала, как histogram_quantile в
+Prometheus, поэтому их точность ограничена шириной интервала. Скорость генерации -
+выходные токены на секунду суммарной длительности вызовов.
+
+Команда rebuild_token_latency пересчитывает гистограммы из логов (например,
+после изменения границ интервалов).
+"""
+from bisect import bisect_left
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import TokenLatencyBucket, TokenUsageLog
+
+DURATION = TokenLatencyBucket.METRIC_DURATION
+TTFT = TokenLatencyBucket.METRIC_TTFT
+
+# Верхние границы интервалов, мс; последний интервал - больше всех границ
+LATENCY_BUCKETS_MS = (
+    50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500,
+    10000, 15000, 20000, 30000, 45000, 60000, 90000, 120000, 180000, 300000,
+)
+PERCENTILES = (50, 90, 95, 99)
+
+# Группировки отчета: параметр group_by -> поле TokenLatencyBucket
+GROUP_FIELDS = {'project': 'project_id', 'model': 'model_name', 'agent': 'ai_agent_name'}
+
+
+def bucket_index(value_ms):
+    """Индекс интервала для длительности value_ms"""
+    return bisect_left(LATENCY_BUCKETS_MS, value_ms)
+
+
+def hour_start(moment):
+    """Начало часа (UTC), к которому относится момент"""
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _output_tokens(completion_tokens, output_tokens):
+    return completion_tokens or output_tokens or 0
+
+
+def _increments(rows):
+    """
+    Суммы для счетчиков: {(project_id, hour, model, agent, metric, bucket): [calls, total_ms, tokens]}.
+    rows - (project_id, момент вызова, model_name, ai_agent_name, duration_ms, ttft_ms, выходные токены)
+    """
+    increments = {}
+    for project_id, moment, model_name, agent_name, duration_ms, ttft_ms, tokens in rows:
+        hour = hour_start(moment)
+        for metric, value in ((DURATION, duration_ms), (TTFT, ttft_ms)):
+            if value is None:
+                continue
+            key = (project_id, hour, model_name, agent_name, metric, bucket_index(value))
+            counts = increments.setdefault(key, [0, 0, 0])
+            counts[0] += 1
+            counts[1] += value
+            if metric == DURATION:
+                counts[2] += tokens
+    return increments
+
+
+def record_latency(logs):
+    """
+    Учесть задержки записанных логов TokenUsageLog.
+    Вызывается в транзакции записи логов: по одному UPDATE на интервал гистограммы
+    (INSERT - только для первого вызова в интервале за час); логи без времени пропускаются
+    без SQL
+    """
+    increments = _increments(
+        (
+            log.project_id, log.started_at or log.datetime, log.model_name, log.ai_agent_name,
+            log.duration_ms, log.time_to_first_token_ms,
+            _output_tokens(log.completion_tokens, log.output_tokens)
+        )
+        for log in logs
+    )
+    for (project_id, hour, model_name, agent_name, metric, bucket), (calls, total_ms, tokens) in increments.items():
+        key = dict(
+            project_id=project_id, hour=hour, model_name=model_name, ai_agent_name=agent_name,
+            metric=metric, bucket=bucket
+        )
+        counter = TokenLatencyBucket.objects.filter(**key)
+        if counter.update(calls=F('calls') + calls, total_ms=F('total_ms') + total_ms,
+                          output_tokens=F('output_tokens') + tokens):
+            continue
+        try:
+            with transaction.atomic():
+                TokenLatencyBucket.objects.create(**key, calls=calls, total_ms=total_ms, output_tokens=tokens)
+        except IntegrityError:
+            # Параллельная запись создала счетчик первой
+            counter.update(calls=F('calls') + calls, total_ms=F('total_ms') + total_ms,
+                           output_tokens=F('output_tokens') + tokens)
+
+
+def quantile(counts, fraction):
+    """
+    Перцентиль по числу вызовов в интервалах ({индекс интервала: число}) с линейной
+    интерполяцией внутри интервала; для последнего интервала - его нижняя граница
+    """
+    total = sum(counts.values())
+    rank = fraction * total
+    seen = 0
+    for index in sorted(counts):
+        count = counts[index]
+        if seen + count >= rank and count:
+            if index >= len(LATENCY_BUCKETS_MS):
+                return float(LATENCY_BUCKETS_MS[-1])
+            lower = LATENCY_BUCKETS_MS[index - 1] if index else 0
+            upper = LATENCY_BUCKETS_MS[index]
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return float(LATENCY_BUCKETS_MS[-1])
+
+
+def _summary(counts, total_ms):
+    calls = sum(counts.values())
+    if not calls:
+        return None
+    summary = {'calls': calls, 'mean': round(total_ms / calls, 1)}
+    for percentile in PERCENTILES:
+        summary[f'p{percentile}'] = round(quantile(counts, percentile / 100), 1)
+    return summary
+
+
+def report(start, end, group_by=tuple(GROUP_FIELDS), project_ids=None, model_name=None, ai_agent_name=None):
+    """
+    Перцентили задержек и скорость генерации за часы [start, end) по группам group_by
+    (ключи GROUP_FIELDS). Один SELECT с GROUP BY по гистограммам: объем чтения зависит
+    от числа групп и интервалов, а не от числа вызовов
+    """
+    fields = [GROUP_FIELDS[name] for name in group_by]
+    buckets = TokenLatencyBucket.objects.filter(hour__gte=hour_start(start), hour__lt=end)
+    if project_ids is not None:
+        buckets = buckets.filter(project_id__in=project_ids)
+    if model_name:
+        buckets = buckets.filter(model_name=model_name)
+    if ai_agent_name:
+        buckets = buckets.filter(ai_agent_name=ai_agent_name)
+    rows = buckets.order_by().values(*fields, 'metric', 'bucket').annotate(
+        calls_sum=Sum('calls'), total_ms_sum=Sum('total_ms'), tokens_sum=Sum('output_tokens')
+    )
+
+    groups = {}
+    for row in rows:
+        group = groups.setdefault(tuple(row[field] for field in fields), {
+            DURATION: ({}, [0, 0]), TTFT: ({}, [0, 0]),
+        })
+        counts, totals = group[row['metric']]
+        counts[row['bucket']] = row['calls_sum']
+        totals[0] += row['total_ms_sum']
+        totals[1] += row['tokens_sum']
+
+    results = []
+    for key in sorted(groups, key=lambda values: [str(value) for value in values]):
+        group = groups[key]
+        (duration_counts, (duration_total, tokens)), (ttft_counts, (ttft_total, _)) = group[DURATION], group[TTFT]
+        item = {name: value for name, value in zip(group_by, key)}
+        item['duration_ms'] = _summary(duration_counts, duration_total)
+        item['time_to_first_token_ms'] = _summary(ttft_counts, ttft_total)
+        item['output_tokens'] = tokens
+        item['tokens_per_second'] = round(tokens * 1000 / duration_total, 2) if duration_total else None
+        results.append(item)
+    return results
+
+
+def rebuild(days=1, project_ids=None, now=None):
+    """
+    Пересчитать гистограммы за последние days суток (с начала часа) из TokenUsageLog.
+    Выполняется в одной транзакции; возвращает число записанных счетчиков
+    """
+    since = hour_start((now or timezone.now()) - timedelta(days=days))
+    logs = TokenUsageLog.objects.annotate(moment=Coalesce('started_at', 'datetime')).filter(
+        Q(duration_ms__isnull=False) | Q(time_to_first_token_ms__isnull=False), moment__gte=since
+    )
+    buckets = TokenLatencyBucket.objects.filter(hour__gte=since)
+    if project_ids is not None:
+        logs = logs.filter(project_id__in=project_ids)
+        buckets = buckets.filter(project_id__in=project_ids)
+
+    with transaction.atomic():
+        buckets.delete()
+        rows = logs.order_by().values_list(
+            'project_id', 'moment', 'model_name', 'ai_agent_name', 'duration_ms', 'time_to_first_token_ms',
+            'completion_tokens', 'output_tokens'
+        ).iterator(chunk_size=2000)
+        increments = _increments(
+            (project_id, moment, model, agent, duration, ttft, _output_tokens(completion, output))
+            for project_id, moment, model, agent, duration, ttft, completion, output in rows
+        )
+        TokenLatencyBucket.objects.bulk_create([
+            TokenLatencyBucket(
+                project_id=project_id, hour=hour, model_name=model_name, ai_agent_name=agent_name,
+                metric=metric, bucket=bucket, calls=calls, total_ms=total_ms, output_tokens=tokens
+            )
+            for (project_id, hour, model_name, agent_name, metric, bucket), (calls, total_ms, tokens)
+            in increments.items()
+        ], batch_size=500)
+    return len(increments)
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import QueryViewSet, QueryLogViewSet, TokenUsageLogViewSet
+from .views import QueryViewSet, QueryLogViewSet, TokenUsageLogViewSet, metrics_view
+from .async_views import claim_next_wait, query_log_stream, query_logs_bulk_create
 
 router = DefaultRouter()
 router.register(r'queries', QueryViewSet, basename='query')
@@ -8,5 +9,10 @@ router.register(r'logs', QueryLogViewSet, basename='querylog')
 router.register(r'token-usage', TokenUsageLogViewSet, basename='tokenusage')
 
 urlpatterns = [
+    path('metrics/', metrics_view, name='metrics'),
+    # Async-эндпоинты (ASGI); должны стоять до маршрутов роутера
+    path('queries/claim_next/wait/', claim_next_wait, name='query_claim_next_wait'),
+    path('queries/<int:pk>/logs/stream/', query_log_stream, name='query_log_stream'),
+    path('logs/bulk/', query_logs_bulk_create, name='querylog_bulk_create'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
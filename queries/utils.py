@@ -1,50 +1,102 @@
+import asyncio
 import threading
-import requests
 import logging
+
+import httpx
 from django.conf import settings
+from . import metrics
 
 logger = logging.getLogger(__name__)
 
+_loop = None
+_client = None
+_loop_lock = threading.Lock()
+
 
-def notify_fastapi_async(query_id):
+def _get_notifier_loop():
     """
-    Отправить уведомление в FastAPI в отдельном потоке.
-    Не блокирует основной запрос.
+    Фоновый event loop уведомлений (один на процесс).
+    Все уведомления идут через один httpx.AsyncClient с keep-alive пулом,
+    вместо отдельного потока и соединения на каждый запрос
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name='fastapi-notifier', daemon=True
+            ).start()
+            _loop = loop
+    return _loop
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=2,  # Короткий таймаут - не ждем долго
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _client
+
+
+async def _post_notification(query_id, query_ids=None):
+    """
+    Отправить уведомление о запросе в FastAPI
 
     Args:
         query_id: ID созданного запроса
+        query_ids: ID всех запросов пакета (одно уведомление на пакет)
     """
     try:
         payload = {
             "query_id": query_id,
             "webbuddy_url": settings.WEBBUDDY_URL
         }
+        if query_ids:
+            payload["query_ids"] = query_ids
         logger.info(f"Sending notification to FastAPI: {payload}")
 
-        response = requests.post(
+        response = await _get_client().post(
             f"{settings.FASTAPI_URL}/api/process-query",
             json=payload,
-            timeout=2  # Короткий таймаут - не ждем долго
         )
 
         if response.status_code == 200:
+            metrics.notifications.inc(result='success')
             logger.info(f"Successfully notified FastAPI about query {query_id}")
         else:
+            metrics.notifications.inc(result='http_error')
             logger.warning(
                 f"FastAPI returned {response.status_code} for query {query_id}. "
                 f"Response: {response.text}. "
                 f"Query will be picked up by polling."
             )
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
+        metrics.notifications.inc(result='timeout')
         logger.warning(
             f"FastAPI timeout for query {query_id}. "
             f"Query will be picked up by polling."
         )
-    except requests.exceptions.ConnectionError:
+    except httpx.TransportError:
+        metrics.notifications.inc(result='unavailable')
         logger.warning(
             f"FastAPI unavailable for query {query_id}. "
             f"Query will be picked up by polling."
         )
     except Exception as e:
-        logger.error(f"Error notifying FastAPI about query {query_id}: {e}")
\ No newline at end of file
+        metrics.notifications.inc(result='error')
+        logger.error(f"Error notifying FastAPI about query {query_id}: {e}")
+
+
+def notify_fastapi_async(query_id, query_ids=None):
+    """
+    Отправить уведомление в FastAPI в фоновом event loop.
+    Не блокирует основной запрос и может вызываться как из sync, так и из async кода.
+
+    Args:
+        query_id: ID созданного запроса (первого запроса пакета)
+        query_ids: ID всех запросов пакета
+    """
+    return asyncio.run_coroutine_threadsafe(_post_notification(query_id, query_ids), _get_notifier_loop())
@@ -1,27 +1,72 @@
-from django.db import transaction
+from datetime import timedelta
+
 from django.utils import timezone
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes, renderer_classes
+from rest_framework.exceptions import Throttled
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Sum, Count
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from .models import Query, QueryLog, TokenUsageLog
+from projects.models import Project
+from users.permissions import HasCrossProjectAccess
+from webbuddy.db_router import ReplicaReadMixin
+from . import admission, answer_cache, answer_chunks, deletion, events, metrics, token_budget, token_latency
+from .idempotency import idempotent
+from .search import search as full_text_search
+from .services import (
+    InvalidStatusTransition, QueryCancelled, cancel_query, claim_next_query, filter_logs, finish_query,
+    scope_to_user
+)
 from .serializers import (
+    AnswerChunkSerializer, QueryBulkDeleteSerializer, QueryBulkItemSerializer,
     QuerySerializer, QueryCreateSerializer, QueryDetailSerializer,
-    QueryLogSerializer, TokenUsageLogSerializer, TokenUsageStatsSerializer
+    QueryCompleteSerializer, QueryFinishSerializer,
+    QueryLogSerializer, TokenUsageLogSerializer, TokenUsageLogBulkItemSerializer,
+    TokenLatencyReportSerializer, TokenUsageStatsSerializer, query_log_values, query_values, token_usage_log_values
 )
+from .utils import notify_fastapi_async
 
 
 # ============ API-представления ============
 
 
-class QueryViewSet(viewsets.ModelViewSet):
+class ValuesListMixin:
+    """
+    Список (list) без ModelSerializer: строки values() сериализуются напрямую
+    (ValuesSerializer), вывод совпадает с serializer_class поле в поле.
+    Отключается настройкой API_FAST_READ_PATHS
+    """
+    values_serializer = None
+
+    def list(self, request, *args, **kwargs):
+        if not settings.API_FAST_READ_PATHS:
+            return super().list(request, *args, **kwargs)
+        return self.values_response(self.filter_queryset(self.get_queryset()), self.values_serializer)
+
+    def values_response(self, queryset, values_serializer):
+        rows = values_serializer.values(queryset)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(values_serializer.to_representation(page))
+        return Response(values_serializer.to_representation(rows))
+
+
+class QueryViewSet(ReplicaReadMixin, ValuesListMixin, viewsets.ModelViewSet):
     """
     ViewSet для модели Query
     Предоставляет CRUD-операции и дополнительные действия для запросов
     """
     queryset = Query.objects.all()
+    values_serializer = query_values
     permission_classes = [IsAuthenticated]
+    # Действия status и answer передают pk в ORM и int() без get_object(): нечисловой pk - 404 маршрутизатора
+    lookup_value_regex = r'\d+'
+    # Списки читаются с реплики; status (проверка отмены воркером) - всегда из основной БД
+    replica_actions = ('list', 'retrieve', 'logs', 'by_status', 'answer_cache_stats')
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -36,9 +81,17 @@ class QueryViewSet(viewsets.ModelViewSet):
         Сервисные аккаунты и администраторы видят все запросы
         """
         user = self.request.user
-        if user.has_cross_project_access():
-            return Query.objects.all()
-        return Query.objects.filter(project=user.project)
+        queryset = Query.objects.select_related('user', 'project')
+        if not user.has_cross_project_access():
+            queryset = queryset.filter(project_id=user.project_id)
+
+        if self.action in ['list', 'by_status', 'search']:
+            # Число логов одним коррелированным подзапросом вместо COUNT на каждую строку
+            logs_count = QueryLog.objects.filter(query=OuterRef('pk')).order_by().values(
+                'query'
+            ).annotate(count=Count('id')).values('count')
+            queryset = queryset.annotate(annotated_logs_count=Coalesce(Subquery(logs_count), 0))
+        return queryset
 
     def perform_create(self, serializer):
         """
@@ -46,13 +99,39 @@ class QueryViewSet(viewsets.ModelViewSet):
         """
         serializer.save(user=self.request.user)
 
+    @idempotent('queries.create')
     def create(self, request, *args, **kwargs):
         """
-        Переопределение create для возврата полных данных запроса
+        Переопределение create для возврата полных данных запроса.
+        Повтор с тем же заголовком Idempotency-Key возвращает исходный ответ
+        без создания нового запроса
         """
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+
+        # Свежий ответ из кэша проекта: запрос сразу завершен, в очередь не ставится
+        project = serializer.validated_data['project']
+        if serializer.validated_data['use_cache']:
+            entry = answer_cache.lookup(project, serializer.validated_data['query_text'])
+            if entry is not None:
+                instance = answer_cache.create_from_cache(
+                    entry, project, request.user, serializer.validated_data['query_text']
+                )
+                output_serializer = QuerySerializer(instance)
+                headers = self.get_success_headers(output_serializer.data)
+                return Response(output_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+        # Бюджет токенов проекта и admission control: 429 с Retry-After
+        try:
+            token_budget.check_budget(project)
+            admission.check_admission(project.id)
+        except Throttled:
+            metrics.queries_rejected.inc()
+            raise
+
         self.perform_create(serializer)
+        admission.note_admitted(project.id)
+        metrics.queries_created.inc()
 
         # Возврат полных данных запроса с id
         instance = serializer.instance
@@ -60,10 +139,103 @@ class QueryViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(output_serializer.data)
         return Response(output_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @action(detail=False, methods=['post'])
+    @idempotent('queries.bulk')
+    def bulk(self, request):
+        """
+        Пакетное создание запросов: один INSERT и одно уведомление воркеров на пакет.
+        Тело: список {"project": id, "query_text": "..."} или {"queries": [...]}.
+        Пакет принимается целиком или отклоняется целиком: проверки проектов, бюджета токенов
+        и admission control - для всего пакета до записи. Кэш ответов не используется:
+        все запросы ставятся в очередь. Возвращает id созданных запросов в порядке пакета
+        """
+        items = request.data.get('queries') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({'detail': 'Expected a non-empty list of queries'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.QUERY_BULK_CREATE_MAX_ITEMS:
+            return Response(
+                {'detail': f'Too many queries in one request (max {settings.QUERY_BULK_CREATE_MAX_ITEMS})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = QueryBulkItemSerializer(data=items, many=True)
+        serializer.is_valid(raise_exception=True)
+        records = serializer.validated_data
+
+        # Одна выборка проектов пакета; чужие проекты для пользователя не существуют
+        projects = Project.objects.filter(id__in={record['project'] for record in records})
+        if not request.user.has_cross_project_access():
+            projects = projects.filter(id=request.user.project_id)
+        projects = projects.in_bulk()
+        errors = {
+            index: f"Project {record['project']} not found"
+            for index, record in enumerate(records) if record['project'] not in projects
+        }
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        counts = {}
+        for record in records:
+            counts[record['project']] = counts.get(record['project'], 0) + 1
+        try:
+            for project_id in counts:
+                token_budget.check_budget(projects[project_id])
+            admission.check_admission_many(counts)
+        except Throttled:
+            metrics.queries_rejected.inc(len(records))
+            raise
+
+        queries = Query.objects.bulk_create([
+            Query(project_id=record['project'], user=request.user, query_text=record['query_text'], status='queued')
+            for record in records
+        ])
+        for project_id, count in counts.items():
+            admission.note_admitted(project_id, count)
+        metrics.queries_created.inc(len(queries))
+
+        # bulk_create не отправляет post_save: одно уведомление и одно пробуждение на пакет
+        ids = [query.id for query in queries]
+        notify_fastapi_async(ids[0], ids)
+        events.query_queued.notify()
+        return Response({'created': len(ids), 'ids': ids}, status=status.HTTP_201_CREATED)
+
+    def perform_update(self, serializer):
+        """
+        Обновление запроса воркером.
+        Статус меняется только по Query.STATUS_TRANSITIONS.
+        При завершении без answer_text ответ собирается из опубликованных частей.
+        При переходе в 'done'/'failed' время завершения проставляется на сервере.
+        Отмененный запрос не меняется: воркер получает 409 и прекращает обработку
+        """
+        previous_status = serializer.instance.status
+        if previous_status == 'cancelled':
+            raise QueryCancelled()
+        new_status = serializer.validated_data.get('status', previous_status)
+        if new_status != previous_status and not Query.can_transition(previous_status, new_status):
+            raise InvalidStatusTransition(previous_status, new_status)
+        if new_status != previous_status and new_status in ('done', 'failed'):
+            # Опубликованные части ответа становятся answer_text, если ответ не передан явно
+            with transaction.atomic():
+                chunks = answer_chunks.collapse(serializer.instance.pk)
+                if chunks and 'answer_text' not in serializer.validated_data:
+                    query = serializer.save(answer_text=chunks)
+                else:
+                    query = serializer.save()
+        else:
+            query = serializer.save()
+
+        if query.status != previous_status and query.status in Query.FINISHED_STATUSES:
+            if query.query_finished is None:
+                query.query_finished = timezone.now()
+                query.save(update_fields=['query_finished'])
+            metrics.observe_completion(query)
+            if query.status == 'done':
+                answer_cache.store(query)
+
     def destroy(self, request, *args, **kwargs):
         """
         Удаление запроса (только если это запрос пользователя из его проекта)
-        Можно удалять только запросы в статусах 'done' или 'failed'
+        Можно удалять только завершенные запросы: 'done', 'failed' или 'cancelled'
         """
         instance = self.get_object()
 
@@ -74,23 +246,155 @@ class QueryViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        # Проверка статуса: можно удалять только завершенные или ошибочные запросы
-        if instance.status not in ['done', 'failed']:
+        # Проверка статуса: можно удалять только завершенные запросы, активные сначала отменяются
+        if instance.status not in Query.FINISHED_STATUSES:
             return Response(
-                {"detail": f"Нельзя удалить запрос в статусе '{instance.status}'. Можно удалять только запросы в статусах 'done' или 'failed'"},
+                {"detail": f"Нельзя удалить запрос в статусе '{instance.status}'. Можно удалять только запросы в статусах 'done', 'failed' или 'cancelled'"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
         self.perform_destroy(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def perform_destroy(self, instance):
+        # Логи удаляются пачками, без загрузки в память сборщиком каскада
+        deletion.delete_query_ids([instance.pk])
+
+    @action(detail=False, methods=['post'])
+    def bulk_delete(self, request):
+        """
+        Массовое удаление завершенных запросов по фильтру:
+        ids - id запросов, status - статусы из 'done', 'failed', 'cancelled' (по умолчанию все три),
+        finished_before - завершенные раньше момента, project - проект (для сервисных аккаунтов
+        и администраторов). Нужен ids или finished_before. Активные запросы не удаляются.
+        Возвращает число удаленных запросов
+        """
+        serializer = QueryBulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        filters = serializer.validated_data
+
+        queryset = scope_to_user(Query.objects.all(), request.user).filter(
+            status__in=filters.get('status', Query.FINISHED_STATUSES)
+        )
+        if 'ids' in filters:
+            queryset = queryset.filter(id__in=filters['ids'])
+        if 'finished_before' in filters:
+            queryset = queryset.filter(query_finished__lt=filters['finished_before'])
+        if 'project' in filters:
+            queryset = queryset.filter(project_id=filters['project'])
+        return Response({'deleted': deletion.delete_queries(queryset)})
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """
+        Отмена запроса в статусе 'queued' или 'in_progress'.
+        Запрос из очереди больше не будет выдан claim_next; воркер, который уже
+        обрабатывает запрос, узнает об отмене по флагу в ответе на запись логов
+        или через GET /api/queries/{id}/status/. Повторная отмена не является ошибкой
+        """
+        query = self.get_object()
+        if query.status != 'cancelled' and not cancel_query(query):
+            # Запрос уже завершен или успел завершиться после выборки - сообщаем актуальный статус
+            query.refresh_from_db()
+            if query.status != 'cancelled':
+                return Response(
+                    {"detail": f"Нельзя отменить запрос в статусе '{query.status}'. Можно отменять только запросы в статусах 'queued' или 'in_progress'"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        return Response(QuerySerializer(query).data)
+
+    @action(detail=True, methods=['post'])
+    @idempotent('queries.complete')
+    def complete(self, request, pk=None):
+        """
+        Завершение запроса статусом 'done' одним вызовом.
+        Тело: {"answer_text": "...", "logs": [{"log_data": "..."}], "token_usage": [{...}]};
+        ответ, последние логи и использование токенов записываются одной транзакцией,
+        время завершения проставляется на сервере. Без answer_text ответ собирается
+        из опубликованных частей (POST /api/queries/{id}/answer/)
+        """
+        return self._finish(request, 'done', QueryCompleteSerializer)
+
+    @action(detail=True, methods=['post'])
+    @idempotent('queries.fail')
+    def fail(self, request, pk=None):
+        """
+        Завершение запроса статусом 'failed' одним вызовом; тело как у complete,
+        answer_text (описание ошибки) необязателен
+        """
+        return self._finish(request, 'failed', QueryFinishSerializer)
+
+    def _finish(self, request, new_status, serializer_class):
+        query = self.get_object()
+        serializer = serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        finish_query(query, new_status, **serializer.validated_data)
+        if new_status == 'done':
+            answer_cache.store(query)
+        return Response(QuerySerializer(query).data)
+
+    @action(detail=True, methods=['get'])
+    def answer(self, request, pk=None):
+        """
+        Новые части ответа для наблюдателей: ?after=<id последней полученной части>.
+        У завершенного запроса частей нет - answer_text содержит итоговый ответ
+        """
+        try:
+            after = int(request.query_params.get('after', 0))
+        except ValueError:
+            return Response({'detail': 'after must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        row = scope_to_user(Query.objects.filter(pk=pk), request.user).values('status', 'answer_text').first()
+        if row is None:
+            return Response({'detail': 'No Query matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+        if row['status'] in ('done', 'failed'):
+            return Response({'id': int(pk), 'status': row['status'], 'chunks': [], 'answer_text': row['answer_text']})
+        return Response({
+            'id': int(pk), 'status': row['status'], 'chunks': answer_chunks.read(pk, after), 'answer_text': None
+        })
+
+    @answer.mapping.post
+    @idempotent('queries.answer')
+    def append_answer(self, request, pk=None):
+        """
+        Дописать часть ответа запроса в статусе 'in_progress': {"text": "..."}.
+        Строка запроса не перезаписывается; части собираются в answer_text при чтении и завершении
+        """
+        query = self.get_object()
+        serializer = AnswerChunkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if query.status == 'cancelled':
+            raise QueryCancelled()
+        if query.status != 'in_progress':
+            return Response(
+                {'detail': f"Нельзя дописать ответ запроса в статусе '{query.status}'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        chunk = answer_chunks.append(query, serializer.validated_data['text'])
+        return Response({'id': chunk.id, 'query': query.id}, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'], url_path='status')
+    def status_probe(self, request, pk=None):
+        """
+        Легкая проверка статуса запроса для воркеров: одна выборка одного столбца,
+        без сериализации запроса и подсчета логов
+        """
+        query_status = scope_to_user(Query.objects.filter(pk=pk), request.user).values_list(
+            'status', flat=True
+        ).first()
+        if query_status is None:
+            return Response({'detail': 'No Query matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'id': int(pk), 'status': query_status, 'cancelled': query_status == 'cancelled'})
+
     @action(detail=True, methods=['get'])
     def logs(self, request, pk=None):
         """
-        Получение логов для конкретного запроса с пагинацией
+        Получение логов для конкретного запроса с пагинацией.
+        Фильтры: ?level=warning,error, ?agent=, ?step=
         """
         query = self.get_object()
-        logs = query.logs.all()
+        logs = filter_logs(query.logs.all(), request.query_params)
+        if settings.API_FAST_READ_PATHS:
+            return self.values_response(logs, query_log_values)
 
         page = self.paginate_queryset(logs)
         if page is not None:
@@ -119,41 +423,118 @@ class QueryViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Полнотекстовый поиск по запросам: текст запроса, ответ и логи.
+        ?q= - строка поиска, ?limit= - число результатов,
+        ?project= - проект (для сервисных аккаунтов и администраторов)
+        Результаты отсортированы по релевантности, поиск ограничен проектом пользователя
+        """
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'detail': 'Query parameter q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({'detail': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.SEARCH_MAX_RESULTS))
+
+        user = request.user
+        if user.has_cross_project_access():
+            project = request.query_params.get('project')
+            if project and not project.isdigit():
+                return Response({'detail': 'project must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+            project_ids = [int(project)] if project else None
+        else:
+            project_ids = [user.project_id] if user.project_id else []
+
+        hits = full_text_search(text, project_ids, limit)
+        queries = self.get_queryset().in_bulk([query_id for query_id, _, _ in hits])
+
+        results = []
+        for query_id, score, match in hits:
+            query = queries.get(query_id)
+            if query is None:
+                continue
+            data = QuerySerializer(query).data
+            data['score'] = round(score, 6)
+            data['match'] = match
+            results.append(data)
+        return Response({'count': len(results), 'results': results})
+
+    @action(detail=False, methods=['get'], url_path='answer_cache')
+    def answer_cache_stats(self, request):
+        """
+        Статистика кэша ответов по проектам пользователя: попадания, промахи, число записей
+        """
+        projects = Project.objects.all()
+        if not request.user.has_cross_project_access():
+            projects = projects.filter(id=request.user.project_id)
+        rows = projects.annotate(entries=Count('answer_cache_entries')).values(
+            'id', 'project_name', 'answer_cache_enabled', 'context_version', 'entries',
+            'answer_cache_stats__hits', 'answer_cache_stats__misses'
+        ).order_by('id')
+
+        results = []
+        for row in rows:
+            hits = row['answer_cache_stats__hits'] or 0
+            misses = row['answer_cache_stats__misses'] or 0
+            results.append({
+                'project': row['id'],
+                'project_name': row['project_name'],
+                'enabled': row['answer_cache_enabled'],
+                'context_version': row['context_version'],
+                'entries': row['entries'],
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+            })
+        return Response(results)
+
     @action(detail=False, methods=['post'])
     def claim_next(self, request):
         """
         Атомарное получение следующего запроса из очереди для обработки
         Возвращает полученный запрос или 404, если очередь пуста
         """
-        with transaction.atomic():
-            # Получение первого запроса в очереди с блокировкой на уровне строки
-            query = self.get_queryset().select_for_update(skip_locked=True).filter(
-                status='queued'
-            ).order_by('query_created').first()
+        query = claim_next_query(self.get_queryset())
+        if query is None:
+            return Response(
+                {'detail': 'No queued queries available'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        # Возврат полных данных запроса
+        serializer = QuerySerializer(query)
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
-            if not query:
-                return Response(
-                    {'detail': 'No queued queries available'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
 
-            # Обновление статуса на in_progress
-            query.status = 'in_progress'
-            query.query_started = timezone.now()
-            query.save()
+class QueryCancelledFlagMixin:
+    """
+    Ответ на создание записи, привязанной к запросу, содержит query_cancelled:
+    воркер узнает об отмене запроса из записи лога без отдельного обращения к API
+    """
 
-            # Возврат полных данных запроса
-            serializer = QuerySerializer(query)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        data = serializer.data
+        # Запрос уже загружен при валидации поля query - дополнительного SQL нет
+        data['query_cancelled'] = serializer.instance.query.status == 'cancelled'
+        headers = self.get_success_headers(data)
+        return Response(data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class QueryLogViewSet(viewsets.ModelViewSet):
+class QueryLogViewSet(ReplicaReadMixin, ValuesListMixin, QueryCancelledFlagMixin, viewsets.ModelViewSet):
     """
     ViewSet для модели QueryLog
     Позволяет внешнему сервису создавать логи
     """
     queryset = QueryLog.objects.all()
     serializer_class = QueryLogSerializer
+    values_serializer = query_log_values
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
@@ -164,16 +545,31 @@ class QueryLogViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if user.has_cross_project_access():
             return QueryLog.objects.all()
-        return QueryLog.objects.filter(project=user.project)
+        return QueryLog.objects.filter(project_id=user.project_id)
+
+    def filter_queryset(self, queryset):
+        """
+        Фильтры списка: ?level=warning,error, ?agent=, ?step=
+        """
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list':
+            queryset = filter_logs(queryset, self.request.query_params)
+        return queryset
 
 
-class TokenUsageLogViewSet(viewsets.ModelViewSet):
+class TokenUsageLogViewSet(ReplicaReadMixin, ValuesListMixin, QueryCancelledFlagMixin, viewsets.ModelViewSet):
     """
-    ViewSet для модели TokenUsageLog
+    ViewSet для модели TokenUsageLog.
+    Логи только создаются и читаются: изменение или удаление total_tokens и времени вызова
+    разошлось бы со счетчиками бюджета (ProjectTokenCounter) и гистограммами задержек
+    (TokenLatencyBucket), поэтому PUT, PATCH и DELETE не поддерживаются (405)
     """
+    http_method_names = ['get', 'post', 'head', 'options']
     queryset = TokenUsageLog.objects.all()
     serializer_class = TokenUsageLogSerializer
+    values_serializer = token_usage_log_values
     permission_classes = [IsAuthenticated]
+    replica_actions = ('list', 'retrieve', 'statistics', 'latency')
 
     def get_queryset(self):
         """
@@ -183,7 +579,78 @@ class TokenUsageLogViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if user.has_cross_project_access():
             return TokenUsageLog.objects.all()
-        return TokenUsageLog.objects.filter(project=user.project)
+        return TokenUsageLog.objects.filter(project_id=user.project_id)
+
+    def perform_create(self, serializer):
+        """
+        Запись лога, счетчиков бюджета токенов проекта и гистограмм задержек в одной транзакции
+        """
+        with transaction.atomic():
+            log = serializer.save()
+            token_budget.record_usage([log])
+            token_latency.record_latency([log])
+
+    @action(detail=False, methods=['post'])
+    @idempotent('token_usage.bulk')
+    def bulk(self, request):
+        """
+        Пакетная запись использования токенов одним INSERT (и счетчиков бюджета проектов).
+        Тело: список объектов TokenUsageLog или {"token_usage": [...]};
+        project можно не передавать - он берется из запроса.
+        В ответе cancelled_queries - отмененные запросы из пачки
+        """
+        items = request.data.get('token_usage') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'detail': 'Expected a non-empty list of token usage records'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.QUERY_LOG_BULK_MAX_ITEMS:
+            return Response(
+                {'detail': f'Too many records in one request (max {settings.QUERY_LOG_BULK_MAX_ITEMS})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = TokenUsageLogBulkItemSerializer(data=items, many=True)
+        serializer.is_valid(raise_exception=True)
+        records = serializer.validated_data
+
+        # Одна выборка проектов запросов вместо проверки каждого элемента отдельно
+        rows = scope_to_user(Query.objects.filter(id__in={r['query'] for r in records}), request.user).values_list(
+            'id', 'project_id', 'status'
+        )
+        query_projects = {}
+        cancelled = []
+        for query_id, project_id, query_status in rows:
+            query_projects[query_id] = project_id
+            if query_status == 'cancelled':
+                cancelled.append(query_id)
+        errors = {}
+        for index, record in enumerate(records):
+            project_id = query_projects.get(record['query'])
+            if project_id is None:
+                errors[index] = f"Query {record['query']} not found"
+            elif record.get('project') not in (None, project_id):
+                errors[index] = f"Query {record['query']} belongs to project {project_id}"
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            logs = TokenUsageLog.objects.bulk_create([
+                TokenUsageLog(
+                    **{key: value for key, value in record.items() if key not in ('query', 'project')},
+                    query_id=record['query'],
+                    project_id=query_projects[record['query']]
+                )
+                for record in records
+            ])
+            # Счетчики бюджета: одно увеличение на проект и период пачки; гистограммы - на интервал
+            token_budget.record_usage(logs)
+            token_latency.record_latency(logs)
+        return Response(
+            {'created': len(logs), 'ids': [log.id for log in logs], 'cancelled_queries': sorted(cancelled)},
+            status=status.HTTP_201_CREATED
+        )
 
     @action(detail=False, methods=['get'])
     def statistics(self, request):
@@ -219,4 +686,44 @@ class TokenUsageLogViewSet(viewsets.ModelViewSet):
         stats['by_model'] = {item['model_name']: item for item in by_model}
 
         serializer = TokenUsageStatsSerializer(stats)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def latency(self, request):
+        """
+        Перцентили задержек вызовов моделей (длительность и время до первого токена)
+        и скорость генерации по проекту, модели и агенту за период.
+        Параметры: since, until (по умолчанию - последние сутки, точность - час),
+        project, model, agent, group_by (через запятую из project, model, agent).
+        Читаются только часовые гистограммы TokenLatencyBucket, не логи
+        """
+        params = TokenLatencyReportSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = params.validated_data
+        until = filters.get('until') or timezone.now()
+        since = filters.get('since') or until - timedelta(days=1)
+
+        if request.user.has_cross_project_access():
+            project_ids = [filters['project']] if 'project' in filters else None
+        else:
+            project_ids = [request.user.project_id]
+        results = token_latency.report(
+            since, until, group_by=filters['group_by'], project_ids=project_ids,
+            model_name=filters.get('model'), ai_agent_name=filters.get('agent')
+        )
+        return Response({
+            'since': token_latency.hour_start(since),
+            'until': until,
+            'percentiles': list(token_latency.PERCENTILES),
+            'results': results,
+        })
+
+
+@api_view(['GET'])
+@permission_classes([HasCrossProjectAccess])
+@renderer_classes([metrics.PrometheusRenderer])
+def metrics_view(request):
+    """
+    Метрики очереди в формате Prometheus (для сервисных аккаунтов и администраторов)
+    """
+    return Response(metrics.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import UserCreationForm
 from django.utils.crypto import get_random_string
-from .models import User
+from .api_keys import revoke_api_key
+from .models import User, ServiceApiKey
 
 
 class CustomUserCreationForm(UserCreationForm):
@@ -69,4 +70,33 @@ class UserAdmin(BaseUserAdmin):
             # In production, send email with temp password
             self.message_user(request, f'Password for {user.username} reset to: {temp_password}')
 
-    reset_password_to_temp.short_description = "Reset password to temporary"
\ No newline at end of file
+    reset_password_to_temp.short_description = "Reset password to temporary"
+
+
+@admin.register(ServiceApiKey)
+class ServiceApiKeyAdmin(admin.ModelAdmin):
+    """
+    Admin interface for service account API keys.
+    Keys are issued via the issue_api_key management command.
+    """
+    list_display = ('prefix', 'user', 'name', 'created_at', 'revoked_at')
+    list_filter = ('revoked_at',)
+    list_select_related = ('user',)
+    search_fields = ('prefix', 'name', 'user__username')
+    readonly_fields = ('user', 'prefix', 'key_hash', 'created_at', 'revoked_at')
+    fields = ('user', 'name', 'prefix', 'key_hash', 'created_at', 'revoked_at')
+
+    actions = ['revoke_keys']
+
+    def has_add_permission(self, request):
+        return False
+
+    def revoke_keys(self, request, queryset):
+        """
+        Admin action to revoke selected API keys
+        """
+        for api_key in queryset.filter(revoked_at__isnull=True):
+            revoke_api_key(api_key)
+            self.message_user(request, f'API key {api_key.prefix} revoked')
+
+    revoke_keys.short_description = "Revoke selected API keys"
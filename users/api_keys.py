@@ -0,0 +1,119 @@
+"""
+Выпуск и проверка API-ключей сервисных аккаунтов.
+
+Формат ключа: ``wb_<prefix>.<secret>``. Префикс хранится открыто и
+используется для поиска записи по уникальному индексу, сам ключ проверяется
+через HMAC-SHA256 и hmac.compare_digest. В отличие от PBKDF2 в
+authenticate() проверка занимает микросекунды, поэтому ключ можно
+передавать в каждом запросе без отдельного логина.
+
+Результаты успешной проверки кэшируются в памяти процесса на
+API_KEY_CACHE_SECONDS секунд. revoke_api_key очищает кэш только текущего
+процесса: в остальных процессах отозванный ключ, как и ключ деактивированного
+пользователя, продолжает проходить проверку до истечения их кэша, то есть не
+дольше API_KEY_CACHE_SECONDS. Если это окно недопустимо, API_KEY_CACHE_SECONDS=0
+отключает кэш (один SELECT на запрос).
+"""
+import hashlib
+import hmac
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from .models import ServiceApiKey
+
+KEY_PREFIX = 'wb_'
+PREFIX_LENGTH = 8
+SECRET_LENGTH = 40
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _hash_key(raw_key):
+    secret = getattr(settings, 'API_KEY_HASH_SECRET', None) or settings.SECRET_KEY
+    return hmac.new(secret.encode(), raw_key.encode(), hashlib.sha256).hexdigest()
+
+
+def _split_key(raw_key):
+    """Возвращает префикс ключа или None, если формат неверный"""
+    if not raw_key or not raw_key.startswith(KEY_PREFIX):
+        return None
+    prefix, sep, secret = raw_key[len(KEY_PREFIX):].partition('.')
+    if not sep or len(prefix) != PREFIX_LENGTH or not secret:
+        return None
+    return prefix
+
+
+def issue_api_key(user, name=''):
+    """
+    Выпустить новый ключ для пользователя.
+    Возвращает (ServiceApiKey, raw_key); raw_key больше нигде не сохраняется
+    """
+    while True:
+        prefix = get_random_string(PREFIX_LENGTH, 'abcdefghijklmnopqrstuvwxyz0123456789')
+        if not ServiceApiKey.objects.filter(prefix=prefix).exists():
+            break
+    raw_key = f"{KEY_PREFIX}{prefix}.{get_random_string(SECRET_LENGTH)}"
+    api_key = ServiceApiKey.objects.create(
+        user=user,
+        name=name,
+        prefix=prefix,
+        key_hash=_hash_key(raw_key),
+    )
+    return api_key, raw_key
+
+
+def revoke_api_key(api_key):
+    """Отозвать ключ и убрать его из кэша текущего процесса"""
+    if api_key.revoked_at is None:
+        api_key.revoked_at = timezone.now()
+        api_key.save(update_fields=['revoked_at'])
+    invalidate_cached_key(api_key.prefix)
+
+
+def rotate_api_key(api_key):
+    """Отозвать ключ и выпустить новый с тем же владельцем и именем"""
+    revoke_api_key(api_key)
+    return issue_api_key(api_key.user, api_key.name)
+
+
+def invalidate_cached_key(prefix):
+    with _cache_lock:
+        _cache.pop(prefix, None)
+
+
+def get_user_for_api_key(raw_key):
+    """
+    Проверить ключ и вернуть пользователя-владельца или None.
+    """
+    prefix = _split_key(raw_key)
+    if prefix is None:
+        return None
+
+    key_hash = _hash_key(raw_key)
+    ttl = getattr(settings, 'API_KEY_CACHE_SECONDS', 60)
+    now = time.monotonic()
+
+    with _cache_lock:
+        cached = _cache.get(prefix)
+    if cached and now - cached[2] < ttl:
+        user, stored_hash, _ = cached
+        return user if hmac.compare_digest(stored_hash, key_hash) else None
+
+    api_key = ServiceApiKey.objects.select_related('user').filter(
+        prefix=prefix, revoked_at__isnull=True
+    ).first()
+    if api_key is None or not hmac.compare_digest(api_key.key_hash, key_hash):
+        return None
+
+    user = api_key.user
+    if not user.is_active or not user.is_service_account():
+        return None
+
+    with _cache_lock:
+        _cache[prefix] = (user, api_key.key_hash, now)
+    return user
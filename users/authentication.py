@@ -0,0 +1,55 @@
+"""
+Аутентификация сервисных аккаунтов по API-ключу
+"""
+from rest_framework import authentication, exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .api_keys import get_user_for_api_key
+
+
+class ApiKeyAuthentication(authentication.BaseAuthentication):
+    """
+    Принимает ключ в заголовке ``Authorization: Api-Key <key>``
+    или ``X-API-Key: <key>``
+    """
+    keyword = 'Api-Key'
+
+    def authenticate(self, request):
+        raw_key = request.META.get('HTTP_X_API_KEY')
+        if not raw_key:
+            auth = authentication.get_authorization_header(request).split()
+            if not auth or auth[0].lower() != self.keyword.lower().encode():
+                return None
+            if len(auth) != 2:
+                raise exceptions.AuthenticationFailed('Invalid API key header')
+            raw_key = auth[1].decode('latin-1')
+
+        user = get_user_for_api_key(raw_key)
+        if user is None:
+            raise exceptions.AuthenticationFailed('Invalid API key')
+        return (user, None)
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+def authenticate_request(request):
+    """
+    Аутентифицировать обычный Django HttpRequest вне DRF-представления
+    (middleware, async-представления): сессия, затем классы из
+    DEFAULT_AUTHENTICATION_CLASSES. Возвращает пользователя или None
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+
+    drf_request = Request(request)
+    for authenticator_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authenticator_class().authenticate(drf_request)
+        except exceptions.APIException:
+            return None
+        if result is not None:
+            return result[0]
+    return None
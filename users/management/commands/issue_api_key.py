@@ -0,0 +1,52 @@
+"""
+Management command для выпуска API-ключа сервисного аккаунта
+"""
+from django.core.management.base import BaseCommand
+from users.api_keys import issue_api_key
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Выпустить API-ключ для сервисного аккаунта'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--username',
+            type=str,
+            required=True,
+            help='Имя пользователя сервисного аккаунта'
+        )
+        parser.add_argument(
+            '--name',
+            type=str,
+            default='',
+            help='Название ключа (например, имя воркера)'
+        )
+
+    def handle(self, *args, **options):
+        username = options['username']
+
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            self.stdout.write(
+                self.style.ERROR(f'Пользователь "{username}" не найден!')
+            )
+            return
+
+        if not user.is_service_account():
+            self.stdout.write(
+                self.style.ERROR(f'Пользователь "{username}" не является сервисным аккаунтом!')
+            )
+            return
+
+        api_key, raw_key = issue_api_key(user, options['name'])
+
+        self.stdout.write(self.style.SUCCESS('\n' + '='*60))
+        self.stdout.write(self.style.SUCCESS('API-ключ успешно выпущен!'))
+        self.stdout.write(self.style.SUCCESS('='*60))
+        self.stdout.write(f'Username: {user.username}')
+        self.stdout.write(f'Name: {api_key.name}')
+        self.stdout.write(f'Prefix: {api_key.prefix}')
+        self.stdout.write(self.style.WARNING(f'\nКлюч (сохраните его, повторно он не показывается!): {raw_key}'))
+        self.stdout.write(self.style.SUCCESS('\n' + '='*60))
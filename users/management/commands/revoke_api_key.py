@@ -0,0 +1,49 @@
+"""
+Management command для отзыва API-ключей сервисного аккаунта
+"""
+from django.core.management.base import BaseCommand
+from users.api_keys import revoke_api_key
+from users.models import ServiceApiKey
+
+
+class Command(BaseCommand):
+    help = 'Отозвать API-ключ (или все ключи пользователя)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prefix',
+            type=str,
+            help='Префикс отзываемого ключа'
+        )
+        parser.add_argument(
+            '--username',
+            type=str,
+            help='Отозвать все активные ключи пользователя'
+        )
+
+    def handle(self, *args, **options):
+        prefix = options.get('prefix')
+        username = options.get('username')
+
+        if not prefix and not username:
+            self.stdout.write(
+                self.style.ERROR('Укажите --prefix или --username')
+            )
+            return
+
+        keys = ServiceApiKey.objects.filter(revoked_at__isnull=True)
+        if prefix:
+            keys = keys.filter(prefix=prefix)
+        if username:
+            keys = keys.filter(user__username=username)
+
+        revoked = 0
+        for api_key in keys:
+            revoke_api_key(api_key)
+            revoked += 1
+            self.stdout.write(f'Отозван ключ {api_key.prefix} ({api_key.name or "без имени"})')
+
+        if revoked:
+            self.stdout.write(self.style.SUCCESS(f'Отозвано ключей: {revoked}'))
+        else:
+            self.stdout.write(self.style.WARNING('Активные ключи не найдены'))
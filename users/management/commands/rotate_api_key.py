@@ -0,0 +1,43 @@
+"""
+Management command для ротации API-ключа сервисного аккаунта
+"""
+from django.core.management.base import BaseCommand
+from users.api_keys import rotate_api_key
+from users.models import ServiceApiKey
+
+
+class Command(BaseCommand):
+    help = 'Отозвать API-ключ и выпустить новый для того же сервисного аккаунта'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prefix',
+            type=str,
+            required=True,
+            help='Префикс ключа, который нужно заменить'
+        )
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+
+        try:
+            old_key = ServiceApiKey.objects.select_related('user').get(
+                prefix=prefix, revoked_at__isnull=True
+            )
+        except ServiceApiKey.DoesNotExist:
+            self.stdout.write(
+                self.style.ERROR(f'Активный ключ с префиксом "{prefix}" не найден!')
+            )
+            return
+
+        api_key, raw_key = rotate_api_key(old_key)
+
+        self.stdout.write(self.style.SUCCESS('\n' + '='*60))
+        self.stdout.write(self.style.SUCCESS('API-ключ успешно заменен!'))
+        self.stdout.write(self.style.SUCCESS('='*60))
+        self.stdout.write(f'Username: {api_key.user.username}')
+        self.stdout.write(f'Name: {api_key.name}')
+        self.stdout.write(f'Отозванный префикс: {old_key.prefix}')
+        self.stdout.write(f'Новый префикс: {api_key.prefix}')
+        self.stdout.write(self.style.WARNING(f'\nНовый ключ (сохраните его, повторно он не показывается!): {raw_key}'))
+        self.stdout.write(self.style.SUCCESS('\n' + '='*60))
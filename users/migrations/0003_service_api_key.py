@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_role'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceApiKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=100, verbose_name='Name')),
+                ('prefix', models.CharField(max_length=16, unique=True, verbose_name='Prefix')),
+                ('key_hash', models.CharField(max_length=64, verbose_name='Key Hash')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('revoked_at', models.DateTimeField(blank=True, null=True, verbose_name='Revoked At')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='api_keys', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Service API Key',
+                'verbose_name_plural': 'Service API Keys',
+                'db_table': 'service_api_keys',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -47,4 +47,36 @@ class User(AbstractUser):
         verbose_name_plural = 'Users'
 
     def __str__(self):
-        return f"{self.username} - {self.fio_name}"
\ No newline at end of file
+        return f"{self.username} - {self.fio_name}"
+
+
+class ServiceApiKey(models.Model):
+    """
+    API-ключ сервисного аккаунта.
+    Сам ключ не хранится: только публичный префикс (для поиска по индексу)
+    и HMAC-SHA256 от полного ключа
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='api_keys',
+        verbose_name='User'
+    )
+    name = models.CharField(max_length=100, blank=True, verbose_name='Name')
+    prefix = models.CharField(max_length=16, unique=True, verbose_name='Prefix')
+    key_hash = models.CharField(max_length=64, verbose_name='Key Hash')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
+    revoked_at = models.DateTimeField(null=True, blank=True, verbose_name='Revoked At')
+
+    class Meta:
+        db_table = 'service_api_keys'
+        verbose_name = 'Service API Key'
+        verbose_name_plural = 'Service API Keys'
+        ordering = ['-created_at']
+
+    @property
+    def is_active(self):
+        return self.revoked_at is None
+
+    def __str__(self):
+        return f"{self.user.username} - {self.prefix}"
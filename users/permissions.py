@@ -2,6 +2,7 @@
 Custom permission classes для управления доступом
 """
 from rest_framework import permissions
+from .models import UserRole
 
 
 class IsServiceAccountOrReadOnly(permissions.BasePermission):
@@ -28,4 +29,13 @@ class HasCrossProjectAccess(permissions.BasePermission):
     Разрешает доступ пользователям с правами cross-project (admin, service, superuser)
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and request.user.has_cross_project_access()
\ No newline at end of file
+        return request.user and request.user.is_authenticated and request.user.has_cross_project_access()
+
+
+class IsAdminRole(permissions.BasePermission):
+    """
+    Разрешает доступ только администраторам (role admin) и суперпользователям
+    """
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and (user.is_superuser or user.role == UserRole.ADMIN))
@@ -1,3 +1,182 @@
-from django.test import TestCase
+import re
+import time
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from webbuddy.testing import ApiTestCase, jwt_client
+from . import api_keys
+from .api_keys import issue_api_key
+from .models import ServiceApiKey, User
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UserApiQueryBudgetTests(ApiTestCase):
+    """
+    Бюджеты SQL-запросов для эндпоинтов users
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user.set_password('secret-pass')
+        cls.user.save(update_fields=['password'])
+        User.objects.bulk_create([
+            User(username=f'user{i}', email=f'user{i}@example.com', project=cls.project) for i in range(10)
+        ])
+        cls.admin = User.objects.create_superuser(username='root', email='root@example.com', password='x')
+
+    def test_list(self):
+        with self.assertQueryBudget(3, 'GET /api/users/'):
+            response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryCountIndependentOf(
+            lambda: self.client.get('/api/users/'),
+            lambda: User.objects.bulk_create([
+                User(username=f'extra{i}', email=f'extra{i}@example.com', project=self.project) for i in range(20)
+            ]),
+            'GET /api/users/'
+        )
+
+    def test_list_superuser(self):
+        with self.assertQueryBudget(3, 'GET /api/users/ (superuser)'):
+            response = jwt_client(self.admin).get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_retrieve(self):
+        with self.assertQueryBudget(2, 'GET /api/users/{id}/'):
+            response = self.client.get(f'/api/users/{self.user.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_me(self):
+        with self.assertQueryBudget(2, 'GET /api/users/me/'):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.data['project_name'], 'Alpha')
+
+    def test_change_password(self):
+        with self.assertQueryBudget(2, 'POST /api/users/change_password/'):
+            response = self.client.post('/api/users/change_password/', {
+                'old_password': 'secret-pass', 'new_password': 'new-secret-pass', 'confirm_password': 'new-secret-pass',
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_login(self):
+        with self.assertQueryBudget(2, 'POST /api/login/'):
+            response = self.client_class().post(
+                '/api/login/', {'username': 'alice', 'password': 'secret-pass'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_api_key_authentication(self):
+        _, raw_key = issue_api_key(self.service, 'test')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Api-Key {raw_key}')
+        with self.assertQueryBudget(1, 'GET /api/users/me/ (API key)'):
+            response = client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 200)
+        # Повторная проверка ключа берется из кэша процесса
+        with self.assertQueryBudget(0, 'GET /api/users/me/ (API key, cached)'):
+            client.get('/api/users/me/')
+
+
+@override_settings(API_KEY_CACHE_SECONDS=60)
+class ApiKeyTests(ApiTestCase):
+    """
+    API-ключи: отзыв, ротация, кэш процесса и команды управления
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.api_key, self.raw_key = issue_api_key(self.service, 'worker-1')
+        self.addCleanup(api_keys._cache.clear)
+
+    @staticmethod
+    def get_me(raw_key, header='HTTP_AUTHORIZATION'):
+        client = APIClient()
+        value = f'Api-Key {raw_key}' if header == 'HTTP_AUTHORIZATION' else raw_key
+        client.credentials(**{header: value})
+        return client.get('/api/users/me/')
+
+    def test_authentication(self):
+        self.assertEqual(self.get_me(self.raw_key).data['username'], 'svc')
+        self.assertEqual(self.get_me(self.raw_key, 'HTTP_X_API_KEY').status_code, 200)
+        self.assertEqual(self.get_me(self.raw_key + 'x').status_code, 401)
+        self.assertEqual(self.get_me('wb_short.secret').status_code, 401)
+        self.assertEqual(self.get_me('not-a-key').status_code, 401)
+
+    def test_key_of_regular_user_is_rejected(self):
+        _, raw_key = issue_api_key(self.user)
+        self.assertIsNone(api_keys.get_user_for_api_key(raw_key))
+
+    def test_revoke_clears_local_cache(self):
+        self.assertEqual(api_keys.get_user_for_api_key(self.raw_key), self.service)
+        self.assertIn(self.api_key.prefix, api_keys._cache)
+
+        api_keys.revoke_api_key(self.api_key)
+        self.assertNotIn(self.api_key.prefix, api_keys._cache)
+        self.assertIsNotNone(ServiceApiKey.objects.get(pk=self.api_key.pk).revoked_at)
+        self.assertEqual(self.get_me(self.raw_key).status_code, 401)
+
+    def test_revocation_in_other_process_applies_after_cache_ttl(self):
+        self.assertEqual(api_keys.get_user_for_api_key(self.raw_key), self.service)
+        # Отзыв из другого процесса: строка обновлена, локальный кэш не тронут
+        ServiceApiKey.objects.filter(pk=self.api_key.pk).update(revoked_at=timezone.now())
+        User.objects.filter(pk=self.service.pk).update(is_active=False)
+        self.assertEqual(api_keys.get_user_for_api_key(self.raw_key), self.service)
+
+        with mock.patch.object(api_keys.time, 'monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(api_keys.get_user_for_api_key(self.raw_key))
+
+    def test_deactivated_user_is_rejected(self):
+        User.objects.filter(pk=self.service.pk).update(is_active=False)
+        self.assertEqual(self.get_me(self.raw_key).status_code, 401)
+
+    def test_rotate(self):
+        self.assertEqual(self.get_me(self.raw_key).status_code, 200)
+        new_key, new_raw_key = api_keys.rotate_api_key(self.api_key)
+        self.assertEqual((new_key.user, new_key.name), (self.service, 'worker-1'))
+        self.assertNotEqual(new_key.prefix, self.api_key.prefix)
+        self.assertEqual(self.get_me(self.raw_key).status_code, 401)
+        self.assertEqual(self.get_me(new_raw_key).status_code, 200)
+
+    def test_rotate_command(self):
+        self.assertEqual(self.get_me(self.raw_key).status_code, 200)
+        out = StringIO()
+        call_command('rotate_api_key', prefix=self.api_key.prefix, stdout=out)
+
+        new_key = ServiceApiKey.objects.get(revoked_at__isnull=True)
+        self.assertIn(f'Новый префикс: {new_key.prefix}', out.getvalue())
+        raw_key = re.search(r'(wb_\S+)', out.getvalue()).group(1)
+        self.assertEqual(self.get_me(raw_key).status_code, 200)
+        self.assertEqual(self.get_me(self.raw_key).status_code, 401)
+
+        out = StringIO()
+        call_command('rotate_api_key', prefix=self.api_key.prefix, stdout=out)
+        self.assertIn('не найден', out.getvalue())
+
+    def test_revoke_command(self):
+        other_key, other_raw_key = issue_api_key(self.service, 'worker-2')
+        self.assertEqual(self.get_me(self.raw_key).status_code, 200)
+
+        out = StringIO()
+        call_command('revoke_api_key', prefix=self.api_key.prefix, stdout=out)
+        self.assertIn('Отозвано ключей: 1', out.getvalue())
+        self.assertEqual(self.get_me(self.raw_key).status_code, 401)
+        self.assertEqual(self.get_me(other_raw_key).status_code, 200)
+
+        out = StringIO()
+        call_command('revoke_api_key', username='svc', stdout=out)
+        self.assertIn(f'Отозван ключ {other_key.prefix} (worker-2)', out.getvalue())
+        self.assertEqual(self.get_me(other_raw_key).status_code, 401)
+        self.assertFalse(ServiceApiKey.objects.filter(revoked_at__isnull=True).exists())
+
+        out = StringIO()
+        call_command('revoke_api_key', username='svc', stdout=out)
+        self.assertIn('Активные ключи не найдены', out.getvalue())
+        out = StringIO()
+        call_command('revoke_api_key', stdout=out)
+        self.assertIn('Укажите --prefix или --username', out.getvalue())
@@ -21,9 +21,10 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        queryset = User.objects.select_related('project')
         if user.is_superuser:
-            return User.objects.all()
-        return User.objects.filter(project=user.project)
+            return queryset
+        return queryset.filter(project_id=user.project_id)
 
     @action(detail=False, methods=['get'])
     def me(self, request):
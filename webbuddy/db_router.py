@@ -0,0 +1,151 @@
+"""
+Чтение с реплик БД для тяжелых читающих эндпоинтов.
+
+Реплики задаются DATABASE_REPLICA_URLS (алиасы replica_1, replica_2, ...).
+С реплики читаются только явно отмеченные безопасные (GET/HEAD) действия:
+списки и статистика (ReplicaReadMixin) и списки админки (replica_reads) -
+и только модели приложений из DATABASE_REPLICA_APPS. Путь записи воркеров
+(claim_next, логи, PATCH статуса), аутентификация и сессии всегда идут в основную БД.
+
+Read-your-writes: после успешного изменяющего запроса пользователь на
+DATABASE_REPLICA_PIN_SECONDS секунд закрепляется за основной БД - в памяти процесса
+(по id пользователя) и cookie (для остальных процессов, см. ReplicaPinMiddleware), поэтому только что
+созданный запрос не пропадает из списка из-за задержки репликации.
+"""
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'webbuddy_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Не чаще раза в столько закреплений удаляются истекшие записи
+_PRUNE_EVERY = 1000
+
+# Алиас реплики, выбранной для текущего запроса (None - основная БД)
+_replica_alias = contextvars.ContextVar('replica_alias', default=None)
+_pins = {}
+_pins_lock = threading.Lock()
+_pin_count = 0
+
+
+def _user_id(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+def pin_to_primary(request, response):
+    """Закрепить пользователя за основной БД после записи"""
+    global _pin_count
+    seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+    user_id = _user_id(request)
+    if user_id is not None:
+        now = time.monotonic()
+        with _pins_lock:
+            _pins[user_id] = now + seconds
+            _pin_count += 1
+            if _pin_count % _PRUNE_EVERY == 0:
+                for expired in [key for key, until in _pins.items() if until <= now]:
+                    del _pins[expired]
+    response.set_cookie(
+        PIN_COOKIE, str(int(time.time() + seconds)), max_age=seconds, httponly=True, samesite='Lax'
+    )
+
+
+def is_pinned(request):
+    """Пользователь недавно писал: читать нужно из основной БД"""
+    try:
+        if int(request.COOKIES.get(PIN_COOKIE, 0)) > time.time():
+            return True
+    except ValueError:
+        pass
+    user_id = _user_id(request)
+    if user_id is None:
+        return False
+    with _pins_lock:
+        until = _pins.get(user_id)
+    return until is not None and until > time.monotonic()
+
+
+def clear_pins():
+    with _pins_lock:
+        _pins.clear()
+
+
+def use_replica(request):
+    """
+    Направить чтения текущего запроса на реплику, если она настроена, метод безопасный
+    и пользователь не закреплен за основной БД. Возвращает токен для release_replica или None.
+    Реплика выбирается один раз на запрос: COUNT пагинации и страница читаются с одной реплики
+    """
+    if not settings.DATABASE_REPLICAS or request.method not in SAFE_METHODS or is_pinned(request):
+        return None
+    return _replica_alias.set(random.choice(settings.DATABASE_REPLICAS))
+
+
+def release_replica(token):
+    if token is not None:
+        _replica_alias.reset(token)
+
+
+@contextmanager
+def replica_reads(request):
+    token = use_replica(request)
+    try:
+        yield
+    finally:
+        release_replica(token)
+
+
+class ReplicaRouter:
+    """
+    Роутер БД: чтения моделей из DATABASE_REPLICA_APPS внутри use_replica/replica_reads -
+    на реплику, все остальное - в основную БД
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _replica_alias.get()
+        if alias is not None and model._meta.app_label in settings.DATABASE_REPLICA_APPS:
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Явно: иначе Django пишет объект в БД, из которой он был прочитан (реплику)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Схема реплик приходит репликацией из основной БД
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Действия DRF-представления из replica_actions читают с реплики
+    (если пользователь не закреплен за основной БД)
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.replica_actions:
+            self._replica_token = use_replica(request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        release_replica(getattr(self, '_replica_token', None))
+        self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
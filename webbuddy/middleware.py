@@ -1,5 +1,18 @@
+import gzip
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
 
+from users.authentication import authenticate_request
+from . import db_router, performance, profiling, static_serving
+
+perf_logger = logging.getLogger('webbuddy.performance')
+
 
 class DisableCSRFForAPIMiddleware(MiddlewareMixin):
     """
@@ -7,4 +20,246 @@ class DisableCSRFForAPIMiddleware(MiddlewareMixin):
     """
     def process_request(self, request):
         if request.path.startswith('/api/'):
-            setattr(request, '_dont_enforce_csrf_checks', True)
\ No newline at end of file
+            setattr(request, '_dont_enforce_csrf_checks', True)
+
+class PerformanceMiddleware:
+    """
+    Инструментирование запросов: число SQL-запросов, время в БД, время view
+    (вместе с сериализацией), время рендеринга и размер ответа до сжатия.
+
+    Измеряется только доля PERF_SAMPLE_RATE запросов, остальные проходят
+    без накладных расходов. Для измеренных запросов добавляется заголовок
+    Server-Timing, обновляются агрегаты по маршруту, а запросы дольше
+    PERF_SLOW_REQUEST_MS пишутся в лог вместе с самыми медленными SQL.
+    SQL учитывается и под ASGI (см. webbuddy/performance.py).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        performance.enable_sql_tracking()
+
+    @staticmethod
+    def _sampled():
+        sample_rate = settings.PERF_SAMPLE_RATE
+        return sample_rate > 0 and (sample_rate >= 1 or random.random() < sample_rate)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+
+        stats = performance.RequestStats()
+        request._perf_stats = stats
+        token = performance.start(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            performance.finish(token)
+        return self._finish(request, response, stats)
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+
+        stats = performance.RequestStats()
+        request._perf_stats = stats
+        token = performance.start(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            performance.finish(token)
+        return self._finish(request, response, stats)
+
+    def _finish(self, request, response, stats):
+        stats.finished = time.perf_counter()
+        if not response.streaming:
+            stats.response_size = getattr(response, 'uncompressed_size', None) or len(response.content)
+
+        response['Server-Timing'] = stats.server_timing()
+
+        route = self._route_name(request)
+        performance.record(route, stats)
+
+        if stats.total_ms >= settings.PERF_SLOW_REQUEST_MS:
+            self._log_slow_request(request, route, stats)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = getattr(request, '_perf_stats', None)
+        if stats is not None:
+            stats.view_started = time.perf_counter()
+        return None
+
+    def process_template_response(self, request, response):
+        # DRF Response рендерится после выхода из view: засекаем границу
+        # и время окончания рендеринга через post-render callback
+        stats = getattr(request, '_perf_stats', None)
+        if stats is not None:
+            stats.view_finished = time.perf_counter()
+
+            def mark_rendered(rendered_response):
+                stats.render_finished = time.perf_counter()
+
+            response.add_post_render_callback(mark_rendered)
+        return response
+
+    @staticmethod
+    def _route_name(request):
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else 'unresolved'
+        return f'{request.method} {route}'
+
+    @staticmethod
+    def _log_slow_request(request, route, stats):
+        statements = '\n'.join(
+            f'  {duration * 1000:.1f} ms: {sql}' for duration, sql in stats.slowest_statements()
+        )
+        perf_logger.warning(
+            f"Slow request {request.method} {request.path} ({route}): "
+            f"total {stats.total_ms:.1f} ms, db {stats.db_ms:.1f} ms in {stats.db_queries} queries, "
+            f"{stats.response_size} bytes. Slowest SQL:\n{statements}"
+        )
+
+
+class ProfilerMiddleware:
+    """
+    Профилирование запроса по требованию администратора
+    (заголовок X-Profile или параметр ?_profile=1).
+    Запросы без маркера не проходят никаких дополнительных проверок.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not profiling.is_profiling_requested(request):
+            return self.get_response(request)
+
+        if not profiling.can_profile(authenticate_request(request)):
+            return self.get_response(request)
+
+        response, name = profiling.profile_request(self.get_response, request)
+        response['X-Profile-Id'] = name
+        return response
+
+    async def __acall__(self, request):
+        if not profiling.is_profiling_requested(request):
+            return await self.get_response(request)
+
+        user = await sync_to_async(authenticate_request)(request)
+        if not profiling.can_profile(user):
+            return await self.get_response(request)
+
+        response, name = await profiling.profile_request_async(self.get_response, request)
+        response['X-Profile-Id'] = name
+        return response
+
+
+class ReplicaPinMiddleware:
+    """
+    Закрепляет пользователя за основной БД после успешного изменяющего запроса
+    (POST/PUT/PATCH/DELETE с ответом 2xx/3xx). Без реплик ничего не делает
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self._wrote(request, response):
+            db_router.pin_to_primary(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self._wrote(request, response):
+            # request.user вне DRF может лениво читать сессию из БД
+            await sync_to_async(db_router.pin_to_primary)(request, response)
+        return response
+
+    @staticmethod
+    def _wrote(request, response):
+        return (
+            bool(settings.DATABASE_REPLICAS)
+            and request.method not in db_router.SAFE_METHODS
+            and response.status_code < 400
+        )
+
+
+class JSONCompressionMiddleware:
+    """
+    Сжатие больших JSON-ответов (br или gzip) по Accept-Encoding.
+    Ответы меньше RESPONSE_COMPRESSION_MIN_BYTES, не-JSON (HTML админки) и потоковые
+    ответы (SSE логов) не сжимаются: поток должен доходить до клиента без буферизации
+    """
+    sync_capable = True
+    async_capable = True
+    # Быстрые уровни: сжатие выполняется на каждый ответ, а не один раз, как для статики
+    BROTLI_QUALITY = 4
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self._compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self._compress(request, await self.get_response(request))
+
+    def _compress(self, request, response):
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or not response.get('Content-Type', '').startswith('application/json')
+            or len(response.content) < settings.RESPONSE_COMPRESSION_MIN_BYTES
+        ):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        available = {'br', 'gzip'} if static_serving.brotli is not None else {'gzip'}
+        encoding = static_serving.choose_encoding(request, available)
+        if encoding == 'br':
+            compressed = static_serving.brotli.compress(response.content, quality=self.BROTLI_QUALITY)
+        elif encoding == 'gzip':
+            compressed = gzip.compress(response.content, compresslevel=settings.RESPONSE_COMPRESSION_LEVEL, mtime=0)
+        else:
+            return response
+        if len(compressed) >= len(response.content):
+            return response
+
+        # Для PerformanceMiddleware: размер ответа учитывается до сжатия
+        response.uncompressed_size = len(response.content)
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # Сжатое тело отличается побайтно: сильный ETag становится слабым
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,192 @@
+"""
+Сбор показателей производительности запросов.
+
+RequestStats заполняется PerformanceMiddleware для одного HTTP-запроса:
+число SQL-запросов, время в БД, время view и рендеринга, размер ответа (до сжатия).
+Время view включает сериализацию (serializer.data вычисляется внутри view):
+отдельно она не измеряется. render - кодирование ответа в JSON рендерером.
+
+SQL считается execute_wrapper'ом, установленным на все соединения (в том числе
+соединения потоков sync_to_async под ASGI): он учитывает запрос в RequestStats
+из contextvar текущего измеряемого запроса, а без измерения сразу выполняет SQL.
+
+RouteStats хранит скользящее окно последних PERF_ROUTE_WINDOW измерений
+по каждому маршруту и считает p50/p95/p99 по запросу.
+"""
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+SQL_CAPTURE_LIMIT = 1000
+
+# RequestStats измеряемого запроса; contextvar переходит и в потоки sync_to_async
+_current_stats = contextvars.ContextVar('perf_request_stats', default=None)
+
+
+class RequestStats:
+    """
+    Показатели одного HTTP-запроса
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.view_finished = None
+        self.render_finished = None
+        self.finished = None
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.statements = []
+        # Размер тела до сжатия JSONCompressionMiddleware
+        self.response_size = 0
+        self._sql_lock = threading.Lock()
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        """execute_wrapper для подсчета SQL-запросов и времени в БД"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            # Под ASGI SQL одного запроса может выполняться в нескольких потоках
+            with self._sql_lock:
+                self.db_time += duration
+                self.db_queries += 1
+                if len(self.statements) < SQL_CAPTURE_LIMIT:
+                    self.statements.append((duration, sql))
+
+    @staticmethod
+    def _ms(start, end):
+        if start is None or end is None:
+            return None
+        return (end - start) * 1000
+
+    @property
+    def total_ms(self):
+        return self._ms(self.started, self.finished)
+
+    @property
+    def db_ms(self):
+        return self.db_time * 1000
+
+    @property
+    def view_ms(self):
+        return self._ms(self.view_started, self.view_finished or self.finished)
+
+    @property
+    def render_ms(self):
+        return self._ms(self.view_finished, self.render_finished)
+
+    def server_timing(self):
+        """Значение заголовка Server-Timing"""
+        parts = [f'db;dur={self.db_ms:.1f};desc="{self.db_queries} queries"']
+        if self.view_ms is not None:
+            parts.append(f'view;dur={self.view_ms:.1f}')
+        if self.render_ms is not None:
+            parts.append(f'render;dur={self.render_ms:.1f}')
+        parts.append(f'total;dur={self.total_ms:.1f}')
+        return ', '.join(parts)
+
+    def slowest_statements(self, limit=10):
+        return sorted(self.statements, key=lambda item: item[0], reverse=True)[:limit]
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats.sql_wrapper(execute, sql, params, many, context)
+
+
+def _install_sql_wrapper(connection, **kwargs):
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+def enable_sql_tracking():
+    """
+    Установить учет SQL на соединения: уже открытые в этом потоке и все новые
+    (в любом потоке) через сигнал connection_created
+    """
+    connection_created.connect(_install_sql_wrapper, dispatch_uid='webbuddy.performance.sql')
+    for connection in connections.all(initialized_only=True):
+        _install_sql_wrapper(connection)
+
+
+def start(stats):
+    """Сделать stats текущим измерением; возвращает токен для finish()"""
+    return _current_stats.set(stats)
+
+
+def finish(token):
+    _current_stats.reset(token)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class RouteStats:
+    """
+    Скользящее окно измерений для одного маршрута
+    """
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, stats):
+        sample = (stats.total_ms, stats.db_ms, stats.db_queries, stats.response_size)
+        with self._lock:
+            self.samples.append(sample)
+            self.count += 1
+
+    def summary(self):
+        with self._lock:
+            samples = list(self.samples)
+            count = self.count
+        if not samples:
+            return {'count': count, 'window': 0}
+
+        totals = sorted(s[0] for s in samples)
+        n = len(samples)
+        return {
+            'count': count,
+            'window': n,
+            'p50_ms': round(percentile(totals, 0.50), 2),
+            'p95_ms': round(percentile(totals, 0.95), 2),
+            'p99_ms': round(percentile(totals, 0.99), 2),
+            'avg_db_ms': round(sum(s[1] for s in samples) / n, 2),
+            'avg_db_queries': round(sum(s[2] for s in samples) / n, 2),
+            'avg_response_bytes': round(sum(s[3] for s in samples) / n),
+        }
+
+
+_routes = {}
+_routes_lock = threading.Lock()
+
+
+def record(route, stats):
+    route_stats = _routes.get(route)
+    if route_stats is None:
+        with _routes_lock:
+            route_stats = _routes.setdefault(route, RouteStats(settings.PERF_ROUTE_WINDOW))
+    route_stats.add(stats)
+
+
+def route_summaries():
+    """
+    Агрегаты по всем маршрутам: {route: {count, p50_ms, p95_ms, p99_ms, ...}}
+    """
+    with _routes_lock:
+        routes = list(_routes.items())
+    return {route: route_stats.summary() for route, route_stats in sorted(routes)}
@@ -0,0 +1,113 @@
+"""
+Профилирование отдельных запросов по требованию администратора.
+
+Запрос профилируется, если в нем есть заголовок ``X-Profile: 1`` или
+параметр ``?_profile=1`` и пользователь - администратор или суперпользователь.
+Запрос выполняется под cProfile, результат сохраняется как pstats-дамп в
+PROFILER_OUTPUT_DIR (открывается через ``python -m pstats``, snakeviz или
+конвертируется во flamegraph через flameprof/gprof2dot).
+"""
+import cProfile
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+
+from users.models import UserRole
+
+PROFILE_NAME_RE = re.compile(r'^[\w.-]+\.prof$')
+FALSE_VALUES = ('', '0', 'false', 'no', 'off')
+
+
+def _is_true(value):
+    return value is not None and value.strip().lower() not in FALSE_VALUES
+
+
+def is_profiling_requested(request):
+    """
+    Маркер профилирования: X-Profile или параметр _profile с истинным значением
+    (?_profile=0 и ?foo_profile=1 - не маркеры). Query string разбирается, только
+    если в ней встречается _profile=
+    """
+    if _is_true(request.META.get('HTTP_X_PROFILE')):
+        return True
+    return '_profile=' in request.META.get('QUERY_STRING', '') and _is_true(request.GET.get('_profile'))
+
+
+def can_profile(user):
+    return bool(user and user.is_authenticated and (user.is_superuser or user.role == UserRole.ADMIN))
+
+
+def get_output_dir():
+    output_dir = Path(settings.PROFILER_OUTPUT_DIR)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return output_dir
+
+
+def _profile_name(request, duration_ms):
+    slug = re.sub(r'[^\w]+', '_', request.path).strip('_')[:80] or 'root'
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return f'{stamp}-{request.method}-{slug}-{int(duration_ms)}ms.prof'
+
+
+def _prune(output_dir):
+    files = sorted(output_dir.glob('*.prof'), key=lambda f: f.stat().st_mtime)
+    for old_file in files[:max(0, len(files) - settings.PROFILER_MAX_FILES)]:
+        old_file.unlink(missing_ok=True)
+
+
+def profile_request(get_response, request):
+    """
+    Выполнить запрос под cProfile и сохранить результат.
+    Возвращает (response, имя файла профиля)
+    """
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    response = profiler.runcall(get_response, request)
+    return response, _save_profile(profiler, request, (time.perf_counter() - start) * 1000)
+
+
+async def profile_request_async(get_response, request):
+    """
+    То же для ASGI. cProfile работает в пределах потока, поэтому в профиль
+    попадает только код в потоке event loop (sync-части через sync_to_async - нет)
+    """
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        response = await get_response(request)
+    finally:
+        profiler.disable()
+    return response, _save_profile(profiler, request, (time.perf_counter() - start) * 1000)
+
+
+def _save_profile(profiler, request, duration_ms):
+    output_dir = get_output_dir()
+    name = _profile_name(request, duration_ms)
+    profiler.dump_stats(str(output_dir / name))
+    _prune(output_dir)
+    return name
+
+
+def list_profiles():
+    output_dir = get_output_dir()
+    profiles = []
+    for profile_file in sorted(output_dir.glob('*.prof'), key=lambda f: f.stat().st_mtime, reverse=True):
+        stat = profile_file.stat()
+        profiles.append({
+            'name': profile_file.name,
+            'size': stat.st_size,
+            'created': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        })
+    return profiles
+
+
+def get_profile_path(name):
+    """Путь к профилю по имени или None (защита от path traversal)"""
+    if not PROFILE_NAME_RE.match(name):
+        return None
+    path = get_output_dir() / name
+    return path if path.is_file() else None
@@ -0,0 +1,75 @@
+"""
+JSON-рендерер и парсер DRF на orjson.
+
+Вывод совпадает с rest_framework.renderers.JSONRenderer (компактный JSON в UTF-8,
+\\u2028/\\u2029 экранируются): типы, которые stdlib-кодировщик DRF выводит по-своему
+(datetime, Decimal, UUID, ленивые строки), передаются в его default().
+orjson указан в requirements.txt; если пакет все же не установлен, а также для ?indent=
+работают классы DRF.
+"""
+from django.conf import settings
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # страховка для окружений без orjson: используется json из stdlib
+    orjson = None
+
+if orjson is not None:
+    DUMPS_OPTIONS = (
+        orjson.OPT_NON_STR_KEYS  # {0: '...'} -> {"0": "..."}, как json.dumps
+        | orjson.OPT_PASSTHROUGH_DATETIME  # datetime форматирует encoders.JSONEncoder, как в DRF
+    )
+
+_LINE_SEPARATOR = '\u2028'.encode()
+_PARAGRAPH_SEPARATOR = '\u2029'.encode()
+_default = encoders.JSONEncoder().default
+
+
+def _request_encoding(parser_context):
+    request = parser_context.get('request')
+    return parser_context.get('encoding') or getattr(request, 'encoding', None) or settings.DEFAULT_CHARSET
+
+
+def dumps(data):
+    """Компактный JSON (bytes) в формате JSONRenderer DRF"""
+    content = orjson.dumps(data, default=_default, option=DUMPS_OPTIONS)
+    if _LINE_SEPARATOR in content or _PARAGRAPH_SEPARATOR in content:
+        content = content.replace(_LINE_SEPARATOR, b'\\u2028').replace(_PARAGRAPH_SEPARATOR, b'\\u2029')
+    return content
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    """JSONRenderer на orjson"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (
+            orjson is None
+            or not self.compact
+            or self.ensure_ascii
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            return dumps(data)
+        except orjson.JSONEncodeError:
+            # Например, целые вне 64 бит: их выводит только json из stdlib
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class ORJSONParser(parsers.JSONParser):
+    """JSONParser на orjson; NaN/Infinity отклоняются, как при STRICT_JSON"""
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = _request_encoding(parser_context or {})
+        if orjson is None or not self.strict or encoding.lower().replace('_', '-') != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,207 @@
+"""
+Раздача статики и index.html React-приложения в production без отдельного веб-сервера.
+
+- collectstatic (CompressedManifestStaticFilesStorage) добавляет к именам файлов хэш
+  содержимого и рядом с каждым сжимаемым файлом кладет .gz и .br (пакет brotli из
+  requirements.txt) - сжатие выполняется один раз при сборке, а не на каждый запрос;
+- serve_static отдает файлы из STATIC_ROOT: готовый сжатый вариант по Accept-Encoding,
+  для файлов с хэшем в имени (сборка Vite в assets/ и хэшированные копии collectstatic) -
+  Cache-Control: immutable на год, для остальных - обязательная ревалидация;
+- index.html читается и сжимается один раз на процесс (SpaIndex) и отдается из памяти
+  с ETag/Last-Modified и Cache-Control: no-cache: браузер сверяет его при каждом заходе
+  и получает новую сборку сразу после перезапуска процессов.
+"""
+import functools
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # страховка для окружений без brotli: отдается только gzip
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {
+    '.css', '.js', '.mjs', '.map', '.html', '.json', '.svg', '.txt', '.xml', '.ico', '.wasm', '.webmanifest',
+}
+# Мелкие файлы не сжимаются: выигрыш меньше накладных расходов
+MIN_COMPRESS_SIZE = 256
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# Сборка Vite добавляет хэш содержимого ко всем файлам в assets/
+HASHED_PREFIXES = ('assets/',)
+
+
+def compress(content):
+    """Сжатые варианты содержимого: {'br': ..., 'gzip': ...}; вариант без выигрыша пропускается"""
+    variants = {}
+    if brotli is not None:
+        variants['br'] = brotli.compress(content, quality=11)
+    variants['gzip'] = gzip.compress(content, compresslevel=9, mtime=0)
+    return {encoding: data for encoding, data in variants.items() if len(data) < len(content) * 0.95}
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding, которые клиент принимает (q > 0)"""
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if name and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def choose_encoding(request, available):
+    """Лучший из доступных вариантов, который принимает клиент: br, затем gzip, иначе None"""
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    for encoding in ('br', 'gzip'):
+        if encoding in available and encoding in accepted:
+            return encoding
+    return None
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage, который после collectstatic сжимает собранные файлы
+    (исходные и хэшированные копии) в соседние .gz/.br
+    """
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if not isinstance(processed, Exception):
+                names.add(name)
+                if hashed_name:
+                    names.add(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                self._write_compressed(name)
+
+    def _write_compressed(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            content = f.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        for encoding, data in compress(content).items():
+            with open(path + ENCODING_SUFFIXES[encoding], 'wb') as f:
+                f.write(data)
+
+    def stored_name(self, name):
+        # До первого collectstatic манифеста нет - ссылки ведут на исходные имена
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+@functools.cache
+def _hashed_names():
+    """Хэшированные имена из манифеста collectstatic (манифест читается при старте процесса)"""
+    return frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def is_hashed(path):
+    return path.startswith(HASHED_PREFIXES) or path in _hashed_names()
+
+
+def serve_static(request, path):
+    """
+    Отдать файл из STATIC_ROOT: предсжатый вариант по Accept-Encoding,
+    immutable-кэширование для файлов с хэшем в имени
+    """
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Static file not found')
+    if not os.path.isfile(fullpath):
+        raise Http404('Static file not found')
+
+    stat = os.stat(fullpath)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        available = {
+            encoding for encoding, suffix in ENCODING_SUFFIXES.items() if os.path.isfile(fullpath + suffix)
+        }
+        encoding = choose_encoding(request, available)
+        content_type, _ = mimetypes.guess_type(fullpath)
+        served = fullpath + ENCODING_SUFFIXES[encoding] if encoding else fullpath
+        response = FileResponse(open(served, 'rb'), content_type=content_type or 'application/octet-stream')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if is_hashed(path) else REVALIDATE_CACHE_CONTROL
+    return response
+
+
+class SpaIndex:
+    """
+    index.html React-приложения в памяти: содержимое, сжатые варианты и ETag.
+    Файл читается один раз на процесс (новая сборка подхватывается после перезапуска);
+    с reload=True - на каждый запрос (DEBUG, пересборка фронтенда без перезапуска)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = None
+
+    def load(self, reload=False):
+        if self._loaded is not None and not reload:
+            return self._loaded
+        with self._lock:
+            if self._loaded is None or reload:
+                try:
+                    with open(self.path, 'rb') as f:
+                        content = f.read()
+                    mtime = os.stat(self.path).st_mtime
+                except FileNotFoundError:
+                    raise Http404('Frontend build not found, run "npm run build" in frontend/')
+                digest = hashlib.sha256(content).hexdigest()[:16]
+                variants = {None: content, **compress(content)}
+                self._loaded = {
+                    'variants': variants,
+                    'etags': {
+                        encoding: f'"{digest}-{encoding}"' if encoding else f'"{digest}"' for encoding in variants
+                    },
+                    'last_modified': http_date(mtime),
+                }
+            return self._loaded
+
+    def response(self, request, reload=False):
+        index = self.load(reload)
+        encoding = choose_encoding(request, index['variants'])
+        etag = index['etags'][encoding]
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(index['variants'][encoding], content_type='text/html; charset=utf-8')
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Last-Modified'] = index['last_modified']
+        response['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+
+spa_index = SpaIndex(settings.BASE_DIR / 'frontend' / 'dist' / 'index.html')
@@ -0,0 +1,105 @@
+"""
+Общие помощники для тестов
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncClient, TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from projects.models import Project
+from queries import admission
+from users.models import User, UserRole
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Реплики из DATABASE_REPLICA_URLS в тестах - зеркала основной тестовой БД (TEST.MIRROR),
+    поэтому чтения идут в основную БД; тесты чтения с реплики подключают свою (webbuddy/tests.py)
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.DATABASE_REPLICAS = []
+
+
+def jwt_client(user):
+    """APIClient, аутентифицированный настоящим JWT (чтобы учитывать запросы аутентификации)"""
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+    return client
+
+
+def jwt_async_client(user):
+    """
+    AsyncClient для async-представлений с тем же JWT.
+    Заголовок задается ASGI-именем: AsyncClient(headers=...) превращает его в HTTP_AUTHORIZATION,
+    который AsyncRequestFactory передает как заголовок http-authorization
+    """
+    return AsyncClient(authorization=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+
+class QueryBudgetMixin:
+    """
+    Проверки бюджета SQL-запросов для тестов API.
+    При превышении бюджета в сообщение об ошибке выводятся все выполненные SQL
+    """
+    @contextmanager
+    def assertQueryBudget(self, budget, label=''):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            statements = '\n'.join(
+                f'{i}. {query["sql"]}' for i, query in enumerate(context.captured_queries, start=1)
+            )
+            self.fail(f'{label or "Request"} executed {executed} SQL queries, budget is {budget}:\n{statements}')
+
+    def assertQueryCountIndependentOf(self, request, grow, label=''):
+        """
+        Число SQL-запросов request() не должно меняться после grow()
+        (например, после добавления строк на страницу)
+        """
+        with CaptureQueriesContext(connection) as before:
+            request()
+        grow()
+        with CaptureQueriesContext(connection) as after:
+            request()
+        if len(after.captured_queries) != len(before.captured_queries):
+            statements = '\n'.join(
+                f'{i}. {query["sql"]}' for i, query in enumerate(after.captured_queries, start=1)
+            )
+            self.fail(
+                f'{label or "Request"} executed {len(before.captured_queries)} SQL queries before and '
+                f'{len(after.captured_queries)} after adding rows:\n{statements}'
+            )
+
+
+@override_settings(PERF_SAMPLE_RATE=0, FASTAPI_URL='http://127.0.0.1:9')
+class ApiTestCase(QueryBudgetMixin, TestCase):
+    """
+    Базовый класс тестов API: проекты Alpha и Beta, пользователи alice (Alpha), bob (Beta)
+    и сервисный аккаунт svc, JWT-клиенты client (alice) и service_client (svc).
+    Измерение производительности выключено, FastAPI недоступен; снимок очереди
+    сбрасывается перед каждым тестом.
+
+    project_fields - дополнительные поля проекта Alpha (например, бюджет токенов)
+    """
+    project_fields = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = Project.objects.create(**{'project_name': 'Alpha', **cls.project_fields})
+        cls.other_project = Project.objects.create(project_name='Beta')
+        cls.user = User.objects.create_user(username='alice', email='alice@example.com', password='x', project=cls.project)
+        cls.other_user = User.objects.create_user(username='bob', email='bob@example.com', password='x', project=cls.other_project)
+        cls.service = User.objects.create_user(username='svc', email='svc@example.com', password='x', role=UserRole.SERVICE)
+
+    def setUp(self):
+        admission.invalidate_queue_snapshot()
+        self.client = jwt_client(self.user)
+        self.service_client = jwt_client(self.service)
@@ -1,11 +1,13 @@
 """
 URL configuration for webbuddy project.
 """
+import re
+
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.conf import settings
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import ReactAppView
+from .views import ReactAppView, route_performance_view, profile_list_view, profile_download_view
 import users.urls
 
 urlpatterns = [
@@ -13,6 +15,9 @@ urlpatterns = [
     path('admin/', admin.site.urls),
 
     # API endpoints
+    path('api/metrics/routes/', route_performance_view, name='route_performance'),
+    path('api/profiles/', profile_list_view, name='profile_list'),
+    path('api/profiles/<str:name>/', profile_download_view, name='profile_download'),
     path('api/', include('queries.urls')),  # Queries API
     path('api/', include('projects.urls')),  # Projects API
     path('api/', include(users.urls.api_urlpatterns)),  # Users API (includes login)
@@ -33,4 +38,12 @@ if settings.DEBUG:
         re_path(r'^(?P<path>vite\.svg)$', serve, {
             'document_root': settings.BASE_DIR / 'frontend' / 'dist',
         }),
-    ] + urlpatterns
\ No newline at end of file
+    ] + urlpatterns
+elif settings.SERVE_STATIC_FILES:
+    # Production: collected files from STATIC_ROOT, precompressed and cached (see webbuddy/static_serving.py)
+    from .static_serving import serve_static
+    urlpatterns = [
+        re_path(r'^(?P<path>assets/.*)$', serve_static),
+        re_path(r'^(?P<path>vite\.svg)$', serve_static),
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')), serve_static),
+    ] + urlpatterns
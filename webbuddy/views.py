@@ -1,17 +1,52 @@
-from django.views.generic import TemplateView
+from django.views.generic import View
 from django.conf import settings
-import os
+from django.http import FileResponse, Http404
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+from users.permissions import HasCrossProjectAccess, IsAdminRole
+from . import performance, profiling
+from .static_serving import spa_index
 
 
-class ReactAppView(TemplateView):
+class ReactAppView(View):
     """
-    Serve React application
+    Serve React application.
+    index.html is kept in memory with revalidation headers; in DEBUG it is re-read
+    on every request so a fresh `npm run build` is picked up without a restart
     """
-    template_name = 'index.html'
 
-    def get_template_names(self):
-        # In production, serve the React build
-        if not settings.DEBUG:
-            return [os.path.join(settings.BASE_DIR, 'frontend', 'dist', 'index.html')]
-        # In development, you would run React dev server separately
-        return [self.template_name]
\ No newline at end of file
+    def get(self, request, *args, **kwargs):
+        return spa_index.response(request, reload=settings.DEBUG)
+
+
+@api_view(['GET'])
+@permission_classes([HasCrossProjectAccess])
+def route_performance_view(request):
+    """
+    Агрегаты PerformanceMiddleware по маршрутам (p50/p95/p99, SQL, размер ответа)
+    """
+    return Response({
+        'sample_rate': settings.PERF_SAMPLE_RATE,
+        'routes': performance.route_summaries(),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminRole])
+def profile_list_view(request):
+    """
+    Список сохраненных профилей запросов (новые первыми)
+    """
+    return Response(profiling.list_profiles())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminRole])
+def profile_download_view(request, name):
+    """
+    Скачать pstats-дамп профиля
+    """
+    path = profiling.get_profile_path(name)
+    if path is None:
+        raise Http404('Profile not found')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
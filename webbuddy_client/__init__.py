@@ -0,0 +1,10 @@
+"""
+Python-клиент WebBuddy для Worker Service (см. WORKER_SERVICE.md).
+
+    from webbuddy_client import WebBuddyClient, AsyncWebBuddyClient
+"""
+from ._common import QueryCancelled, WebBuddyError
+from .client import WebBuddyClient
+from .aio import AsyncWebBuddyClient
+
+__all__ = ['WebBuddyClient', 'AsyncWebBuddyClient', 'WebBuddyError', 'QueryCancelled']
@@ -0,0 +1,193 @@
+"""
+Общая часть синхронного и асинхронного клиентов: ошибки, учетные данные, пути API.
+Модуль не зависит от Django и HTTP-библиотеки.
+"""
+import base64
+import json
+import time
+import uuid
+
+LOGIN_PATH = '/api/login/'
+REFRESH_PATH = '/api/token/refresh/'
+CLAIM_NEXT_PATH = '/api/queries/claim_next/'
+CLAIM_NEXT_WAIT_PATH = '/api/queries/claim_next/wait/'
+QUERIES_PATH = '/api/queries/'
+QUERIES_BULK_PATH = '/api/queries/bulk/'
+LOGS_BULK_PATH = '/api/logs/bulk/'
+TOKEN_USAGE_BULK_PATH = '/api/token-usage/bulk/'
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_POOL_SIZE = 10
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_CLAIM_WAIT = 25.0
+# Запас до истечения access-токена, при котором он обновляется заранее
+REFRESH_MARGIN_SECONDS = 60
+
+
+class WebBuddyError(Exception):
+    """Ошибка ответа WebBuddy API"""
+
+    def __init__(self, status_code, detail):
+        self.status_code = status_code
+        self.detail = detail
+        super().__init__(f'WebBuddy API error {status_code}: {detail}')
+
+
+class QueryCancelled(Exception):
+    """
+    Запрос отменен пользователем - обработку нужно прекратить.
+    Выбрасывается check_cancelled() и при попытке завершить отмененный запрос
+    """
+
+    def __init__(self, query_id):
+        self.query_id = query_id
+        super().__init__(f'Query {query_id} was cancelled')
+
+
+def error_from_response(status_code, text):
+    try:
+        detail = json.loads(text)
+    except ValueError:
+        detail = text
+    return WebBuddyError(status_code, detail)
+
+
+def project_settings_path(project_id=None, with_tokens=False):
+    """Путь к настройкам проекта (см. WORKER_SERVICE.md)"""
+    if project_id and with_tokens:
+        return f'/api/projects/{project_id}/tokens/'
+    if project_id:
+        return f'/api/projects/{project_id}/'
+    if with_tokens:
+        return '/api/projects/my_project_tokens/'
+    return '/api/projects/my_project/'
+
+
+def _jwt_expiry(token):
+    """Время истечения JWT из поля exp (подпись не проверяется - это делает сервер)"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class Credentials:
+    """
+    Учетные данные клиента: API-ключ сервисного аккаунта или логин/пароль (JWT).
+    Сам обмен токенами выполняет клиент, здесь только состояние
+    """
+
+    def __init__(self, username=None, password=None, api_key=None):
+        if api_key is None and not (username and password):
+            raise ValueError('Either api_key or username and password are required')
+        self.username = username
+        self.password = password
+        self.api_key = api_key
+        self.access = None
+        self.refresh = None
+        self.access_expires_at = None
+
+    @property
+    def uses_api_key(self):
+        return self.api_key is not None
+
+    def next_step(self):
+        """Что нужно сделать перед запросом: 'login', 'refresh' или None"""
+        if self.uses_api_key:
+            return None
+        if self.access is None:
+            return 'login' if self.refresh is None else 'refresh'
+        if self.access_expires_at is not None and time.time() >= self.access_expires_at - REFRESH_MARGIN_SECONDS:
+            return 'refresh' if self.refresh else 'login'
+        return None
+
+    def login_payload(self):
+        return {'username': self.username, 'password': self.password}
+
+    def refresh_payload(self):
+        return {'refresh': self.refresh}
+
+    def store(self, data):
+        """Сохранить токены из ответа login/refresh"""
+        self.access = data['access']
+        self.access_expires_at = _jwt_expiry(self.access)
+        if data.get('refresh'):
+            self.refresh = data['refresh']
+
+    def expire(self):
+        """Сбросить access-токен после 401; следующий запрос обновит его"""
+        self.access = None
+
+    def headers(self):
+        if self.uses_api_key:
+            return {'Authorization': f'Api-Key {self.api_key}'}
+        return {'Authorization': f'Bearer {self.access}'}
+
+
+def claim_params(wait):
+    """Путь и параметры claim_next: long-poll при wait > 0"""
+    if wait:
+        return CLAIM_NEXT_WAIT_PATH, {'timeout': wait}
+    return CLAIM_NEXT_PATH, None
+
+
+def log_item(query_id, log_data, project=None, fields=None):
+    """Запись лога; fields - необязательные level, agent, step, payload"""
+    item = {'query': query_id, 'log_data': log_data, **(fields or {})}
+    if project is not None:
+        item['project'] = project
+    return item
+
+
+def token_usage_item(query_id, fields):
+    """Запись использования токенов; started_at/finished_at можно передать как datetime"""
+    item = {key: value.isoformat() if hasattr(value, 'isoformat') else value for key, value in fields.items()}
+    item['query'] = query_id
+    return item
+
+
+def finish_path(query_id, action):
+    """Путь завершения запроса: action - 'complete' или 'fail'"""
+    return f'{QUERIES_PATH}{query_id}/{action}/'
+
+
+def answer_path(query_id):
+    return f'{QUERIES_PATH}{query_id}/answer/'
+
+
+def finish_payload(answer_text, logs, token_usage):
+    """
+    Тело complete/fail: ответ и еще не отправленные логи и записи токенов запроса.
+    answer_text=None - сервер соберет ответ из частей, опубликованных append_answer()
+    """
+    payload = {
+        'logs': [{key: value for key, value in item.items() if key not in ('query', 'project')} for item in logs],
+        'token_usage': [
+            {key: value for key, value in item.items() if key not in ('query', 'project')} for item in token_usage
+        ],
+    }
+    if answer_text is not None:
+        payload['answer_text'] = answer_text
+    return payload
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def is_retryable(error):
+    """
+    Стоит ли повторить запрос с тем же Idempotency-Key: ошибка сервера
+    или 409 - первая попытка с этим ключом еще выполняется
+    """
+    return error.status_code >= 500 or error.status_code == 409
+
+
+def cancelled_queries(response):
+    """Отмененные запросы из ответа пакетной записи логов или токенов"""
+    return (response or {}).get('cancelled_queries', ())
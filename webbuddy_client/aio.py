@@ -0,0 +1,369 @@
+"""
+Асинхронный (asyncio) клиент WebBuddy на httpx.
+
+API повторяет WebBuddyClient: те же методы, но корутины. Логи и использование
+токенов отправляются пачками фоновой задачей в том же event loop.
+"""
+import asyncio
+import logging
+
+import httpx
+
+from . import _common
+from ._common import Credentials, QueryCancelled, WebBuddyError, error_from_response
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBatchWriter:
+    """Асинхронный аналог BatchWriter: фоновая задача отправляет записи пачками"""
+
+    def __init__(self, send, batch_size, flush_interval, name):
+        self._send = send
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = name
+        self._items = []
+        # (ключ, пачка), не отправленная из-за ошибки; повторяется первой и с тем же ключом
+        self._retry = None
+        self._wakeup = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+        self._task = None
+        self._closed = False
+
+    def add(self, item):
+        if self._closed:
+            raise RuntimeError(f'{self.name} writer is closed')
+        self._items.append(item)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if len(self._items) >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self):
+        return len(self._items) + (len(self._retry[1]) if self._retry else 0)
+
+    async def flush(self):
+        async with self._send_lock:
+            while self._retry is not None or self._items:
+                if self._retry is not None:
+                    key, batch = self._retry
+                    self._retry = None
+                else:
+                    key, batch = _common.new_idempotency_key(), self._items[:self.batch_size]
+                    del self._items[:self.batch_size]
+                try:
+                    await self._send(batch, key)
+                except WebBuddyError as e:
+                    if _common.is_retryable(e):
+                        self._retry = (key, batch)
+                        raise
+                    logger.error(f'Dropping {len(batch)} {self.name} records rejected by WebBuddy: {e.detail}')
+                except Exception:
+                    self._retry = (key, batch)
+                    raise
+
+    async def take(self, query_id):
+        """Забрать из буфера неотправленные записи запроса (см. BatchWriter.take)"""
+        while True:
+            async with self._send_lock:
+                if self._retry is None or all(item['query'] != query_id for item in self._retry[1]):
+                    taken = [item for item in self._items if item['query'] == query_id]
+                    self._items = [item for item in self._items if item['query'] != query_id]
+                    return taken
+            await self.flush()
+
+    def requeue(self, items):
+        for item in items:
+            self.add(item)
+
+    async def close(self):
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f'Failed to flush {self.name} records, will retry: {e}')
+
+
+class AsyncWebBuddyClient:
+    """
+    Асинхронный клиент WebBuddy API.
+
+        async with AsyncWebBuddyClient('http://localhost:8000', api_key='wb_...') as client:
+            query = await client.claim_next(wait=25)
+            client.log(query['id'], 'Шаг 1')
+            await client.complete_query(query['id'], 'Ответ')
+
+    Клиент привязан к event loop, в котором впервые использован
+    """
+
+    def __init__(self, base_url, *, username=None, password=None, api_key=None,
+                 pool_size=_common.DEFAULT_POOL_SIZE, timeout=_common.DEFAULT_TIMEOUT,
+                 batch_size=_common.DEFAULT_BATCH_SIZE, flush_interval=_common.DEFAULT_FLUSH_INTERVAL,
+                 retries=3):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.credentials = Credentials(username=username, password=password, api_key=api_key)
+        self._auth_lock = asyncio.Lock()
+        # retries транспорта повторяют только ошибки установки соединения
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=httpx.AsyncHTTPTransport(retries=retries),
+        )
+        self.logs = AsyncBatchWriter(self._send_logs, batch_size, flush_interval, 'log')
+        self.token_usage = AsyncBatchWriter(self._send_token_usage, batch_size, flush_interval, 'token usage')
+        # Запросы, об отмене которых сообщил сервер
+        self._cancelled = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # ---------- аутентификация ----------
+
+    async def login(self):
+        data = await self._post_json(_common.LOGIN_PATH, self.credentials.login_payload())
+        self.credentials.store(data)
+        return data
+
+    async def _refresh(self):
+        try:
+            self.credentials.store(await self._post_json(_common.REFRESH_PATH, self.credentials.refresh_payload()))
+        except WebBuddyError as e:
+            if e.status_code != 401:
+                raise
+            await self.login()
+
+    async def _ensure_auth(self):
+        if self.credentials.next_step() is None:
+            return
+        async with self._auth_lock:
+            step = self.credentials.next_step()
+            if step == 'login':
+                await self.login()
+            elif step == 'refresh':
+                await self._refresh()
+
+    async def _post_json(self, path, payload):
+        response = await self.http.post(path, json=payload)
+        if response.status_code >= 400:
+            raise error_from_response(response.status_code, response.text)
+        return response.json()
+
+    # ---------- HTTP ----------
+
+    async def request(self, method, path, *, allow_404=False, timeout=None, headers=None, **kwargs):
+        for attempt in (1, 2):
+            await self._ensure_auth()
+            access = self.credentials.access
+            response = await self.http.request(
+                method, path, headers={**self.credentials.headers(), **(headers or {})},
+                timeout=timeout or self.timeout, **kwargs
+            )
+            if response.status_code == 401 and attempt == 1 and not self.credentials.uses_api_key:
+                if self.credentials.access == access:
+                    self.credentials.expire()
+                continue
+            break
+        if allow_404 and response.status_code == 404:
+            return None
+        if response.status_code >= 400:
+            raise error_from_response(response.status_code, response.text)
+        if response.status_code == 204 or not response.content:
+            return None
+        return response.json()
+
+    # ---------- запросы ----------
+
+    async def claim_next(self, wait=None):
+        path, params = _common.claim_params(wait)
+        timeout = self.timeout + wait if wait else None
+        return await self.request('POST', path, params=params, allow_404=True, timeout=timeout)
+
+    async def create_query(self, project, query_text, idempotency_key=None):
+        headers = {_common.IDEMPOTENCY_HEADER: idempotency_key} if idempotency_key else None
+        return await self.request(
+            'POST', _common.QUERIES_PATH, json={'project': project, 'query_text': query_text}, headers=headers
+        )
+
+    async def create_queries(self, queries, idempotency_key=None):
+        headers = {_common.IDEMPOTENCY_HEADER: idempotency_key} if idempotency_key else None
+        return await self.request(
+            'POST', _common.QUERIES_BULK_PATH, json={'queries': list(queries)}, headers=headers
+        )
+
+    async def get_query(self, query_id):
+        return await self.request('GET', f'{_common.QUERIES_PATH}{query_id}/')
+
+    async def update_query(self, query_id, **fields):
+        """Обновить запрос; для отмененного запроса выбрасывается QueryCancelled"""
+        try:
+            return await self.request('PATCH', f'{_common.QUERIES_PATH}{query_id}/', json=fields)
+        except WebBuddyError as e:
+            if e.status_code == 409:
+                raise QueryCancelled(query_id) from e
+            raise
+
+    async def cancel_query(self, query_id):
+        """Отменить запрос в очереди или в обработке"""
+        return await self.request('POST', f'{_common.QUERIES_PATH}{query_id}/cancel/')
+
+    async def is_cancelled(self, query_id, refresh=True):
+        """
+        Отменен ли запрос. Отмена, о которой сообщил ответ на пакетную запись логов,
+        известна без обращения к API; refresh=True дополнительно спрашивает статус у сервера
+        """
+        if query_id in self._cancelled:
+            return True
+        if not refresh:
+            return False
+        data = await self.request('GET', f'{_common.QUERIES_PATH}{query_id}/status/')
+        if data['cancelled']:
+            self._cancelled.add(query_id)
+        return data['cancelled']
+
+    async def check_cancelled(self, query_id, refresh=True):
+        """Выбросить QueryCancelled, если запрос отменен (вызывается между шагами агентов)"""
+        if await self.is_cancelled(query_id, refresh=refresh):
+            raise QueryCancelled(query_id)
+
+    async def append_answer(self, query_id, text):
+        try:
+            return await self.request('POST', _common.answer_path(query_id), json={'text': text})
+        except WebBuddyError as e:
+            if e.status_code == 409:
+                raise QueryCancelled(query_id) from e
+            raise
+
+    async def complete_query(self, query_id, answer_text=None):
+        return await self._finish_query(query_id, 'complete', answer_text)
+
+    async def fail_query(self, query_id, error):
+        return await self._finish_query(query_id, 'fail', f'Ошибка: {error}')
+
+    async def _finish_query(self, query_id, action, answer_text):
+        logs, token_usage = await self.logs.take(query_id), await self.token_usage.take(query_id)
+        try:
+            return await self.request(
+                'POST', _common.finish_path(query_id, action),
+                json=_common.finish_payload(answer_text, logs, token_usage)
+            )
+        except Exception as e:
+            # Запрос не завершен (в том числе отменен): логи и токены уйдут обычными пачками
+            self.logs.requeue(logs)
+            self.token_usage.requeue(token_usage)
+            if isinstance(e, WebBuddyError) and e.status_code == 409:
+                raise QueryCancelled(query_id) from e
+            raise
+
+    async def get_project_settings(self, project_id=None, with_tokens=False):
+        return await self.request('GET', _common.project_settings_path(project_id, with_tokens))
+
+    # ---------- логи и токены ----------
+
+    def log(self, query_id, log_data, project=None, **fields):
+        self.logs.add(_common.log_item(query_id, log_data, project, fields))
+
+    def log_token_usage(self, query_id, **fields):
+        self.token_usage.add(_common.token_usage_item(query_id, fields))
+
+    async def _send_logs(self, batch, key):
+        response = await self.request(
+            'POST', _common.LOGS_BULK_PATH, json=batch, headers={_common.IDEMPOTENCY_HEADER: key}
+        )
+        self._cancelled.update(_common.cancelled_queries(response))
+
+    async def _send_token_usage(self, batch, key):
+        response = await self.request(
+            'POST', _common.TOKEN_USAGE_BULK_PATH, json=batch, headers={_common.IDEMPOTENCY_HEADER: key}
+        )
+        self._cancelled.update(_common.cancelled_queries(response))
+
+    async def flush(self):
+        await self.logs.flush()
+        await self.token_usage.flush()
+
+    async def close(self):
+        await self.logs.close()
+        await self.token_usage.close()
+        await self.http.aclose()
+
+    # ---------- цикл воркера ----------
+
+    async def process(self, handler, query):
+        """Обработать один запрос корутиной handler(client, query); см. WebBuddyClient.process"""
+        try:
+            try:
+                answer = await handler(self, query)
+            except QueryCancelled:
+                raise
+            except Exception as e:
+                logger.exception(f"Query {query['id']} failed")
+                self.log(query['id'], f'Ошибка: {e}', level='error')
+                await self.fail_query(query['id'], e)
+                return
+            if answer is not None:
+                await self.complete_query(query['id'], answer)
+        except QueryCancelled:
+            logger.info(f"Query {query['id']} was cancelled")
+        finally:
+            self._cancelled.discard(query['id'])
+
+    async def run_worker(self, handler, *, concurrency=4, wait=_common.DEFAULT_CLAIM_WAIT,
+                         stop_event=None, error_backoff=5.0):
+        """
+        Обрабатывать запросы в concurrency задачах, пока не выставлен stop_event (asyncio.Event).
+        Новый запрос берется только свободной задачей. Ошибка API или сети при захвате
+        или завершении запроса не останавливает задачу (пауза error_backoff секунд),
+        а непредвиденная ошибка одной задачи не отменяет остальные
+        """
+        stop_event = stop_event or asyncio.Event()
+
+        async def backoff():
+            try:
+                await asyncio.wait_for(stop_event.wait(), error_backoff)
+            except asyncio.TimeoutError:
+                pass
+
+        async def slot():
+            while not stop_event.is_set():
+                try:
+                    query = await self.claim_next(wait=wait)
+                except (WebBuddyError, httpx.HTTPError) as e:
+                    logger.warning(f'claim_next failed: {e}')
+                    await backoff()
+                    continue
+                if query is None:
+                    continue
+                try:
+                    await self.process(handler, query)
+                except (WebBuddyError, httpx.HTTPError) as e:
+                    logger.warning(f"Query {query['id']} could not be finished: {e}")
+                    await backoff()
+
+        try:
+            results = await asyncio.gather(*(slot() for _ in range(concurrency)), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error('Worker slot stopped', exc_info=result)
+        finally:
+            await self.flush()
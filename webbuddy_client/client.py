@@ -0,0 +1,449 @@
+"""
+Синхронный клиент WebBuddy для Worker Service.
+
+- одно keep-alive соединение на поток из пула requests.Session;
+- JWT получается и обновляется автоматически (или используется API-ключ);
+- логи и использование токенов копятся в памяти и отправляются пачками
+  фоновым потоком через /api/logs/bulk/ и /api/token-usage/bulk/;
+- complete_query()/fail_query() завершают запрос одним вызовом вместе с еще
+  не отправленными логами и токенами этого запроса;
+- run_worker() берет запросы не больше, чем может обработать одновременно.
+"""
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import _common
+from ._common import Credentials, QueryCancelled, WebBuddyError, error_from_response
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """
+    Буфер записей, который фоновый поток отправляет пачками:
+    раз в flush_interval секунд или сразу при накоплении batch_size записей.
+    Порядок записей сохраняется. Каждая пачка отправляется с заголовком Idempotency-Key:
+    пачка, ответ на которую потерян, при повторе не запишется дважды. Ошибки 4xx
+    не исправятся повтором - такая пачка отбрасывается с записью в лог; при прочих
+    ошибках пачка с тем же ключом ждет следующей попытки
+    """
+
+    def __init__(self, send, batch_size, flush_interval, name):
+        self._send = send
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = name
+        self._items = []
+        # (ключ, пачка), не отправленная из-за ошибки; повторяется первой и с тем же ключом
+        self._retry = None
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def add(self, item):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f'{self.name} writer is closed')
+            self._items.append(item)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f'webbuddy-{self.name}-writer', daemon=True
+                )
+                self._thread.start()
+            if len(self._items) >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._items) + (len(self._retry[1]) if self._retry else 0)
+
+    def flush(self):
+        """Отправить все накопленные записи в текущем потоке"""
+        with self._send_lock:
+            while True:
+                with self._cond:
+                    if self._retry is not None:
+                        key, batch = self._retry
+                        self._retry = None
+                    else:
+                        key, batch = _common.new_idempotency_key(), self._items[:self.batch_size]
+                        del self._items[:self.batch_size]
+                if not batch:
+                    return
+                try:
+                    self._send(batch, key)
+                except WebBuddyError as e:
+                    if _common.is_retryable(e):
+                        self._keep_for_retry(key, batch)
+                        raise
+                    logger.error(f'Dropping {len(batch)} {self.name} records rejected by WebBuddy: {e.detail}')
+                except Exception:
+                    self._keep_for_retry(key, batch)
+                    raise
+
+    def take(self, query_id):
+        """
+        Забрать из буфера неотправленные записи запроса - они уйдут вместе с его завершением.
+        Отправляемая в этот момент пачка дописывается первой; если записи запроса ждут
+        повторной отправки, сначала отправляется она - порядок записей сохраняется
+        """
+        with self._send_lock:
+            with self._cond:
+                if self._retry is None or all(item['query'] != query_id for item in self._retry[1]):
+                    taken = [item for item in self._items if item['query'] == query_id]
+                    self._items = [item for item in self._items if item['query'] != query_id]
+                    return taken
+        self.flush()
+        return self.take(query_id)
+
+    def requeue(self, items):
+        """Вернуть в буфер записи, взятые take(), если завершить запрос не удалось"""
+        for item in items:
+            self.add(item)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _keep_for_retry(self, key, batch):
+        with self._cond:
+            self._retry = (key, batch)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._items) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f'Failed to flush {self.name} records, will retry: {e}')
+            if closed:
+                return
+
+
+class WebBuddyClient:
+    """
+    Клиент WebBuddy API.
+
+        client = WebBuddyClient('http://localhost:8000', api_key='wb_...')
+        query = client.claim_next(wait=25)
+        client.log(query['id'], 'Шаг 1')
+        client.check_cancelled(query['id'])
+        client.complete_query(query['id'], 'Ответ')
+        client.close()
+
+    Методы безопасно вызывать из нескольких потоков
+    """
+
+    def __init__(self, base_url, *, username=None, password=None, api_key=None,
+                 pool_size=_common.DEFAULT_POOL_SIZE, timeout=_common.DEFAULT_TIMEOUT,
+                 batch_size=_common.DEFAULT_BATCH_SIZE, flush_interval=_common.DEFAULT_FLUSH_INTERVAL,
+                 retries=3):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.credentials = Credentials(username=username, password=password, api_key=api_key)
+        self._auth_lock = threading.Lock()
+
+        self.session = requests.Session()
+        # Повторяются только ошибки установки соединения: запрос до сервера не дошел
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, connect=retries, read=0, status=0, redirect=0, backoff_factor=0.2)
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.logs = BatchWriter(self._send_logs, batch_size, flush_interval, 'log')
+        self.token_usage = BatchWriter(self._send_token_usage, batch_size, flush_interval, 'token usage')
+        # Запросы, об отмене которых сообщил сервер
+        self._cancelled = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ---------- аутентификация ----------
+
+    def login(self):
+        """Получить пару JWT-токенов по логину и паролю"""
+        data = self._post_json(_common.LOGIN_PATH, self.credentials.login_payload())
+        self.credentials.store(data)
+        return data
+
+    def _refresh(self):
+        try:
+            self.credentials.store(self._post_json(_common.REFRESH_PATH, self.credentials.refresh_payload()))
+        except WebBuddyError as e:
+            if e.status_code != 401:
+                raise
+            # Refresh-токен истек - входим заново
+            self.login()
+
+    def _ensure_auth(self):
+        if self.credentials.next_step() is None:
+            return
+        with self._auth_lock:
+            step = self.credentials.next_step()
+            if step == 'login':
+                self.login()
+            elif step == 'refresh':
+                self._refresh()
+
+    def _post_json(self, path, payload):
+        response = self.session.post(self.base_url + path, json=payload, timeout=self.timeout)
+        if response.status_code >= 400:
+            raise error_from_response(response.status_code, response.text)
+        return response.json()
+
+    # ---------- HTTP ----------
+
+    def request(self, method, path, *, allow_404=False, timeout=None, headers=None, **kwargs):
+        """
+        Выполнить запрос к API и вернуть JSON ответа.
+        При 401 токен обновляется и запрос повторяется один раз
+        """
+        for attempt in (1, 2):
+            self._ensure_auth()
+            access = self.credentials.access
+            response = self.session.request(
+                method, self.base_url + path, headers={**self.credentials.headers(), **(headers or {})},
+                timeout=timeout or self.timeout, **kwargs
+            )
+            if response.status_code == 401 and attempt == 1 and not self.credentials.uses_api_key:
+                with self._auth_lock:
+                    if self.credentials.access == access:
+                        self.credentials.expire()
+                continue
+            break
+        if allow_404 and response.status_code == 404:
+            return None
+        if response.status_code >= 400:
+            raise error_from_response(response.status_code, response.text)
+        if response.status_code == 204 or not response.content:
+            return None
+        return response.json()
+
+    # ---------- запросы ----------
+
+    def claim_next(self, wait=None):
+        """
+        Взять следующий запрос из очереди.
+        wait - сколько секунд ждать появления запроса (long-poll); None - не ждать.
+        Возвращает запрос или None, если очередь пуста
+        """
+        path, params = _common.claim_params(wait)
+        timeout = self.timeout + wait if wait else None
+        return self.request('POST', path, params=params, allow_404=True, timeout=timeout)
+
+    def create_query(self, project, query_text, idempotency_key=None):
+        """
+        Создать запрос. С idempotency_key повтор вызова (например, после таймаута)
+        вернет уже созданный запрос вместо нового
+        """
+        headers = {_common.IDEMPOTENCY_HEADER: idempotency_key} if idempotency_key else None
+        return self.request(
+            'POST', _common.QUERIES_PATH, json={'project': project, 'query_text': query_text}, headers=headers
+        )
+
+    def create_queries(self, queries, idempotency_key=None):
+        """
+        Создать пакет запросов одним вызовом: queries - список {"project": id, "query_text": "..."}.
+        Возвращает {"created": N, "ids": [...]} с id в порядке пакета
+        """
+        headers = {_common.IDEMPOTENCY_HEADER: idempotency_key} if idempotency_key else None
+        return self.request('POST', _common.QUERIES_BULK_PATH, json={'queries': list(queries)}, headers=headers)
+
+    def get_query(self, query_id):
+        return self.request('GET', f'{_common.QUERIES_PATH}{query_id}/')
+
+    def update_query(self, query_id, **fields):
+        """Обновить запрос; для отмененного запроса выбрасывается QueryCancelled"""
+        try:
+            return self.request('PATCH', f'{_common.QUERIES_PATH}{query_id}/', json=fields)
+        except WebBuddyError as e:
+            if e.status_code == 409:
+                raise QueryCancelled(query_id) from e
+            raise
+
+    def cancel_query(self, query_id):
+        """Отменить запрос в очереди или в обработке"""
+        return self.request('POST', f'{_common.QUERIES_PATH}{query_id}/cancel/')
+
+    def is_cancelled(self, query_id, refresh=True):
+        """
+        Отменен ли запрос. Отмена, о которой сообщил ответ на пакетную запись логов,
+        известна без обращения к API; refresh=True дополнительно спрашивает статус у сервера
+        """
+        if query_id in self._cancelled:
+            return True
+        if not refresh:
+            return False
+        data = self.request('GET', f'{_common.QUERIES_PATH}{query_id}/status/')
+        if data['cancelled']:
+            self._cancelled.add(query_id)
+        return data['cancelled']
+
+    def check_cancelled(self, query_id, refresh=True):
+        """Выбросить QueryCancelled, если запрос отменен (вызывается между шагами агентов)"""
+        if self.is_cancelled(query_id, refresh=refresh):
+            raise QueryCancelled(query_id)
+
+    def append_answer(self, query_id, text):
+        """
+        Опубликовать следующую часть ответа: пользователь видит ее до завершения запроса.
+        Строка запроса не перезаписывается; итоговый ответ соберется из частей
+        при complete_query(query_id) без answer_text
+        """
+        try:
+            return self.request('POST', _common.answer_path(query_id), json={'text': text})
+        except WebBuddyError as e:
+            if e.status_code == 409:
+                raise QueryCancelled(query_id) from e
+            raise
+
+    def complete_query(self, query_id, answer_text=None):
+        """
+        Завершить запрос статусом done одним вызовом: ответ уходит вместе с еще не
+        отправленными логами и записями токенов запроса и записывается одной транзакцией.
+        Без answer_text ответ собирается из частей, опубликованных append_answer()
+        """
+        return self._finish_query(query_id, 'complete', answer_text)
+
+    def fail_query(self, query_id, error):
+        """Завершить запрос статусом failed одним вызовом (см. complete_query)"""
+        return self._finish_query(query_id, 'fail', f'Ошибка: {error}')
+
+    def _finish_query(self, query_id, action, answer_text):
+        logs, token_usage = self.logs.take(query_id), self.token_usage.take(query_id)
+        try:
+            return self.request(
+                'POST', _common.finish_path(query_id, action),
+                json=_common.finish_payload(answer_text, logs, token_usage)
+            )
+        except Exception as e:
+            # Запрос не завершен (в том числе отменен): логи и токены уйдут обычными пачками
+            self.logs.requeue(logs)
+            self.token_usage.requeue(token_usage)
+            if isinstance(e, WebBuddyError) and e.status_code == 409:
+                raise QueryCancelled(query_id) from e
+            raise
+
+    def get_project_settings(self, project_id=None, with_tokens=False):
+        return self.request('GET', _common.project_settings_path(project_id, with_tokens))
+
+    # ---------- логи и токены ----------
+
+    def log(self, query_id, log_data, project=None, **fields):
+        """Поставить лог в очередь на пакетную отправку; fields - level, agent, step, payload"""
+        self.logs.add(_common.log_item(query_id, log_data, project, fields))
+
+    def log_token_usage(self, query_id, **fields):
+        """
+        Поставить запись использования токенов в очередь на пакетную отправку.
+        Задержка вызова модели: duration_ms (или started_at и finished_at) и time_to_first_token_ms
+        """
+        self.token_usage.add(_common.token_usage_item(query_id, fields))
+
+    def _send_logs(self, batch, key):
+        response = self.request(
+            'POST', _common.LOGS_BULK_PATH, json=batch, headers={_common.IDEMPOTENCY_HEADER: key}
+        )
+        self._cancelled.update(_common.cancelled_queries(response))
+
+    def _send_token_usage(self, batch, key):
+        response = self.request(
+            'POST', _common.TOKEN_USAGE_BULK_PATH, json=batch, headers={_common.IDEMPOTENCY_HEADER: key}
+        )
+        self._cancelled.update(_common.cancelled_queries(response))
+
+    def flush(self):
+        """Отправить все накопленные логи и записи токенов"""
+        self.logs.flush()
+        self.token_usage.flush()
+
+    def close(self):
+        self.logs.close()
+        self.token_usage.close()
+        self.session.close()
+
+    # ---------- цикл воркера ----------
+
+    def process(self, handler, query):
+        """
+        Обработать один запрос: handler(client, query) возвращает текст ответа.
+        Если handler вернул None, он сам завершил запрос.
+        Исключение handler переводит запрос в failed; QueryCancelled (см. check_cancelled)
+        просто прекращает обработку - запрос уже отменен пользователем
+        """
+        try:
+            try:
+                answer = handler(self, query)
+            except QueryCancelled:
+                raise
+            except Exception as e:
+                logger.exception(f"Query {query['id']} failed")
+                self.log(query['id'], f'Ошибка: {e}', level='error')
+                self.fail_query(query['id'], e)
+                return
+            if answer is not None:
+                self.complete_query(query['id'], answer)
+        except QueryCancelled:
+            logger.info(f"Query {query['id']} was cancelled")
+        finally:
+            self._cancelled.discard(query['id'])
+
+    def run_worker(self, handler, *, concurrency=4, wait=_common.DEFAULT_CLAIM_WAIT,
+                   stop_event=None, error_backoff=5.0):
+        """
+        Обрабатывать запросы из очереди в concurrency потоках, пока не выставлен stop_event.
+        Каждый поток берет новый запрос только после завершения предыдущего, поэтому
+        воркер никогда не держит больше concurrency запросов в статусе in_progress.
+        Ошибка API или сети при захвате или завершении запроса не останавливает поток:
+        он ждет error_backoff секунд и берет следующий запрос
+        """
+        stop_event = stop_event or threading.Event()
+
+        def slot():
+            while not stop_event.is_set():
+                try:
+                    query = self.claim_next(wait=wait)
+                except (WebBuddyError, requests.RequestException) as e:
+                    logger.warning(f'claim_next failed: {e}')
+                    stop_event.wait(error_backoff)
+                    continue
+                if query is None:
+                    continue
+                try:
+                    self.process(handler, query)
+                except (WebBuddyError, requests.RequestException) as e:
+                    logger.warning(f"Query {query['id']} could not be finished: {e}")
+                    stop_event.wait(error_backoff)
+
+        threads = [
+            threading.Thread(target=slot, name=f'webbuddy-worker-{i}', daemon=True)
+            for i in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.flush()
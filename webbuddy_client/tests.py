@@ -0,0 +1,298 @@
+"""
+Сквозные тесты клиента против WebBuddy, запущенного LiveServerTestCase
+"""
+import asyncio
+import threading
+from datetime import timedelta
+from unittest import mock
+
+import httpx
+from django.test import LiveServerTestCase, SimpleTestCase, override_settings
+from django.utils import timezone
+
+from projects.models import Project
+from queries import admission
+from queries.models import Query, QueryLog, TokenUsageLog
+from users.api_keys import issue_api_key
+from users.models import User, UserRole
+from . import AsyncWebBuddyClient, QueryCancelled, WebBuddyClient, WebBuddyError
+from .client import BatchWriter
+
+TOKEN_USAGE = {
+    'ai_agent_name': 'planner', 'request_to_ai_agent': 'req', 'ai_agent_answer': 'ans',
+    'model_name': 'gpt-4o', 'model_role': 'assistant',
+    'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15,
+}
+
+
+class SerializedStaticFilesHandler(LiveServerTestCase.static_handler):
+    """
+    Потоки живого сервера делят одно соединение с in-memory SQLite тестов:
+    запросы выполняются по одному, иначе транзакции параллельных запросов
+    (claim_next, завершение запроса) пересекаются на общем соединении
+    """
+    lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self.lock:
+            return super().__call__(environ, start_response)
+
+
+@override_settings(PERF_SAMPLE_RATE=0, FASTAPI_URL='http://127.0.0.1:9')
+class WorkerClientEndToEndTests(LiveServerTestCase):
+    static_handler = SerializedStaticFilesHandler
+
+    def setUp(self):
+        admission.invalidate_queue_snapshot()
+        self.project = Project.objects.create(project_name='Alpha')
+        User.objects.create_user(username='alice', email='alice@example.com', password='pw', project=self.project)
+        service = User.objects.create_user(username='worker', email='worker@example.com', password='pw', role=UserRole.SERVICE)
+        _, self.api_key = issue_api_key(service, name='e2e')
+
+    def submit(self, count):
+        with WebBuddyClient(self.live_server_url, username='alice', password='pw') as client:
+            return client.create_queries(
+                {'project': self.project.id, 'query_text': f'Query {i}'} for i in range(count)
+            )['ids']
+
+    def assert_processed(self, query_ids):
+        for query in Query.objects.filter(id__in=query_ids):
+            self.assertEqual(query.status, 'done')
+            self.assertEqual(query.answer_text, f'Answer to {query.query_text}')
+            self.assertIsNotNone(query.query_finished)
+            self.assertEqual(
+                list(QueryLog.objects.filter(query=query).order_by('id').values_list('log_data', flat=True)),
+                ['step 1', 'step 2']
+            )
+        self.assertEqual(TokenUsageLog.objects.filter(query_id__in=query_ids).count(), len(query_ids))
+
+    def test_sync_worker_processes_queue(self):
+        query_ids = self.submit(5)
+        stop = threading.Event()
+        processed = []
+        lock = threading.Lock()
+
+        def handler(client, query):
+            client.log(query['id'], 'step 1')
+            client.log(query['id'], 'step 2')
+            started_at = timezone.now()
+            client.log_token_usage(
+                query['id'], started_at=started_at, finished_at=started_at + timedelta(milliseconds=1500),
+                time_to_first_token_ms=200, **TOKEN_USAGE
+            )
+            with lock:
+                processed.append(query['id'])
+                if len(processed) == len(query_ids):
+                    stop.set()
+            return f"Answer to {query['query_text']}"
+
+        with WebBuddyClient(self.live_server_url, api_key=self.api_key, batch_size=3, flush_interval=0.1) as worker:
+            worker.run_worker(handler, concurrency=2, wait=1, stop_event=stop)
+
+        self.assertCountEqual(processed, query_ids)
+        self.assert_processed(query_ids)
+        self.assertEqual(
+            set(TokenUsageLog.objects.filter(query_id__in=query_ids).values_list('duration_ms', flat=True)), {1500}
+        )
+
+    def test_async_worker_processes_queue(self):
+        query_ids = self.submit(4)
+
+        async def main():
+            stop = asyncio.Event()
+            processed = []
+
+            async def handler(client, query):
+                client.log(query['id'], 'step 1')
+                client.log(query['id'], 'step 2')
+                client.log_token_usage(query['id'], **TOKEN_USAGE)
+                processed.append(query['id'])
+                if len(processed) == len(query_ids):
+                    stop.set()
+                return f"Answer to {query['query_text']}"
+
+            async with AsyncWebBuddyClient(self.live_server_url, api_key=self.api_key, flush_interval=0.1) as worker:
+                await worker.run_worker(handler, concurrency=2, wait=1, stop_event=stop)
+            return processed
+
+        self.assertCountEqual(asyncio.run(main()), query_ids)
+        self.assert_processed(query_ids)
+
+    def test_sync_worker_survives_finish_errors(self):
+        first_id, second_id = self.submit(2)
+        stop = threading.Event()
+        claimed = []
+
+        def handler(client, query):
+            claimed.append(query['id'])
+            if len(claimed) == 2:
+                stop.set()
+            return 'ok'
+
+        with WebBuddyClient(self.live_server_url, api_key=self.api_key) as worker:
+            complete_query = worker.complete_query
+            calls = []
+
+            def flaky_complete(query_id, answer_text=None):
+                calls.append(query_id)
+                if len(calls) == 1:
+                    raise WebBuddyError(503, 'Service Unavailable')
+                return complete_query(query_id, answer_text)
+
+            with mock.patch.object(worker, 'complete_query', side_effect=flaky_complete), \
+                    self.assertLogs('webbuddy_client.client', 'WARNING') as logs:
+                worker.run_worker(handler, concurrency=1, wait=1, stop_event=stop, error_backoff=0)
+
+        self.assertEqual(claimed, [first_id, second_id])
+        self.assertIn(f'Query {first_id} could not be finished', logs.output[0])
+        self.assertEqual(Query.objects.get(id=first_id).status, 'in_progress')
+        self.assertEqual(Query.objects.get(id=second_id).status, 'done')
+
+    def test_async_worker_survives_finish_errors(self):
+        first_id, second_id = self.submit(2)
+
+        async def main():
+            stop = asyncio.Event()
+            claimed = []
+
+            async def handler(client, query):
+                claimed.append(query['id'])
+                if len(claimed) == 2:
+                    stop.set()
+                if query['id'] == first_id:
+                    raise RuntimeError('boom')
+                return 'ok'
+
+            async with AsyncWebBuddyClient(self.live_server_url, api_key=self.api_key) as worker:
+                fail_query = mock.AsyncMock(side_effect=httpx.ConnectError('connection reset'))
+                with mock.patch.object(worker, 'fail_query', fail_query), \
+                        self.assertLogs('webbuddy_client.aio', 'WARNING') as logs:
+                    await worker.run_worker(handler, concurrency=2, wait=1, stop_event=stop, error_backoff=0)
+            return claimed, logs.output
+
+        claimed, output = asyncio.run(main())
+        self.assertCountEqual(claimed, [first_id, second_id])
+        self.assertTrue(any(f'Query {first_id} could not be finished' in line for line in output))
+        self.assertEqual(Query.objects.get(id=second_id).status, 'done')
+
+    def test_handler_error_fails_query(self):
+        query_id, = self.submit(1)
+
+        def handler(client, query):
+            raise RuntimeError('boom')
+
+        with WebBuddyClient(self.live_server_url, api_key=self.api_key) as worker:
+            with self.assertLogs('webbuddy_client.client', 'ERROR'):
+                worker.process(handler, worker.claim_next())
+
+        query = Query.objects.get(id=query_id)
+        self.assertEqual(query.status, 'failed')
+        self.assertIn('boom', query.answer_text)
+        self.assertTrue(QueryLog.objects.filter(query=query, log_data__contains='boom').exists())
+
+    def test_cancelled_query_stops_handler(self):
+        query_id, = self.submit(1)
+        steps = []
+
+        def handler(client, query):
+            client.log(query['id'], 'step 1')
+            with WebBuddyClient(self.live_server_url, username='alice', password='pw') as user_client:
+                user_client.cancel_query(query['id'])
+            # Об отмене сообщает ответ на пакетную запись логов - без отдельного запроса статуса
+            client.flush()
+            self.assertTrue(client.is_cancelled(query['id'], refresh=False))
+            steps.append('checked')
+            client.check_cancelled(query['id'])
+            steps.append('unreachable')
+
+        with WebBuddyClient(self.live_server_url, api_key=self.api_key) as worker:
+            worker.process(handler, worker.claim_next())
+            self.assertEqual(steps, ['checked'])
+            with self.assertRaises(QueryCancelled):
+                worker.complete_query(query_id, 'late answer')
+            self.assertTrue(worker.is_cancelled(query_id))
+
+        query = Query.objects.get(id=query_id)
+        self.assertEqual(query.status, 'cancelled')
+        self.assertEqual(query.answer_text, '')
+
+    def test_complete_sends_pending_records_with_answer(self):
+        query_id, = self.submit(1)
+        with WebBuddyClient(self.live_server_url, api_key=self.api_key, flush_interval=60) as worker:
+            worker.claim_next()
+            worker.log(query_id, 'step 1')
+            worker.log_token_usage(query_id, **TOKEN_USAGE)
+            response = worker.complete_query(query_id, 'Ответ')
+            # Логи и токены ушли вместе с ответом, а не отдельными пачками
+            self.assertEqual((worker.logs.pending(), worker.token_usage.pending()), (0, 0))
+        self.assertEqual((response['status'], response['logs_count']), ('done', 1))
+        self.assertEqual(TokenUsageLog.objects.get(query_id=query_id).total_tokens, 15)
+
+    def test_streamed_answer(self):
+        query_id, = self.submit(1)
+        with WebBuddyClient(self.live_server_url, api_key=self.api_key) as worker:
+            worker.claim_next()
+            worker.append_answer(query_id, 'Часть 1. ')
+            worker.append_answer(query_id, 'Часть 2.')
+            response = worker.complete_query(query_id)
+        self.assertEqual(response['answer_text'], 'Часть 1. Часть 2.')
+
+    def test_background_flush_without_explicit_flush(self):
+        query_id, = self.submit(1)
+        with WebBuddyClient(self.live_server_url, api_key=self.api_key, batch_size=2, flush_interval=60) as worker:
+            worker.log(query_id, 'a')
+            worker.log(query_id, 'b')
+            # batch_size достигнут - пачка уходит фоновым потоком, не дожидаясь flush_interval
+            for _ in range(50):
+                if worker.logs.pending() == 0 and QueryLog.objects.filter(query_id=query_id).count() == 2:
+                    break
+                threading.Event().wait(0.1)
+            self.assertEqual(QueryLog.objects.filter(query_id=query_id).count(), 2)
+
+    def test_jwt_login_and_refresh(self):
+        client = WebBuddyClient(self.live_server_url, username='alice', password='pw')
+        self.addCleanup(client.close)
+        self.assertIsNone(client.claim_next())  # обычный пользователь: очередь своего проекта пуста
+        self.assertIsNotNone(client.credentials.refresh)
+
+        # Отозванный/испорченный access-токен: клиент обновляет его и повторяет запрос
+        client.credentials.access = 'broken'
+        self.assertEqual(client.get_project_settings()['project_name'], 'Alpha')
+        self.assertNotEqual(client.credentials.access, 'broken')
+
+        # Истекающий access-токен обновляется заранее
+        client.credentials.access_expires_at = 0
+        access = client.credentials.access
+        client.get_project_settings()
+        self.assertNotEqual(client.credentials.access, access)
+
+    def test_invalid_credentials(self):
+        with WebBuddyClient(self.live_server_url, username='alice', password='wrong') as client:
+            with self.assertRaises(WebBuddyError) as context:
+                client.get_project_settings()
+        self.assertEqual(context.exception.status_code, 401)
+
+
+class BatchWriterTests(SimpleTestCase):
+
+    def test_failed_batch_is_retried_with_same_key(self):
+        sent = []
+
+        def send(batch, key):
+            sent.append((key, list(batch)))
+            if len(sent) == 1:
+                raise ConnectionError('response lost')
+
+        writer = BatchWriter(send, batch_size=10, flush_interval=60, name='log')
+        writer._items = ['a', 'b']
+        with self.assertRaises(ConnectionError):
+            writer.flush()
+        writer._items.append('c')
+        self.assertEqual(writer.pending(), 3)
+        writer.flush()
+
+        # Повтор - та же пачка с тем же ключом, новые записи уходят отдельной пачкой
+        self.assertEqual(sent[1], sent[0])
+        self.assertEqual(sent[2][1], ['c'])
+        self.assertNotEqual(sent[2][0], sent[0][0])
+        self.assertEqual(writer.pending(), 0)